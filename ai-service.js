@@ -94,8 +94,10 @@ class AIService {
     } catch (error) {
       console.error(`❌ خطأ في ${provider}:`, error.message);
 
-      // إرجاع استجابة بديلة في حالة الفشل
-      return `عذراً، حدث خطأ مع ${provider}: ${error.message}. يرجى المحاولة مرة أخرى أو استخدام مزود آخر.`;
+      // رفع الخطأ بدلاً من إرجاع رسالة اعتذار كأنها رد ناجح، حتى لا يخزنها العملاء مؤقتاً كنتيجة
+      const providerError = new Error(`عذراً، حدث خطأ مع ${provider}: ${error.message}. يرجى المحاولة مرة أخرى أو استخدام مزود آخر.`);
+      providerError.statusCode = 502;
+      throw providerError;
     }
   }
 
@@ -258,7 +260,7 @@ class AIService {
       },
       body: JSON.stringify({
         model: model,
-        messages: [{ role: 'user', content: message }],
+        messages: options.messages || [{ role: 'user', content: message }],
         max_tokens: options.maxTokens || 2000,
         temperature: options.temperature || (isCodeRequest ? 0.1 : 0.7),
         stream: false
@@ -277,6 +279,45 @@ class AIService {
     
     return data.choices[0].message.content;
   }
+
+  // فتح بث SSE من Blackbox AI وإرجاع الاستجابة كما هي لتمريرها للعميل
+  async streamRequest(provider, message, options = {}) {
+    if (provider !== 'blackbox') {
+      throw new Error(`البث غير مدعوم للمزود: ${provider}`);
+    }
+
+    if (!message || typeof message !== 'string') {
+      throw new Error('الرسالة غير صحيحة أو غير محددة');
+    }
+
+    const client = createAIClient(provider);
+    const isCodeRequest = options.type === 'code' ||
+                         (options.type || '').startsWith('code_') ||
+                         message.includes('code');
+
+    const response = await fetch(`${client.baseURL}/chat/completions`, {
+      method: 'POST',
+      headers: {
+        'Authorization': `Bearer ${client.apiKey}`,
+        'Content-Type': 'application/json',
+        'Accept': 'text/event-stream'
+      },
+      body: JSON.stringify({
+        model: isCodeRequest ? client.models.blackboxCode : client.models.blackboxChat,
+        messages: options.messages || [{ role: 'user', content: message }],
+        max_tokens: options.maxTokens || 2000,
+        temperature: options.temperature || (isCodeRequest ? 0.1 : 0.7),
+        stream: true
+      })
+    });
+
+    if (!response.ok || !response.body) {
+      const errorText = await response.text();
+      throw new Error(`Blackbox AI API Error: ${response.status} - ${errorText}`);
+    }
+
+    return response;
+  }
 }
 
 module.exports = AIService;
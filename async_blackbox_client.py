@@ -0,0 +1,249 @@
+# async_blackbox_client.py - عميل Blackbox غير متزامن (httpx) بتزامن محدود لتشغيل عدة طلبات في آن واحد
+import asyncio
+import os
+import time
+
+import httpx
+from requests.exceptions import InvalidJSONError
+
+import metrics
+from batch import call_with_item, run_batch_async
+from blackbox_client import (
+    DEFAULT_BASE_URL,
+    OPERATIONS,
+    generate_code_payload,
+    explain_code_payload,
+    debug_code_payload,
+    optimize_code_payload,
+    convert_code_payload,
+    chat_payload
+)
+from http_transport import DEFAULT_POOL_MAXSIZE, DEFAULT_CONNECT_TIMEOUT, DEFAULT_READ_TIMEOUT
+from resilience import (
+    CircuitOpenError,
+    RetryPolicy,
+    get_circuit_breaker,
+    get_rate_limiter,
+    send_with_retries_async
+)
+from response_cache import get_default_cache
+from serialization import (
+    BLACKBOX_GZIP,
+    completion_fields,
+    compression_enabled,
+    encode_body,
+    gzip_accepted,
+    native_json,
+    reject_gzip
+)
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv('BLACKBOX_MAX_CONCURRENCY', '8'))
+
+
+class AsyncBlackboxAIClient:
+    """نسخة غير متزامنة من BlackboxAIClient بنفس العمليات ونفس شكل النتائج
+
+    يحد Semaphore من عدد الطلبات المتزامنة حتى لا نتجاوز حصة API.
+    """
+
+    def __init__(self, max_concurrency=None, client=None, cache=None, retry_policy=None, base_url=None):
+        self.api_key = os.getenv('BLACKBOX_API_KEY')
+        self.base_url = base_url or DEFAULT_BASE_URL
+        self.headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json"
+        }
+        self.max_concurrency = max_concurrency or DEFAULT_MAX_CONCURRENCY
+        self.cache = get_default_cache() if cache is None else (cache or None)
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = get_rate_limiter()
+        self.breaker = get_circuit_breaker(self.base_url)
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.client = client or httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=max(self.max_concurrency, DEFAULT_POOL_MAXSIZE),
+                max_keepalive_connections=DEFAULT_POOL_MAXSIZE
+            ),
+            timeout=httpx.Timeout(DEFAULT_READ_TIMEOUT, connect=DEFAULT_CONNECT_TIMEOUT)
+        )
+
+        if not self.api_key:
+            print("⚠️ تحذير: مفتاح Blackbox API غير موجود في متغيرات البيئة")
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        """إغلاق مجمع الاتصالات"""
+        await self.client.aclose()
+
+    async def _chat_completion(self, payload, operation="chat"):
+        """إرسال طلب إلى نقطة chat/completions وإرجاع نص الرد (مع تسجيل المقاييس باسم operation)"""
+        cache_key = None
+        if self.cache is not None and self.cache.should_cache(payload, operation):
+            cache_key = self.cache.make_key(payload)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.observe_cache_hit("async", operation)
+                return cached
+
+        ttfb = None
+
+        async def send():
+            nonlocal ttfb
+            endpoint = f"{self.base_url}/chat/completions"
+            # لا نحجز مكاناً في Semaphore أثناء انتظار التراجع بين المحاولات
+            async with self._semaphore:
+                compress = compression_enabled(endpoint, BLACKBOX_GZIP) and gzip_accepted(endpoint)
+                while True:
+                    if native_json(compress):
+                        # بدون orjson يرمّز httpx الجسم بنفسه (json=) بأقل كلفة
+                        body_headers = {}
+                        request = self.client.build_request("POST", endpoint, headers=self.headers, json=payload)
+                    else:
+                        data, body_headers = encode_body(payload, compress)
+                        request = self.client.build_request(
+                            "POST",
+                            endpoint,
+                            headers=dict(self.headers, **body_headers),
+                            content=data
+                        )
+                    sent = time.perf_counter()
+                    response = await self.client.send(request, stream=True)
+                    # الإرسال بوضع البث يعود عند وصول الترويسات، فنقيس زمن أول بايت قبل قراءة الجسم
+                    ttfb = time.perf_counter() - sent
+                    try:
+                        await response.aread()
+                    finally:
+                        await response.aclose()
+                    if response.status_code != 415 or "Content-Encoding" not in body_headers:
+                        return response
+                    # الخادم لا يقبل الأجسام المضغوطة: نعيد الإرسال دون ضغط ولا نضغط له بعدها
+                    reject_gzip(endpoint)
+                    compress = False
+
+        started = time.perf_counter()
+        with metrics.span(f"blackbox.{operation}", model=payload.get("model")):
+            try:
+                response = await send_with_retries_async(
+                    send,
+                    self.breaker,
+                    self.rate_limiter,
+                    self.retry_policy,
+                    retry_exceptions=(httpx.TransportError,)
+                )
+            except (httpx.HTTPError, CircuitOpenError) as e:
+                metrics.observe_error("async", operation, e)
+                raise
+            metrics.observe_response(
+                "async", operation, response.status_code, started,
+                ttfb=ttfb,
+                body_bytes=len(response.content)
+            )
+            response.raise_for_status()
+            content, usage = completion_fields(response.content)
+        metrics.observe_usage(operation, usage)
+
+        if cache_key:
+            self.cache.set(cache_key, content)
+        return content
+
+    async def _run(self, operation, payload, build_result):
+        """تنفيذ الطلب وتحويل الرد أو الخطأ إلى قاموس النتيجة المعتاد"""
+        try:
+            content = await self._chat_completion(payload, operation)
+            return dict({"success": True}, **build_result(content))
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            return {
+                "success": False,
+                "error": f"خطأ في الطلب: {str(e)}"
+            }
+        except (KeyError, InvalidJSONError) as e:
+            # رد 200 بجسم غير JSON يُرجع كفشل لهذا العنصر ولا يوقف gather()
+            return {
+                "success": False,
+                "error": f"خطأ في تحليل الاستجابة: {str(e)}"
+            }
+
+    async def generate_code(self, prompt, language="python"):
+        """توليد كود برمجي بناءً على الوصف المطلوب"""
+        return await self._run(
+            "generate_code",
+            generate_code_payload(prompt, language),
+            lambda content: {"code": content, "language": language}
+        )
+
+    async def explain_code(self, code):
+        """شرح الكود المُرسل"""
+        return await self._run(
+            "explain_code",
+            explain_code_payload(code),
+            lambda content: {"explanation": content}
+        )
+
+    async def debug_code(self, code, error_message=""):
+        """تصحيح الأخطاء في الكود"""
+        return await self._run(
+            "debug_code",
+            debug_code_payload(code, error_message),
+            lambda content: {"fixed_code": content}
+        )
+
+    async def optimize_code(self, code, optimization_goal="performance"):
+        """تحسين الكود للأداء أو القراءة"""
+        return await self._run(
+            "optimize_code",
+            optimize_code_payload(code, optimization_goal),
+            lambda content: {"optimized_code": content, "optimization_type": optimization_goal}
+        )
+
+    async def convert_code(self, code, from_language, to_language):
+        """تحويل الكود من لغة برمجة إلى أخرى"""
+        return await self._run(
+            "convert_code",
+            convert_code_payload(code, from_language, to_language),
+            lambda content: {
+                "converted_code": content,
+                "from_language": from_language,
+                "to_language": to_language
+            }
+        )
+
+    async def chat(self, message, context="", index=None, top_k=None):
+        """محادثة عامة مع Blackbox AI (مع index تُضاف أقرب المقاطع من المشروع إلى السياق)"""
+        if index is not None:
+            context = index.augment(message, context, top_k)
+        return await self._run(
+            "chat",
+            chat_payload(message, context),
+            lambda content: {"response": content}
+        )
+
+    async def gather(self, operation, items):
+        """تنفيذ عملية واحدة على عدة مدخلات بالتوازي وإرجاع النتائج بترتيب المدخلات
+
+        operation: اسم العملية مثل "explain_code" أو "convert_code"
+        items: قائمة من المعاملات؛ كل عنصر إما tuple للمعاملات الموضعية أو dict للمسماة أو قيمة مفردة
+        """
+        if operation not in OPERATIONS:
+            raise ValueError(f"عملية غير مدعومة: {operation}")
+        method = getattr(self, operation)
+        return await asyncio.gather(*(call_with_item(method, item) for item in items))
+
+    def batch(self, operation, items):
+        """مولد غير متزامن يُرجع نتيجة كل عنصر مع index فور اكتمالها"""
+        return run_batch_async(self, operation, items)
+
+
+# مثال على الاستخدام
+if __name__ == "__main__":
+    async def main():
+        async with AsyncBlackboxAIClient(max_concurrency=4) as client:
+            results = await client.gather("explain_code", ["print('a')", "x = [i * i for i in range(10)]"])
+            for result in results:
+                print(result)
+
+    asyncio.run(main())
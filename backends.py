@@ -0,0 +1,333 @@
+# backends.py - واجهة موحدة لعميل الواجهة: عبر وكيل Node أو مباشرة إلى Blackbox داخل العملية
+import os
+import threading
+import time
+
+import metrics
+from batch import run_batch
+from http_transport import get_session, get_timeout, iter_sse_data
+from response_cache import ResponseCache, get_default_cache
+from serialization import PROXY_GZIP, decode_response, post_json
+from single_flight import get_single_flight
+
+# proxy: عبر server.js على /api/blackbox/code، direct: blackbox_client.BlackboxAIClient داخل العملية
+DEFAULT_BACKEND = os.getenv('BLACKBOX_BACKEND', 'proxy')
+DEFAULT_PROXY_URL = os.getenv('PROXY_URL', "http://0.0.0.0:5000")
+
+BACKENDS = ("proxy", "direct")
+
+# مفاتيح نص الرد في نتائج العميل المباشر حسب العملية
+_DIRECT_RESULT_KEYS = ("response", "code", "explanation", "fixed_code", "optimized_code", "converted_code")
+
+
+class _FallbackText(str):
+    """نص رد من الخدمة البديلة في خادم Node: يُعرض للمستخدم لكنه لا يُخزن مؤقتاً"""
+
+
+def _is_fallback(result):
+    """هل الرد من خدمة server.js البديلة (نص ثابت بـ success: true) لا من مزود حقيقي؟"""
+    payload = result.get("result")
+    return isinstance(payload, dict) and bool(payload.get("fallback"))
+
+
+def _proxy_text(payload):
+    """نص الرد من حقل result في رد خادم Node (نصاً كان أو كائناً فيه response)"""
+    if isinstance(payload, dict):
+        return payload.get("response", "")
+    return str(payload or "")
+
+
+def _chat_messages(message, context="", index=None, top_k=None):
+    """رسالة المحادثة العامة بنفس صيغة blackbox_client.chat_payload، مع المقاطع المسترجعة من index"""
+    if index is not None:
+        context = index.augment(message, context, top_k)
+    prompt = f"Context: {context}\n\nQuestion: {message}" if context else message
+    return [{"role": "user", "content": prompt}]
+
+
+def normalize_result(result):
+    """توحيد شكلي الرد إلى {"success", "response"} أو {"success": False, "error"}
+
+    وكيل Node يُرجع {"success", "result": {"response"}} بينما يُرجع العميل المباشر
+    code أو explanation أو fixed_code... حسب العملية.
+    """
+    if not result.get("success"):
+        return {"success": False, "error": result.get("error", "خطأ غير معروف")}
+    if "result" in result:
+        return {"success": True, "response": _proxy_text(result["result"])}
+    for key in _DIRECT_RESULT_KEYS:
+        if key in result:
+            return {"success": True, "response": result[key]}
+    return {"success": True, "response": ""}
+
+
+class ProxyBackend:
+    """الإرسال عبر خادم Node (server.js) الذي يتولى الاتصال بمزودي الذكاء الاصطناعي"""
+
+    name = "proxy"
+
+    def __init__(self, base_url=None):
+        self.base_url = base_url or DEFAULT_PROXY_URL
+        # جلسة مشتركة بمجمع اتصالات دائمة مع خادم Node
+        self.session = get_session()
+        self.timeout = get_timeout(read_timeout=30)
+        self.cache = get_default_cache()
+        self.single_flight = get_single_flight()
+
+    def _post(self, operation, fields):
+        """إرسال طلب إلى /api/blackbox/code مع استخدام الذاكرة المؤقتة إن كانت مفعلة"""
+        cache_key = None
+        if self.cache is not None and self.cache.should_cache(fields, operation):
+            cache_key = self.cache.make_key(fields)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.observe_cache_hit(self.name, operation)
+                return normalize_result(cached)
+
+        if self.single_flight is None:
+            result = self._request(operation, fields)
+        else:
+            result = self.single_flight.do(
+                ("proxy", self.base_url, ResponseCache.make_key(fields)),
+                lambda: self._request(operation, fields)
+            )
+        if cache_key and result.get("success") and not _is_fallback(result):
+            self.cache.set(cache_key, result)
+        return normalize_result(result)
+
+    def _request(self, operation, fields):
+        """الطلب الفعلي إلى خادم Node؛ يُرجع الرد كما هو أو {"success": False, "error"}"""
+        started = time.perf_counter()
+        try:
+            with metrics.span(f"proxy.{operation}"):
+                # خادم Node يفك الأجسام المضغوطة، فالكود الكبير يُرسل بـ gzip إلى وكيل غير محلي (PROXY_GZIP_REQUESTS)
+                response = post_json(
+                    self.session,
+                    f"{self.base_url}/api/blackbox/code",
+                    fields,
+                    compress=PROXY_GZIP,
+                    timeout=self.timeout
+                )
+            metrics.observe_response(
+                self.name, operation, response.status_code, started,
+                ttfb=response.elapsed.total_seconds(),
+                body_bytes=len(response.content)
+            )
+
+            if response.status_code == 200:
+                return decode_response(response.content)
+            else:
+                return {"success": False, "error": f"خطأ HTTP: {response.status_code}"}
+
+        except Exception as e:
+            metrics.observe_error(self.name, operation, e)
+            return {"success": False, "error": f"خطأ في الاتصال: {str(e)}"}
+
+    def generate_code(self, prompt, language="python"):
+        """توليد كود برمجي بناءً على الوصف المطلوب"""
+        return self._post("generate_code", {"action": "generate", "prompt": prompt, "language": language})
+
+    def explain_code(self, code):
+        """شرح الكود المُرسل"""
+        return self._post("explain_code", {"action": "explain", "code": code})
+
+    def debug_code(self, code, error_message=""):
+        """تصحيح الأخطاء في الكود"""
+        return self._post("debug_code", {"action": "debug", "code": code, "error_message": error_message})
+
+    def optimize_code(self, code, optimization_goal="performance"):
+        """تحسين الكود للأداء أو القراءة"""
+        return self._post("optimize_code", {"action": "optimize", "code": code, "optimization_goal": optimization_goal})
+
+    def convert_code(self, code, from_language, to_language):
+        """تحويل الكود من لغة برمجة إلى أخرى"""
+        return self._post("convert_code", {
+            "action": "convert",
+            "code": code,
+            "from_language": from_language,
+            "to_language": to_language
+        })
+
+    def chat(self, message, context="", index=None, top_k=None):
+        """محادثة عامة، مع index تُضاف أقرب top_k مقاطع من المشروع إلى السياق (انظر code_index.py)"""
+        return self.converse(_chat_messages(message, context, index, top_k))
+
+    def converse(self, messages, operation="chat"):
+        """إرسال سجل محادثة متعدد الأدوار (انظر conversation.py)"""
+        return self._post(operation, {"action": "chat", "messages": messages})
+
+    def batch(self, operation, items, max_workers=None):
+        """تنفيذ عملية على عدة مدخلات بالتوازي مع إرجاع النتائج فور اكتمالها"""
+        return run_batch(self, operation, items, max_workers=max_workers)
+
+    def _stream(self, operation, fields):
+        """بث نص الرد من خادم Node تدريجياً (أو الرد كاملاً إن لم يدعم الخادم البث)"""
+        cache_key = None
+        if self.cache is not None and self.cache.should_cache(fields, operation):
+            cache_key = self.cache.make_key(fields)
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.observe_cache_hit(self.name, operation)
+                yield _proxy_text(cached.get("result"))
+                return
+
+        if self.single_flight is None:
+            chunks = self._stream_upstream(operation, fields)
+        else:
+            chunks = self.single_flight.stream(
+                ("proxy-stream", self.base_url, ResponseCache.make_key(fields)),
+                lambda: self._stream_upstream(operation, fields)
+            )
+
+        parts = []
+        fallback = False
+        for text in chunks:
+            fallback = fallback or isinstance(text, _FallbackText)
+            parts.append(text)
+            yield text
+
+        if cache_key and not fallback:
+            # نخزن بنفس شكل رد الخادم غير المبثوث ليشترك المساران في الذاكرة
+            self.cache.set(cache_key, {"success": True, "result": {"response": "".join(parts)}})
+
+    def _stream_upstream(self, operation, fields):
+        """بث نص الرد من خادم Node دون ذاكرة مؤقتة أو دمج"""
+        started = time.perf_counter()
+        ttfb = None
+        with post_json(
+            self.session,
+            f"{self.base_url}/api/blackbox/code",
+            dict(fields, stream=True),
+            compress=PROXY_GZIP,
+            timeout=self.timeout,
+            stream=True
+        ) as response:
+            response.raise_for_status()
+
+            if not response.headers.get("Content-Type", "").startswith("text/event-stream"):
+                body = decode_response(response.content)
+                text = _proxy_text(body.get("result"))
+                yield _FallbackText(text) if _is_fallback(body) else text
+                return
+
+            for data in iter_sse_data(response):
+                chunk = decode_response(data)
+                if chunk.get("error"):
+                    raise RuntimeError(chunk["error"])
+                text = ((chunk.get("choices") or [{}])[0].get("delta") or {}).get("content")
+                if text:
+                    if ttfb is None:
+                        ttfb = time.perf_counter() - started
+                    yield text
+        metrics.observe_response(self.name, operation, 200, started, ttfb=ttfb)
+
+    def generate_code_stream(self, prompt, language="python"):
+        """توليد كود مع بث النص تدريجياً"""
+        return self._stream("generate_code", {"action": "generate", "prompt": prompt, "language": language})
+
+    def explain_code_stream(self, code):
+        """شرح الكود مع بث النص تدريجياً"""
+        return self._stream("explain_code", {"action": "explain", "code": code})
+
+    def debug_code_stream(self, code, error_message=""):
+        """تصحيح الأخطاء مع بث النص تدريجياً"""
+        return self._stream("debug_code", {"action": "debug", "code": code, "error_message": error_message})
+
+    def chat_stream(self, message, context="", index=None, top_k=None):
+        """محادثة عامة مع بث نص الرد تدريجياً"""
+        return self.converse_stream(_chat_messages(message, context, index, top_k))
+
+    def converse_stream(self, messages, operation="chat"):
+        """إرسال سجل محادثة مع بث نص الرد تدريجياً"""
+        return self._stream(operation, {"action": "chat", "messages": messages})
+
+
+class DirectBackend:
+    """الاتصال بـ Blackbox مباشرة من داخل العملية دون المرور بخادم Node
+
+    يوفر قفزة HTTP محلية وإعادة ترميز JSON في كل طلب، ويستخدم إعادة المحاولة
+    وقاطع الدائرة والذاكرة المؤقتة الخاصة بـ blackbox_client.
+    """
+
+    name = "direct"
+
+    def __init__(self, client=None):
+        if client is None:
+            from blackbox_client import BlackboxAIClient
+            client = BlackboxAIClient()
+        self.client = client
+
+    def generate_code(self, prompt, language="python"):
+        """توليد كود برمجي بناءً على الوصف المطلوب"""
+        return normalize_result(self.client.generate_code(prompt, language))
+
+    def explain_code(self, code):
+        """شرح الكود المُرسل"""
+        return normalize_result(self.client.explain_code(code))
+
+    def debug_code(self, code, error_message=""):
+        """تصحيح الأخطاء في الكود"""
+        return normalize_result(self.client.debug_code(code, error_message))
+
+    def optimize_code(self, code, optimization_goal="performance"):
+        """تحسين الكود للأداء أو القراءة"""
+        return normalize_result(self.client.optimize_code(code, optimization_goal))
+
+    def convert_code(self, code, from_language, to_language):
+        """تحويل الكود من لغة برمجة إلى أخرى"""
+        return normalize_result(self.client.convert_code(code, from_language, to_language))
+
+    def chat(self, message, context="", index=None, top_k=None):
+        """محادثة عامة، مع index تُضاف أقرب top_k مقاطع من المشروع إلى السياق (انظر code_index.py)"""
+        return normalize_result(self.client.chat(message, context, index=index, top_k=top_k))
+
+    def converse(self, messages, operation="chat"):
+        """إرسال سجل محادثة متعدد الأدوار (انظر conversation.py)"""
+        return normalize_result(self.client.complete(messages, operation))
+
+    def batch(self, operation, items, max_workers=None):
+        """تنفيذ عملية على عدة مدخلات بالتوازي مع إرجاع النتائج فور اكتمالها"""
+        return run_batch(self, operation, items, max_workers=max_workers)
+
+    def generate_code_stream(self, prompt, language="python"):
+        """توليد كود مع بث النص تدريجياً"""
+        return self.client.generate_code_stream(prompt, language)
+
+    def explain_code_stream(self, code):
+        """شرح الكود مع بث النص تدريجياً"""
+        return self.client.explain_code_stream(code)
+
+    def debug_code_stream(self, code, error_message=""):
+        """تصحيح الأخطاء مع بث النص تدريجياً"""
+        return self.client.debug_code_stream(code, error_message)
+
+    def chat_stream(self, message, context="", index=None, top_k=None):
+        """محادثة عامة مع بث نص الرد تدريجياً"""
+        return self.client.chat_stream(message, context, index=index, top_k=top_k)
+
+    def converse_stream(self, messages, operation="chat"):
+        """إرسال سجل محادثة مع بث نص الرد تدريجياً"""
+        return self.client.complete_stream(messages, operation)
+
+
+def create_backend(name=None):
+    """إنشاء الواجهة الخلفية المطلوبة (proxy أو direct)"""
+    name = name or DEFAULT_BACKEND
+    if name == "proxy":
+        return ProxyBackend()
+    if name == "direct":
+        return DirectBackend()
+    raise ValueError(f"واجهة خلفية غير معروفة: {name}. المتاحة: {', '.join(BACKENDS)}")
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """الواجهة الخلفية المشتركة على مستوى العملية حسب BLACKBOX_BACKEND"""
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = create_backend()
+        return _backend
@@ -0,0 +1,81 @@
+# batch.py - تنفيذ عملية واحدة على عدة مدخلات بالتوازي مع إرجاع النتائج فور اكتمالها
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# العمليات المدعومة في وضع الدفعات
+BATCH_OPERATIONS = ("explain_code", "debug_code", "optimize_code", "convert_code")
+
+DEFAULT_MAX_WORKERS = int(os.getenv('BLACKBOX_BATCH_WORKERS', '8'))
+
+
+def call_with_item(method, item):
+    """استدعاء method بعنصر دفعة: tuple للمعاملات الموضعية أو dict للمسماة أو قيمة مفردة"""
+    if isinstance(item, dict):
+        return method(**item)
+    if isinstance(item, (tuple, list)):
+        return method(*item)
+    return method(item)
+
+
+def _resolve(client, operation):
+    if operation not in BATCH_OPERATIONS:
+        raise ValueError(f"عملية غير مدعومة في الدفعات: {operation}. المتاحة: {', '.join(BATCH_OPERATIONS)}")
+    return getattr(client, operation)
+
+
+def run_batch(client, operation, items, max_workers=None):
+    """تنفيذ الدفعة عبر مجمع خيوط وإرجاع كل نتيجة مع index الخاص بها فور اكتمالها
+
+    فشل أي عنصر لا يوقف الدفعة؛ يظهر كنتيجة {"success": False, "error": ...} لذلك العنصر.
+    """
+    method = _resolve(client, operation)
+    items = list(items)
+    pool = ThreadPoolExecutor(max_workers=max_workers or DEFAULT_MAX_WORKERS)
+    try:
+        futures = {pool.submit(call_with_item, method, item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                result = {"success": False, "error": f"خطأ غير متوقع: {str(e)}"}
+            yield dict(result, index=index)
+    finally:
+        # إلغاء العناصر المتبقية إذا توقف المستهلك عن القراءة مبكراً
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_batch_async(client, operation, items):
+    """نسخة غير متزامنة من run_batch لعميل AsyncBlackboxAIClient (التزامن محدود بـ Semaphore العميل)"""
+    # asyncio يُحمّل هنا فقط لأن المسار المتزامن (وتطبيق Streamlit) لا يحتاجه
+    import asyncio
+
+    method = _resolve(client, operation)
+
+    async def run(index, item):
+        try:
+            result = await call_with_item(method, item)
+        except Exception as e:
+            result = {"success": False, "error": f"خطأ غير متوقع: {str(e)}"}
+        return dict(result, index=index)
+
+    tasks = [asyncio.ensure_future(run(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+def summarize_batch(results):
+    """ترتيب نتائج الدفعة حسب index وفصل الأخطاء"""
+    ordered = sorted(results, key=lambda result: result["index"])
+    return {
+        "results": ordered,
+        "succeeded": sum(1 for result in ordered if result.get("success")),
+        "errors": [
+            {"index": result["index"], "error": result.get("error", "خطأ غير معروف")}
+            for result in ordered if not result.get("success")
+        ]
+    }
@@ -0,0 +1,419 @@
+# benchmark.py - قياس أداء العملاء واستخراج HTML دون اتصال مقابل stub_server.py مع مقارنة بخط أساس
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from html_extract import available_backends, extract_page
+from serialization import completion_fields, encode_body, orjson
+from stub_server import StubConfig, start_stub_server
+
+DEFAULT_LEVELS = "1,4,16,64"
+# أحجام الكود المعتادة في الطلبات (KB)
+DEFAULT_SERIALIZATION_SIZES = "10,50,100,200"
+CLIENT_SCENARIOS = ("direct", "direct-stream", "async", "proxy", "proxy-stream")
+# المقاييس التي تُقارن بخط الأساس: (المفتاح، هل الأكبر أفضل)
+COMPARED_FIELDS = (("throughput", True), ("p95", False))
+HTML_COMPARED_FIELDS = (("p50", False),)
+
+
+def percentile(sorted_values, q):
+    """المئين بطريقة أقرب رتبة على قائمة مرتبة"""
+    if not sorted_values:
+        return None
+    rank = max(1, int(round(q * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def peak_rss_mb():
+    """أعلى ذاكرة مقيمة للعملية حتى الآن (ru_maxrss بالكيلوبايت على Linux)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _summarize(scenario, concurrency, latencies, errors, elapsed, traced_peak=None):
+    latencies = sorted(latencies)
+    return {
+        "scenario": scenario,
+        "concurrency": concurrency,
+        "requests": len(latencies) + errors,
+        "errors": errors,
+        "elapsed": elapsed,
+        "throughput": (len(latencies) + errors) / elapsed if elapsed else 0.0,
+        "mean": sum(latencies) / len(latencies) if latencies else None,
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "peak_rss_mb": peak_rss_mb(),
+        "traced_peak_mb": traced_peak / (1024 * 1024) if traced_peak is not None else None
+    }
+
+
+def _make_call(scenario, base_url, retry_policy):
+    """دالة طلب واحد للسيناريو؛ تُرجع True عند النجاح"""
+    if scenario.startswith("direct"):
+        from blackbox_client import BlackboxAIClient
+        client = BlackboxAIClient(cache=False, retry_policy=retry_policy, base_url=f"{base_url}/v1")
+    else:
+        from backends import ProxyBackend
+        client = ProxyBackend(base_url=base_url)
+        client.cache = None
+
+    if scenario.endswith("-stream"):
+        def call(code):
+            try:
+                return bool("".join(client.explain_code_stream(code)))
+            except Exception:
+                return False
+    else:
+        def call(code):
+            return client.explain_code(code).get("success", False)
+    return call
+
+
+def _timed(call, code):
+    started = time.perf_counter()
+    ok = call(code)
+    return ok, time.perf_counter() - started
+
+
+def run_threaded_level(scenario, base_url, concurrency, requests_count, retry_policy):
+    """تشغيل requests_count طلباً عبر concurrency خيطاً وإرجاع ملخص المستوى"""
+    call = _make_call(scenario, base_url, retry_policy)
+    latencies = []
+    errors = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for ok, latency in pool.map(lambda i: _timed(call, f"print({i})"), range(requests_count)):
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+    return latencies, errors, time.perf_counter() - started
+
+
+def run_async_level(base_url, concurrency, requests_count, retry_policy):
+    """نفس القياس بالعميل غير المتزامن بحد concurrency طلباً في الطيران
+
+    يبدأ توقيت الطلب بعد حجز مكانه كما في مجمع الخيوط، حتى لا يُحسب زمن الانتظار في الطابور.
+    """
+    from async_blackbox_client import AsyncBlackboxAIClient
+
+    async def run():
+        latencies = []
+        errors = 0
+        async with AsyncBlackboxAIClient(max_concurrency=concurrency, cache=False,
+                                         retry_policy=retry_policy, base_url=f"{base_url}/v1") as client:
+            slots = asyncio.Semaphore(concurrency)
+
+            async def one(i):
+                nonlocal errors
+                async with slots:
+                    started = time.perf_counter()
+                    result = await client.explain_code(f"print({i})")
+                if result.get("success"):
+                    latencies.append(time.perf_counter() - started)
+                else:
+                    errors += 1
+
+            started = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(requests_count)))
+            return latencies, errors, time.perf_counter() - started
+
+    return asyncio.run(run())
+
+
+def bench_clients(base_url, scenarios, levels, requests_per_level, retry_policy, trace_memory=False):
+    """تشغيل كل سيناريو على كل مستوى تزامن وإرجاع صفوف النتائج"""
+    rows = []
+    for scenario in scenarios:
+        for concurrency in levels:
+            requests_count = max(requests_per_level, concurrency * 4)
+            if trace_memory:
+                tracemalloc.start()
+            if scenario == "async":
+                latencies, errors, elapsed = run_async_level(base_url, concurrency, requests_count, retry_policy)
+            else:
+                latencies, errors, elapsed = run_threaded_level(
+                    scenario, base_url, concurrency, requests_count, retry_policy
+                )
+            traced_peak = None
+            if trace_memory:
+                traced_peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            rows.append(_summarize(scenario, concurrency, latencies, errors, elapsed, traced_peak))
+    return rows
+
+
+def canned_page(kind, size=1024 * 1024):
+    """صفحات HTML ثابتة كبيرة لقياس الاستخراج (نفس المحتوى في كل تشغيل)
+
+    article: فقرات كثيرة، links: قوائم روابط، script-heavy: سكربتات وأنماط كبيرة قبل المحتوى.
+    """
+    head = "<html><head><title>Benchmark page</title>"
+    if kind == "script-heavy":
+        head += "<script>" + "var x = 1; // padding\n" * (size // 44) + "</script>"
+        head += "<style>" + ".a { color: red; }\n" * (size // 38) + "</style>"
+    parts = [head, "</head><body>"]
+    used = 0
+    index = 0
+    while used < size:
+        if kind == "links":
+            block = "<ul>" + "".join(
+                f'<li><a href="/page/{index}/{n}">Link {index}-{n}</a></li>' for n in range(20)
+            ) + "</ul>"
+        else:
+            block = (
+                f"<div class=\"section\"><h2>Section {index}</h2><p>Paragraph {index} "
+                + "lorem ipsum dolor sit amet " * 20
+                + f'<a href="/section/{index}">more</a></p></div>'
+            )
+        parts.append(block)
+        used += len(block)
+        index += 1
+    parts.append("</body></html>")
+    return "".join(parts)
+
+
+def bench_html(kinds=("article", "links", "script-heavy"), repeat=5, size=1024 * 1024):
+    """زمن extract_page لكل صفحة وواجهة، بالحدود الافتراضية (توقف مبكر) وبلا حدود"""
+    rows = []
+    for kind in kinds:
+        html = canned_page(kind, size)
+        for backend in available_backends():
+            for mode, limits in (("default", {}), ("full", {"max_paragraphs": 10 ** 6, "max_links": 10 ** 6})):
+                timings = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    extract_page(html, backend=backend, **limits)
+                    timings.append(time.perf_counter() - started)
+                timings.sort()
+                rows.append({
+                    "scenario": f"html:{kind}:{backend}:{mode}",
+                    "size_mb": len(html) / (1024 * 1024),
+                    "p50": percentile(timings, 0.5),
+                    "mb_per_s": len(html) / (1024 * 1024) / percentile(timings, 0.5)
+                })
+    return rows
+
+
+def canned_code(size):
+    """كود ثابت بحجم size بايت من ملفات بايثون هذا المستودع (تعليقات عربية كما في الطلبات الفعلية)"""
+    directory = os.path.dirname(os.path.abspath(__file__))
+    sources = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".py"):
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                sources.append(f.read())
+    text = "\n".join(sources)
+    while len(text.encode("utf-8")) < size:
+        text += text
+    return text.encode("utf-8")[:size].decode("utf-8", errors="ignore")
+
+
+def _baseline_encode(payload):
+    # ما يفعله requests مع json=: json.dumps بالإعدادات الافتراضية (ensure_ascii ومسافات بعد الفواصل)
+    return json.dumps(payload).encode("utf-8")
+
+
+def _baseline_decode(data):
+    # ما يفعله response.json(): فك البايتات إلى نص ثم json.loads للرد كاملاً
+    body = json.loads(data.decode("utf-8"))
+    return body["choices"][0]["message"]["content"], body.get("usage")
+
+
+def bench_serialization(sizes=(10, 50, 100, 200), repeat=50):
+    """كلفة المعالج والبايتات لكل طلب: ترميز جسم الطلب وفك الرد لكل مرمّز، مع الضغط وبدونه
+
+    الصف baseline يحاكي المسار السابق (json= في requests وresponse.json()) للمقارنة.
+    """
+    from blackbox_client import explain_code_payload
+
+    codecs = ["json"] + (["orjson"] if orjson is not None else [])
+    rows = []
+    for size in sizes:
+        code = canned_code(size * 1024)
+        payload = explain_code_payload(code)
+        response = json.dumps({
+            "id": "benchmark",
+            "object": "chat.completion",
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": code}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": size * 256, "completion_tokens": size * 256}
+        }).encode("utf-8")
+
+        variants = [("baseline", lambda: (_baseline_encode(payload), {}), lambda: _baseline_decode(response))]
+        for codec in codecs:
+            for compress in (False, True):
+                variants.append((
+                    f"{codec}:{'gzip' if compress else 'identity'}",
+                    lambda codec=codec, compress=compress: encode_body(payload, compress, codec=codec),
+                    lambda codec=codec: completion_fields(response, codec=codec)
+                ))
+
+        baseline = None
+        for name, encode, decode in variants:
+            encode_timings = []
+            decode_timings = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                data, _ = encode()
+                encode_timings.append(time.perf_counter() - started)
+                started = time.perf_counter()
+                decode()
+                decode_timings.append(time.perf_counter() - started)
+            encode_timings.sort()
+            decode_timings.sort()
+            row = {
+                "scenario": f"serialization:{size}KB:{name}",
+                "size_kb": size,
+                "bytes": len(data),
+                "encode": percentile(encode_timings, 0.5),
+                "decode": percentile(decode_timings, 0.5)
+            }
+            # p50 = كلفة المعالج لكل طلب (ترميز + فك)، وهو ما يُقارن بخط الأساس
+            row["p50"] = row["encode"] + row["decode"]
+            baseline = baseline or row
+            row["bytes_saved"] = 1 - row["bytes"] / baseline["bytes"]
+            row["cpu_saved"] = 1 - row["p50"] / baseline["p50"]
+            rows.append(row)
+    return rows
+
+
+def _key(row):
+    return f"{row['scenario']}@{row.get('concurrency', '-')}"
+
+
+def compare(rows, baseline_rows, tolerance):
+    """مقارنة النتائج بخط أساس؛ تُرجع أسطر التراجعات التي تتجاوز tolerance (نسبة)"""
+    baseline = {_key(row): row for row in baseline_rows}
+    regressions = []
+    for row in rows:
+        base = baseline.get(_key(row))
+        if not base:
+            continue
+        # صفوف HTML ليس لها إنتاجية، فنقارن زمنها الوسيط فقط
+        fields = COMPARED_FIELDS if "throughput" in row else HTML_COMPARED_FIELDS
+        for field, higher_is_better in fields:
+            if row.get(field) is None or not base.get(field):
+                continue
+            change = (row[field] - base[field]) / base[field]
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append(f"{_key(row)} {field}: {base[field]:.4f} -> {row[field]:.4f} ({change:+.0%})")
+    return regressions
+
+
+def _ms(value):
+    return f"{value * 1000:8.1f}" if value is not None else "       -"
+
+
+def print_client_rows(rows):
+    print(f"{'scenario':<14}{'conc':>5}{'reqs':>6}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'rss MB':>8}")
+    for row in rows:
+        print(
+            f"{row['scenario']:<14}{row['concurrency']:>5}{row['requests']:>6}{row['errors']:>5}"
+            f"{row['throughput']:>9.1f}{_ms(row['p50'])} {_ms(row['p95'])} {_ms(row['p99'])}"
+            f"{row['peak_rss_mb']:>8.1f}"
+            + (f"  traced {row['traced_peak_mb']:.1f} MB" if row["traced_peak_mb"] is not None else "")
+        )
+
+
+def print_html_rows(rows):
+    print(f"{'scenario':<40}{'MB':>6}{'p50 ms':>10}{'MB/s':>9}")
+    for row in rows:
+        print(f"{row['scenario']:<40}{row['size_mb']:>6.1f}{_ms(row['p50'])}  {row['mb_per_s']:>7.1f}")
+
+
+def print_serialization_rows(rows):
+    print(f"{'scenario':<40}{'bytes':>9}{'enc µs':>9}{'dec µs':>9}{'bytes saved':>13}{'cpu saved':>11}")
+    for row in rows:
+        print(
+            f"{row['scenario']:<40}{row['bytes']:>9}{row['encode'] * 1e6:>9.0f}{row['decode'] * 1e6:>9.0f}"
+            f"{row['bytes_saved']:>13.0%}{row['cpu_saved']:>11.0%}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="قياس أداء عملاء Blackbox واستخراج HTML دون اتصال")
+    parser.add_argument("--suite", choices=("clients", "html", "serialization", "all"), default="all")
+    parser.add_argument("--scenarios", default=",".join(CLIENT_SCENARIOS))
+    parser.add_argument("--levels", default=DEFAULT_LEVELS, help="مستويات التزامن مفصولة بفواصل")
+    parser.add_argument("--requests", type=int, default=100, help="أقل عدد طلبات لكل مستوى")
+    parser.add_argument("--latency", default="lognormal:-3,0.5", help="توزيع زمن الخادم الوهمي")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-base-delay", type=float, default=0.01)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--trace-memory", action="store_true", help="قياس ذروة التخصيص بـ tracemalloc (أبطأ)")
+    parser.add_argument("--html-repeat", type=int, default=5)
+    parser.add_argument("--serialization-sizes", default=DEFAULT_SERIALIZATION_SIZES, help="أحجام الكود بالـ KB")
+    parser.add_argument("--serialization-repeat", type=int, default=50)
+    parser.add_argument("--json", help="حفظ النتائج في ملف JSON لاستخدامها خط أساس")
+    parser.add_argument("--compare", help="ملف JSON لخط أساس سابق")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="نسبة التراجع المسموحة قبل الفشل")
+    args = parser.parse_args()
+
+    # الخادم الوهمي لا يتحقق من المفتاح
+    os.environ.setdefault("BLACKBOX_API_KEY", "benchmark")
+    # تجاوز المجمع في المستويات العالية متوقع هنا ولا نريد تحذيراته في المخرجات
+    logging.getLogger("urllib3.connectionpool").setLevel(logging.ERROR)
+
+    rows = []
+    if args.suite in ("clients", "all"):
+        from resilience import RetryPolicy
+
+        config = StubConfig(
+            latency=args.latency,
+            error_rate=args.error_rate,
+            rate_limit_rate=args.rate_limit_rate,
+            seed=args.seed
+        )
+        server = start_stub_server(config)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+        levels = [int(level) for level in args.levels.split(",")]
+        scenarios = [scenario for scenario in args.scenarios.split(",") if scenario in CLIENT_SCENARIOS]
+        client_rows = bench_clients(
+            base_url, scenarios, levels, args.requests,
+            RetryPolicy(base_delay=args.retry_base_delay), args.trace_memory
+        )
+        server.shutdown()
+        print_client_rows(client_rows)
+        rows.extend(client_rows)
+
+    if args.suite in ("html", "all"):
+        html_rows = bench_html(repeat=args.html_repeat)
+        print()
+        print_html_rows(html_rows)
+        rows.extend(html_rows)
+
+    if args.suite in ("serialization", "all"):
+        serialization_rows = bench_serialization(
+            [int(size) for size in args.serialization_sizes.split(",")], args.serialization_repeat
+        )
+        print()
+        print_serialization_rows(serialization_rows)
+        rows.extend(serialization_rows)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": rows}, f, indent=2)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline_rows = json.load(f)["results"]
+        regressions = compare(rows, baseline_rows, args.tolerance)
+        if regressions:
+            print("\n❌ تراجع في الأداء مقارنة بخط الأساس:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\n✅ لا تراجع في الأداء مقارنة بخط الأساس")
+
+
+if __name__ == "__main__":
+    main()
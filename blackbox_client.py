@@ -1,43 +1,310 @@
 
 import requests
-import json
 import os
+import time
+
+import metrics
+from batch import run_batch
+from endpoint_pool import get_endpoint_pool
+from http_transport import get_session, get_timeout, iter_sse_data
+from resilience import RetryPolicy, get_circuit_breaker, get_rate_limiter, send_with_retries
+from response_cache import ResponseCache, get_default_cache
+from serialization import BLACKBOX_GZIP, completion_fields, decode_response, post_json
+from single_flight import get_single_flight
+
+# يمكن توجيهه إلى خادم محلي بديل (مثل stub_server.py في قياس الأداء)
+DEFAULT_BASE_URL = os.getenv('BLACKBOX_BASE_URL', "https://api.blackbox.ai/v1")
+
+# العمليات المتاحة على العميل (المتزامن وغير المتزامن)
+OPERATIONS = ("generate_code", "explain_code", "debug_code", "optimize_code", "convert_code", "chat")
+
+
+def _payload(content, model="blackbox-code", max_tokens=2000, temperature=0.7, stream=False):
+    """بناء جسم طلب chat/completions برسالة مستخدم واحدة"""
+    return messages_payload(
+        [
+            {
+                "role": "user",
+                "content": content
+            }
+        ],
+        model=model, max_tokens=max_tokens, temperature=temperature, stream=stream
+    )
+
+
+def messages_payload(messages, model="blackbox-code", max_tokens=2000, temperature=0.7, stream=False):
+    """بناء جسم طلب chat/completions من سجل رسائل كامل (role وcontent لكل رسالة)"""
+    return {
+        "messages": list(messages),
+        "model": model,
+        "stream": stream,
+        "max_tokens": max_tokens,
+        "temperature": temperature
+    }
+
+
+def generate_code_payload(prompt, language="python", stream=False):
+    """طلب توليد الكود"""
+    return _payload(f"Generate {language} code for: {prompt}", max_tokens=2000, temperature=0.7, stream=stream)
+
+
+def explain_code_payload(code, stream=False):
+    """طلب شرح الكود"""
+    return _payload(f"Explain this code in detail:\n\n```\n{code}\n```", max_tokens=1500, temperature=0.3, stream=stream)
+
+
+def debug_code_payload(code, error_message="", stream=False):
+    """طلب تصحيح الأخطاء"""
+    prompt = f"Debug this code and fix any issues:\n\nCode:\n```\n{code}\n```"
+    if error_message:
+        prompt += f"\n\nError message: {error_message}"
+    return _payload(prompt, max_tokens=2000, temperature=0.1, stream=stream)
+
+
+def optimize_code_payload(code, optimization_goal="performance", stream=False):
+    """طلب تحسين الكود"""
+    return _payload(f"Optimize this code for {optimization_goal}:\n\n```\n{code}\n```", max_tokens=2000, temperature=0.2, stream=stream)
+
+
+def convert_code_payload(code, from_language, to_language, stream=False):
+    """طلب تحويل الكود بين لغتين"""
+    return _payload(
+        f"Convert this {from_language} code to {to_language}:\n\n```{from_language}\n{code}\n```",
+        max_tokens=2000, temperature=0.1, stream=stream
+    )
+
+
+def chat_payload(message, context="", stream=False):
+    """طلب المحادثة العامة"""
+    prompt = message
+    if context:
+        prompt = f"Context: {context}\n\nQuestion: {message}"
+    return _payload(prompt, model="blackbox", max_tokens=1500, temperature=0.7, stream=stream)
+
 
 class BlackboxAIClient:
-    def __init__(self):
+    def __init__(self, session=None, timeout=None, cache=None, retry_policy=None, base_url=None, endpoint_pool=None):
         self.api_key = os.getenv('BLACKBOX_API_KEY')
-        self.base_url = "https://api.blackbox.ai/v1"
+        self.base_url = base_url or DEFAULT_BASE_URL
+        # عدة نقاط/مفاتيح (BLACKBOX_ENDPOINTS) يُختار بينها لكل طلب، وإلا فنقطة base_url وحدها
+        self.endpoint_pool = endpoint_pool or (None if base_url else get_endpoint_pool(self.base_url, self.api_key))
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # جلسة مشتركة بمجمع اتصالات دائمة لتجنب مصافحة TCP+TLS في كل طلب
+        self.session = session or get_session()
+        self.timeout = timeout or get_timeout()
+        # ذاكرة مؤقتة اختيارية للردود (None = الافتراضية حسب BLACKBOX_CACHE، False = تعطيل)
+        self.cache = get_default_cache() if cache is None else (cache or None)
+        # دمج الطلبات المتطابقة المتزامنة على مستوى العملية (BLACKBOX_SINGLE_FLIGHT=0 للتعطيل)
+        self.single_flight = get_single_flight()
+        # إعادة المحاولة لكل عميل، أما محدد المعدل وقاطع الدائرة فمشتركان في العملية
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.rate_limiter = get_rate_limiter()
+        self.breaker = get_circuit_breaker(self.base_url)
         
-        if not self.api_key:
+        if not self.api_key and not (self.endpoint_pool and all(endpoint.api_key for endpoint in self.endpoint_pool.endpoints)):
             print("⚠️ تحذير: مفتاح Blackbox API غير موجود في متغيرات البيئة")
     
+    def _cache_key(self, payload, operation):
+        """مفتاح التخزين المؤقت للطلب، أو None إن كان التخزين معطلاً أو غير مناسب"""
+        if self.cache is not None and self.cache.should_cache(payload, operation):
+            return self.cache.make_key(payload)
+        return None
+    
+    def _send(self, payload, headers=None, stream=False):
+        """إرسال الطلب عبر محدد المعدل وقاطع الدائرة مع إعادة المحاولة عند 429 و5xx"""
+        if self.endpoint_pool is not None:
+            # أفضل نقطة حسب زمن الاستجابة والحصة، مع الانتقال لغيرها عند الفشل (والتحوط لغير البث)
+            return self.endpoint_pool.send(
+                lambda pooled: post_json(
+                    self.session,
+                    f"{pooled.base_url}/chat/completions",
+                    payload,
+                    headers=pooled.headers(headers or self.headers),
+                    compress=BLACKBOX_GZIP,
+                    timeout=self.timeout,
+                    stream=stream
+                ),
+                self.retry_policy,
+                hedge=False if stream else None
+            )
+        
+        endpoint = f"{self.base_url}/chat/completions"
+        return send_with_retries(
+            # الجسم يُرمّز بـ orjson ويُضغط إن كان كبيراً (BLACKBOX_GZIP_REQUESTS=1)
+            lambda: post_json(
+                self.session,
+                endpoint,
+                payload,
+                headers=headers or self.headers,
+                compress=BLACKBOX_GZIP,
+                timeout=self.timeout,
+                stream=stream
+            ),
+            self.breaker,
+            self.rate_limiter,
+            self.retry_policy
+        )
+    
+    def _chat_completion(self, payload, operation="chat"):
+        """إرسال طلب إلى نقطة chat/completions وإرجاع نص الرد (مع تسجيل المقاييس باسم operation)"""
+        cache_key = self._cache_key(payload, operation)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.observe_cache_hit("sync", operation)
+                return cached
+        
+        if self.single_flight is None:
+            content = self._request_completion(payload, operation)
+        else:
+            # الطلبات المتطابقة المتزامنة تنتظر نفس الطلب بدلاً من إرسال نسخ مكررة
+            content = self.single_flight.do(
+                ("call", self.base_url, ResponseCache.make_key(payload)),
+                lambda: self._request_completion(payload, operation)
+            )
+        
+        if cache_key:
+            self.cache.set(cache_key, content)
+        return content
+    
+    def _request_completion(self, payload, operation):
+        """الطلب الفعلي إلى chat/completions دون ذاكرة مؤقتة أو دمج"""
+        started = time.perf_counter()
+        with metrics.span(f"blackbox.{operation}", model=payload.get("model")):
+            try:
+                response = self._send(payload)
+            except requests.exceptions.RequestException as e:
+                metrics.observe_error("sync", operation, e)
+                raise
+            # elapsed في requests هو الزمن حتى وصول الترويسات (زمن أول بايت)
+            metrics.observe_response(
+                "sync", operation, response.status_code, started,
+                ttfb=response.elapsed.total_seconds(),
+                body_bytes=len(response.content)
+            )
+            response.raise_for_status()
+            content, usage = completion_fields(response.content)
+        metrics.observe_usage(operation, usage)
+        return content
+    
+    def stream_chat_completion(self, payload):
+        """بث الرد كأجزاء SSE محللة (dict لكل جزء) عبر مولد
+
+        يرفع requests.exceptions.RequestException عند فشل الطلب.
+        """
+        payload = dict(payload, stream=True)
+        headers = dict(self.headers, Accept="text/event-stream")
+        with self._send(payload, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            for data in iter_sse_data(response):
+                yield decode_response(data)
+    
+    def _stream_text(self, payload, operation="chat"):
+        """بث أجزاء النص فقط من الرد (الرد المخزن مؤقتاً يُرجع دفعة واحدة)"""
+        cache_key = self._cache_key(payload, operation)
+        if cache_key:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                metrics.observe_cache_hit("sync", operation)
+                yield cached
+                return
+        
+        if self.single_flight is None:
+            chunks = self._stream_upstream(payload, operation)
+        else:
+            # المشتركون في نفس البث المتزامن يستلمون الأجزاء من طلب واحد
+            chunks = self.single_flight.stream(
+                ("stream", self.base_url, ResponseCache.make_key(payload)),
+                lambda: self._stream_upstream(payload, operation)
+            )
+        
+        parts = []
+        for text in chunks:
+            parts.append(text)
+            yield text
+        
+        if cache_key:
+            self.cache.set(cache_key, "".join(parts))
+    
+    def _stream_upstream(self, payload, operation):
+        """بث نص الرد من الخادم مباشرة دون ذاكرة مؤقتة أو دمج"""
+        started = time.perf_counter()
+        ttfb = None
+        try:
+            for chunk in self.stream_chat_completion(payload):
+                if ttfb is None:
+                    ttfb = time.perf_counter() - started
+                # بعض الخوادم ترسل usage في الجزء الأخير من البث
+                metrics.observe_usage(operation, chunk.get('usage'))
+                choices = chunk.get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text:
+                    yield text
+        except requests.exceptions.RequestException as e:
+            metrics.observe_error("sync", operation, e)
+            raise
+        metrics.observe_response("sync", operation, 200, started, ttfb=ttfb)
+    
+    def complete(self, messages, operation="chat", model="blackbox-code", temperature=0.1):
+        """إرسال سجل رسائل (محادثة متعددة الأدوار) وإرجاع نص الرد"""
+        try:
+            content = self._chat_completion(
+                messages_payload(messages, model=model, temperature=temperature), operation
+            )
+            
+            return {
+                "success": True,
+                "response": content
+            }
+            
+        except requests.exceptions.RequestException as e:
+            return {
+                "success": False,
+                "error": f"خطأ في الطلب: {str(e)}"
+            }
+        except KeyError as e:
+            return {
+                "success": False,
+                "error": f"خطأ في تحليل الاستجابة: {str(e)}"
+            }
+    
+    def complete_stream(self, messages, operation="chat", model="blackbox-code", temperature=0.1):
+        """إرسال سجل رسائل مع بث نص الرد تدريجياً"""
+        return self._stream_text(
+            messages_payload(messages, model=model, temperature=temperature, stream=True), operation
+        )
+    
+    def generate_code_stream(self, prompt, language="python"):
+        """توليد كود مع بث النص تدريجياً"""
+        return self._stream_text(generate_code_payload(prompt, language, stream=True), "generate_code")
+    
+    def explain_code_stream(self, code):
+        """شرح الكود مع بث النص تدريجياً"""
+        return self._stream_text(explain_code_payload(code, stream=True), "explain_code")
+    
+    def debug_code_stream(self, code, error_message=""):
+        """تصحيح الأخطاء مع بث النص تدريجياً"""
+        return self._stream_text(debug_code_payload(code, error_message, stream=True), "debug_code")
+    
+    def chat_stream(self, message, context="", index=None, top_k=None):
+        """محادثة عامة مع بث نص الرد تدريجياً"""
+        if index is not None:
+            context = index.augment(message, context, top_k)
+        return self._stream_text(chat_payload(message, context, stream=True), "chat")
+    
     def generate_code(self, prompt, language="python"):
         """توليد كود برمجي بناءً على الوصف المطلوب"""
         try:
-            endpoint = f"{self.base_url}/chat/completions"
-            payload = {
-                "messages": [
-                    {
-                        "role": "user", 
-                        "content": f"Generate {language} code for: {prompt}"
-                    }
-                ],
-                "model": "blackbox-code",
-                "stream": False,
-                "max_tokens": 2000,
-                "temperature": 0.7
-            }
+            payload = generate_code_payload(prompt, language)
             
-            response = requests.post(endpoint, headers=self.headers, json=payload)
-            response.raise_for_status()
+            content = self._chat_completion(payload, "generate_code")
             
             return {
                 "success": True,
-                "code": response.json()['choices'][0]['message']['content'],
+                "code": content,
                 "language": language
             }
             
@@ -55,26 +322,13 @@ class BlackboxAIClient:
     def explain_code(self, code):
         """شرح الكود المُرسل"""
         try:
-            endpoint = f"{self.base_url}/chat/completions"
-            payload = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": f"Explain this code in detail:\n\n```\n{code}\n```"
-                    }
-                ],
-                "model": "blackbox-code",
-                "stream": False,
-                "max_tokens": 1500,
-                "temperature": 0.3
-            }
+            payload = explain_code_payload(code)
             
-            response = requests.post(endpoint, headers=self.headers, json=payload)
-            response.raise_for_status()
+            content = self._chat_completion(payload, "explain_code")
             
             return {
                 "success": True,
-                "explanation": response.json()['choices'][0]['message']['content']
+                "explanation": content
             }
             
         except requests.exceptions.RequestException as e:
@@ -91,30 +345,13 @@ class BlackboxAIClient:
     def debug_code(self, code, error_message=""):
         """تصحيح الأخطاء في الكود"""
         try:
-            prompt = f"Debug this code and fix any issues:\n\nCode:\n```\n{code}\n```"
-            if error_message:
-                prompt += f"\n\nError message: {error_message}"
-            
-            endpoint = f"{self.base_url}/chat/completions"
-            payload = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "model": "blackbox-code",
-                "stream": False,
-                "max_tokens": 2000,
-                "temperature": 0.1
-            }
+            payload = debug_code_payload(code, error_message)
             
-            response = requests.post(endpoint, headers=self.headers, json=payload)
-            response.raise_for_status()
+            content = self._chat_completion(payload, "debug_code")
             
             return {
                 "success": True,
-                "fixed_code": response.json()['choices'][0]['message']['content']
+                "fixed_code": content
             }
             
         except requests.exceptions.RequestException as e:
@@ -126,26 +363,13 @@ class BlackboxAIClient:
     def optimize_code(self, code, optimization_goal="performance"):
         """تحسين الكود للأداء أو القراءة"""
         try:
-            endpoint = f"{self.base_url}/chat/completions"
-            payload = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": f"Optimize this code for {optimization_goal}:\n\n```\n{code}\n```"
-                    }
-                ],
-                "model": "blackbox-code",
-                "stream": False,
-                "max_tokens": 2000,
-                "temperature": 0.2
-            }
+            payload = optimize_code_payload(code, optimization_goal)
             
-            response = requests.post(endpoint, headers=self.headers, json=payload)
-            response.raise_for_status()
+            content = self._chat_completion(payload, "optimize_code")
             
             return {
                 "success": True,
-                "optimized_code": response.json()['choices'][0]['message']['content'],
+                "optimized_code": content,
                 "optimization_type": optimization_goal
             }
             
@@ -158,26 +382,13 @@ class BlackboxAIClient:
     def convert_code(self, code, from_language, to_language):
         """تحويل الكود من لغة برمجة إلى أخرى"""
         try:
-            endpoint = f"{self.base_url}/chat/completions"
-            payload = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": f"Convert this {from_language} code to {to_language}:\n\n```{from_language}\n{code}\n```"
-                    }
-                ],
-                "model": "blackbox-code",
-                "stream": False,
-                "max_tokens": 2000,
-                "temperature": 0.1
-            }
+            payload = convert_code_payload(code, from_language, to_language)
             
-            response = requests.post(endpoint, headers=self.headers, json=payload)
-            response.raise_for_status()
+            content = self._chat_completion(payload, "convert_code")
             
             return {
                 "success": True,
-                "converted_code": response.json()['choices'][0]['message']['content'],
+                "converted_code": content,
                 "from_language": from_language,
                 "to_language": to_language
             }
@@ -188,33 +399,21 @@ class BlackboxAIClient:
                 "error": f"خطأ في الطلب: {str(e)}"
             }
     
-    def chat(self, message, context=""):
-        """محادثة عامة مع Blackbox AI"""
+    def chat(self, message, context="", index=None, top_k=None):
+        """محادثة عامة مع Blackbox AI
+
+        مع index (code_index.CodeIndex) تُضاف أقرب top_k مقاطع من المشروع إلى السياق بدلاً من لصق الملفات.
+        """
         try:
-            prompt = message
-            if context:
-                prompt = f"Context: {context}\n\nQuestion: {message}"
+            if index is not None:
+                context = index.augment(message, context, top_k)
+            payload = chat_payload(message, context)
             
-            endpoint = f"{self.base_url}/chat/completions"
-            payload = {
-                "messages": [
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "model": "blackbox",
-                "stream": False,
-                "max_tokens": 1500,
-                "temperature": 0.7
-            }
-            
-            response = requests.post(endpoint, headers=self.headers, json=payload)
-            response.raise_for_status()
+            content = self._chat_completion(payload, "chat")
             
             return {
                 "success": True,
-                "response": response.json()['choices'][0]['message']['content']
+                "response": content
             }
             
         except requests.exceptions.RequestException as e:
@@ -223,17 +422,22 @@ class BlackboxAIClient:
                 "error": f"خطأ في الطلب: {str(e)}"
             }
     
+    def batch(self, operation, items, max_workers=None):
+        """تنفيذ explain/debug/optimize/convert على عدة مدخلات بالتوازي
+
+        مولد يُرجع نتيجة كل عنصر مع مفتاح index فور اكتمالها، وأخطاء العناصر لا توقف الدفعة.
+        """
+        return run_batch(self, operation, items, max_workers=max_workers)
+    
     def test_connection(self):
         """اختبار الاتصال مع API"""
         try:
-            result = self.chat("Hello, can you help me with coding?")
-            if result["success"]:
-                return {
-                    "success": True,
-                    "message": "الاتصال مع Blackbox AI يعمل بنجاح"
-                }
-            else:
-                return result
+            # عملية مستقلة عن chat: الطلب ثابت فيُخزن مؤقتاً (BLACKBOX_CACHE_OPERATIONS) ولا يستهلك الحصة عند التكرار
+            self._chat_completion(chat_payload("Hello, can you help me with coding?"), "test_connection")
+            return {
+                "success": True,
+                "message": "الاتصال مع Blackbox AI يعمل بنجاح"
+            }
         except Exception as e:
             return {
                 "success": False,
@@ -0,0 +1,247 @@
+# browser_pool.py - مجمع متصفحات Chrome دافئة (headless) مشترك على مستوى العملية
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import WebDriverException
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from webdriver_manager.chrome import ChromeDriverManager
+
+from metrics import BROWSER_CHECKOUT_SECONDS, BROWSER_LOAD_SECONDS, timed
+
+DEFAULT_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', '2'))
+DEFAULT_MIN_IDLE = int(os.getenv('BROWSER_POOL_MIN_IDLE', '1'))
+DEFAULT_MAX_PAGES = int(os.getenv('BROWSER_MAX_PAGES', '50'))
+DEFAULT_IDLE_TIMEOUT = float(os.getenv('BROWSER_IDLE_TIMEOUT', '300'))
+DEFAULT_PAGE_LOAD_TIMEOUT = float(os.getenv('BROWSER_PAGE_LOAD_TIMEOUT', '30'))
+
+_driver_path = None
+_driver_path_lock = threading.Lock()
+
+
+def get_driver_path():
+    """مسار chromedriver؛ يُحدد مرة واحدة فقط لكل عملية بدلاً من كل نقرة"""
+    global _driver_path
+    with _driver_path_lock:
+        if _driver_path is None:
+            _driver_path = os.getenv('CHROMEDRIVER_PATH') or ChromeDriverManager().install()
+        return _driver_path
+
+
+def chrome_options():
+    """إعداد Chrome للتشغيل في وضع headless"""
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--disable-gpu")
+    return options
+
+
+class _PooledDriver:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.last_used = time.monotonic()
+
+
+class BrowserPool:
+    """مجمع متصفحات مُطلقة مسبقاً مع فحص الصحة وإعادة التدوير
+
+    - checkout/checkin: استعارة متصفح وإرجاعه (أو استخدام driver() كسياق)
+    - max_pages: يُعاد تشغيل المتصفح بعد هذا العدد من الصفحات للحد من تسرب الذاكرة
+    - idle_timeout: تُغلق المتصفحات الخاملة أطول من هذه المدة (مع إبقاء min_idle)
+    """
+
+    def __init__(self, size=None, min_idle=None, max_pages=None, idle_timeout=None):
+        self.size = size or DEFAULT_POOL_SIZE
+        self.min_idle = DEFAULT_MIN_IDLE if min_idle is None else min_idle
+        self.max_pages = max_pages or DEFAULT_MAX_PAGES
+        self.idle_timeout = idle_timeout or DEFAULT_IDLE_TIMEOUT
+        self._idle = []
+        self._total = 0
+        self._closed = False
+        self._condition = threading.Condition()
+        self.launched = 0
+        self.recycled = 0
+
+    def _launch(self):
+        driver = webdriver.Chrome(service=Service(get_driver_path()), options=chrome_options())
+        driver.set_page_load_timeout(DEFAULT_PAGE_LOAD_TIMEOUT)
+        with self._condition:
+            self.launched += 1
+        return _PooledDriver(driver)
+
+    @staticmethod
+    def _healthy(pooled):
+        try:
+            pooled.driver.window_handles
+            return True
+        except WebDriverException:
+            return False
+
+    def _discard(self, pooled):
+        try:
+            pooled.driver.quit()
+        except WebDriverException:
+            pass
+        with self._condition:
+            self._total -= 1
+            self._condition.notify()
+
+    def warm_up(self):
+        """إطلاق min_idle متصفحات مسبقاً حتى تكون أول صفحة على متصفح دافئ"""
+        while True:
+            with self._condition:
+                if self._closed or len(self._idle) >= self.min_idle or self._total >= self.size:
+                    return
+                self._total += 1
+            try:
+                pooled = self._launch()
+            except Exception as e:
+                with self._condition:
+                    self._total -= 1
+                print(f"⚠️ تحذير: فشل الإطلاق المسبق للمتصفح: {str(e)}")
+                return
+            with self._condition:
+                self._idle.append(pooled)
+                self._condition.notify()
+
+    def checkout(self, timeout=60):
+        """استعارة متصفح سليم من المجمع، أو إطلاق واحد جديد إن لم يكتمل الحجم"""
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                if self._closed:
+                    raise RuntimeError("مجمع المتصفحات مغلق")
+                if self._idle:
+                    pooled = self._idle.pop()
+                elif self._total < self.size:
+                    self._total += 1
+                    pooled = None
+                else:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("لا يوجد متصفح متاح في المجمع")
+                    self._condition.wait(remaining)
+                    continue
+
+            if pooled is None:
+                try:
+                    return self._launch()
+                except Exception:
+                    with self._condition:
+                        self._total -= 1
+                        self._condition.notify()
+                    raise
+
+            if self._healthy(pooled):
+                return pooled
+            self._discard(pooled)
+
+    def checkin(self, pooled, healthy=True):
+        """إرجاع المتصفح للمجمع، أو إغلاقه إذا تعطل أو تجاوز max_pages"""
+        pooled.pages += 1
+        pooled.last_used = time.monotonic()
+
+        if healthy and pooled.pages < self.max_pages and not self._closed:
+            try:
+                # تحرير ذاكرة الصفحة السابقة وعزل الجلسات عن بعضها
+                pooled.driver.delete_all_cookies()
+                pooled.driver.get("about:blank")
+            except WebDriverException:
+                healthy = False
+            if healthy:
+                with self._condition:
+                    self._idle.append(pooled)
+                    self._condition.notify()
+                return
+
+        if pooled.pages >= self.max_pages:
+            with self._condition:
+                self.recycled += 1
+        self._discard(pooled)
+
+    @contextmanager
+    def driver(self, timeout=60):
+        """سياق يستعير متصفحاً ويعيده تلقائياً"""
+        with timed(BROWSER_CHECKOUT_SECONDS):
+            pooled = self.checkout(timeout)
+        healthy = True
+        try:
+            yield pooled.driver
+        except WebDriverException:
+            healthy = False
+            raise
+        finally:
+            self.checkin(pooled, healthy)
+
+    def evict_idle(self):
+        """إغلاق المتصفحات الخاملة منذ أكثر من idle_timeout مع إبقاء min_idle"""
+        now = time.monotonic()
+        expired = []
+        with self._condition:
+            keep = []
+            for pooled in sorted(self._idle, key=lambda p: p.last_used, reverse=True):
+                if len(keep) >= self.min_idle and now - pooled.last_used > self.idle_timeout:
+                    expired.append(pooled)
+                else:
+                    keep.append(pooled)
+            self._idle = keep
+        for pooled in expired:
+            self._discard(pooled)
+        return len(expired)
+
+    def close(self):
+        """إغلاق جميع المتصفحات الخاملة ومنع الاستعارات الجديدة"""
+        with self._condition:
+            self._closed = True
+            idle, self._idle = self._idle, []
+        for pooled in idle:
+            self._discard(pooled)
+
+    def stats(self):
+        with self._condition:
+            return {
+                "size": self.size,
+                "open": self._total,
+                "idle": len(self._idle),
+                "launched": self.launched,
+                "recycled": self.recycled
+            }
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _reaper(pool, interval):
+    while not pool._closed:
+        time.sleep(interval)
+        pool.evict_idle()
+
+
+def get_browser_pool():
+    """المجمع المشترك على مستوى العملية مع إطلاق مسبق وخيط لإخلاء المتصفحات الخاملة"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool()
+            threading.Thread(target=_pool.warm_up, daemon=True).start()
+            threading.Thread(
+                target=_reaper,
+                args=(_pool, max(5.0, _pool.idle_timeout / 4)),
+                daemon=True
+            ).start()
+        return _pool
+
+
+def fetch_page_source(url):
+    """تحميل الصفحة على متصفح دافئ من المجمع وإرجاع HTML بعد التنفيذ"""
+    with get_browser_pool().driver() as driver:
+        with timed(BROWSER_LOAD_SECONDS):
+            driver.get(url)
+        return driver.page_source
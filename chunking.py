@@ -0,0 +1,454 @@
+# chunking.py - تقسيم المدخلات الكبيرة على حدود نحوية ومعالجتها بأسلوب map-reduce مع ذاكرة مؤقتة لكل جزء
+import ast
+import hashlib
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from batch import run_batch
+from conversation import estimate_tokens
+from response_cache import ResponseCache
+
+# المدخلات الأصغر من العتبة تُرسل كما هي في طلب واحد
+DEFAULT_CHUNK_THRESHOLD = int(os.getenv('CHUNK_THRESHOLD', '2000'))
+DEFAULT_CHUNK_TOKENS = int(os.getenv('CHUNK_MAX_TOKENS', '1200'))
+DEFAULT_CHUNK_WORKERS = int(os.getenv('CHUNK_WORKERS', '4'))
+DEFAULT_CHUNK_CACHE_TTL = float(os.getenv('CHUNK_CACHE_TTL', str(24 * 3600)))
+# أقصى حجم لمدخل استدعاء reduce؛ الشروح الأكبر تُجمع على مراحل (مجموعات ثم نتائجها)
+DEFAULT_REDUCE_TOKENS = int(os.getenv('CHUNK_REDUCE_MAX_TOKENS', '6000'))
+
+# العمليات التي تدعم التقسيم (optimize وconvert تُدمج محلياً، وexplain باستدعاء reduce)
+CHUNKED_OPERATIONS = ("explain_code", "optimize_code", "convert_code")
+
+REDUCE_PROMPT = (
+    "The following are explanations of consecutive parts of one {language} file. Combine them into "
+    "a single coherent explanation of the whole file: start with a short overview of what the file "
+    "does, then walk through the parts in order, and remove repetition.\n\n"
+)
+
+PARTIAL_REDUCE_PROMPT = (
+    "The following are explanations of consecutive parts of one {language} file. Combine them into "
+    "one concise explanation of these parts only, in order, keeping the names of functions and classes; "
+    "it will later be merged with explanations of the rest of the file.\n\n"
+)
+
+# سطر يبدأ تعريفاً في لغات شائعة (JavaScript وJava وC++ وGo وRust...)
+_DEFINITION = re.compile(
+    r"^\s*(?:export\s+|public\s+|private\s+|protected\s+|static\s+|async\s+|pub(?:\([^)]*\))?\s+)*"
+    r"(?:function\*?|class|interface|struct|enum|impl|trait|fn|func|def|module|namespace)\s+([A-Za-z_$][\w$]*)"
+)
+_CODE_BLOCK = re.compile(r"```[\w+#.-]*\n(.*?)```", re.DOTALL)
+
+
+def _unit(lines, start, end, name=None):
+    return {"start": start, "end": end, "names": [name] if name else [], "text": "".join(lines[start:end])}
+
+
+def _split_lines(lines, start, end, max_tokens):
+    """تقسيم مدى أسطر طويل إلى أجزاء لا تتجاوز max_tokens، مع تفضيل القطع عند الأسطر الفارغة"""
+    units = []
+    piece_start = start
+    last_blank = None
+    size = 0
+    for index in range(start, end):
+        size += estimate_tokens(lines[index])
+        if not lines[index].strip():
+            last_blank = index + 1
+        if size > max_tokens and index > piece_start:
+            cut = last_blank if last_blank and last_blank > piece_start else index
+            units.append(_unit(lines, piece_start, cut))
+            piece_start = cut
+            last_blank = None
+            size = sum(estimate_tokens(line) for line in lines[piece_start:index + 1])
+    if piece_start < end:
+        units.append(_unit(lines, piece_start, end))
+    return units
+
+
+def _python_units(lines, body, start, end, max_tokens):
+    """وحدات متجاورة تغطي [start, end): كل تعريف مع التعليقات والأسطر التي تسبقه"""
+    units = []
+    position = start
+    for node in body:
+        node_end = node.end_lineno
+        name = getattr(node, "name", None)
+        if estimate_tokens("".join(lines[position:node_end])) <= max_tokens:
+            units.append(_unit(lines, position, node_end, name))
+        elif isinstance(node, ast.ClassDef) and len(node.body) > 1:
+            # صنف كبير يُقسم على حدود توابعه، ورأسه يلحق بالتابع الأول
+            units.extend(_python_units(lines, node.body, position, node_end, max_tokens))
+        else:
+            units.extend(_split_lines(lines, position, node_end, max_tokens))
+        position = node_end
+    if position < end:
+        if units and estimate_tokens("".join(lines[position:end])) + estimate_tokens(units[-1]["text"]) <= max_tokens:
+            units[-1] = dict(units[-1], end=end, text=units[-1]["text"] + "".join(lines[position:end]))
+        else:
+            units.extend(_split_lines(lines, position, end, max_tokens))
+    return units
+
+
+def _generic_units(lines, max_tokens):
+    """حدود تقريبية للغات الأخرى: سطر خارج أي أقواس {} يلي سطراً فارغاً أو نهاية كتلة"""
+    units = []
+    depth = 0
+    unit_start = 0
+    name = None
+    for index, line in enumerate(lines):
+        stripped = line.strip()
+        previous = lines[index - 1].strip() if index else ""
+        boundary = (
+            index > unit_start and depth <= 0 and stripped and not stripped.startswith(("}", ")", "]", "."))
+            and (not previous or previous.endswith(("}", "};", ";")))
+        )
+        if boundary:
+            units.append(_unit(lines, unit_start, index, name))
+            unit_start = index
+            name = None
+        match = _DEFINITION.match(line)
+        if match and name is None:
+            name = match.group(1)
+        # عد تقريبي للأقواس دون تحليل النصوص والتعليقات
+        depth += line.count("{") - line.count("}")
+    if unit_start < len(lines):
+        units.append(_unit(lines, unit_start, len(lines), name))
+
+    sized = []
+    for unit in units:
+        if estimate_tokens(unit["text"]) <= max_tokens:
+            sized.append(unit)
+        else:
+            pieces = _split_lines(lines, unit["start"], unit["end"], max_tokens)
+            pieces[0]["names"] = unit["names"]
+            sized.extend(pieces)
+    return sized
+
+
+def _pack(units, max_tokens):
+    """جمع الوحدات المتجاورة في أجزاء بحدود مستقرة أمام التعديل
+
+    يُغلق الجزء عند امتلائه أو بعد وحدة "حدّية" حسب بصمة نصها وحدها (تقسيم معرّف بالمحتوى)، فتعديل
+    دالة لا يغير حدود الأجزاء البعيدة عنها وتبقى نتائجها في الذاكرة المؤقتة صالحة.
+    """
+    chunks = []
+    current = []
+    size = 0
+    for unit in units:
+        tokens = estimate_tokens(unit["text"])
+        if current and size + tokens > max_tokens:
+            chunks.append(current)
+            current, size = [], 0
+        current.append(unit)
+        size += tokens
+        if hashlib.sha256(unit["text"].encode("utf-8")).digest()[0] % 4 == 0:
+            chunks.append(current)
+            current, size = [], 0
+    if current:
+        chunks.append(current)
+    return [
+        {
+            "index": index,
+            "start_line": group[0]["start"] + 1,
+            "end_line": group[-1]["end"],
+            "names": [name for unit in group for name in unit["names"]],
+            "text": "".join(unit["text"] for unit in group)
+        }
+        for index, group in enumerate(chunks)
+    ]
+
+
+def split_code(code, language=None, max_tokens=None):
+    """تقسيم الكود إلى أجزاء على حدود الدوال والأصناف (ast لبايثون، وتقدير تقريبي لغيرها)
+
+    كل جزء {"index", "start_line", "end_line", "names", "text"}، وربط نصوص الأجزاء بالترتيب يعيد الكود كما هو.
+    """
+    max_tokens = max_tokens or DEFAULT_CHUNK_TOKENS
+    lines = code.splitlines(keepends=True)
+    units = None
+    if language in (None, "python"):
+        try:
+            tree = ast.parse(code)
+        except (SyntaxError, ValueError):
+            tree = None
+        if tree is not None:
+            units = _python_units(lines, tree.body, 0, len(lines), max_tokens)
+    if units is None:
+        units = _generic_units(lines, max_tokens)
+    return _pack(units, max_tokens)
+
+
+def needs_chunking(code, threshold=None):
+    return estimate_tokens(code) > (threshold or DEFAULT_CHUNK_THRESHOLD)
+
+
+def _split_response(text):
+    """فصل كتل الكود في الرد عن الشرح المرافق"""
+    blocks = _CODE_BLOCK.findall(text)
+    if not blocks:
+        return text.strip(), ""
+    return "\n".join(block.rstrip("\n") for block in blocks), _CODE_BLOCK.sub("", text).strip()
+
+
+def _label(chunk):
+    names = f": {', '.join(chunk['names'][:5])}" if chunk["names"] else ""
+    return f"Part {chunk['index'] + 1} (lines {chunk['start_line']}-{chunk['end_line']}{names})"
+
+
+def _section(chunk, text):
+    """شرح جزء أو مجموعة أجزاء متجاورة في مدخل reduce"""
+    return {
+        "first": chunk["index"] + 1,
+        "last": chunk["index"] + 1,
+        "start_line": chunk["start_line"],
+        "end_line": chunk["end_line"],
+        "names": chunk["names"],
+        "text": text
+    }
+
+
+def _section_label(section):
+    if section["first"] == section["last"]:
+        names = f": {', '.join(section['names'][:5])}" if section["names"] else ""
+        return f"Part {section['first']} (lines {section['start_line']}-{section['end_line']}{names})"
+    return f"Parts {section['first']}-{section['last']} (lines {section['start_line']}-{section['end_line']})"
+
+
+def _truncate(text, max_tokens):
+    """قص النص إلى max_tokens تقريباً (بنفس تقدير estimate_tokens)"""
+    max_chars = max_tokens * 4
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars].rstrip() + "\n[...]"
+
+
+def reduce_prompt(sections, language="code", template=REDUCE_PROMPT):
+    body = "\n\n".join(f"## {_section_label(section)}\n{section['text']}" for section in sections)
+    return template.format(language=language) + body
+
+
+def _group_sections(sections, max_tokens):
+    """مجموعات متجاورة لا يتجاوز مدخل كل منها max_tokens"""
+    groups = [[]]
+    size = 0
+    for section in sections:
+        tokens = estimate_tokens(section["text"]) + estimate_tokens(_section_label(section))
+        if groups[-1] and size + tokens > max_tokens:
+            groups.append([])
+            size = 0
+        groups[-1].append(section)
+        size += tokens
+    return groups
+
+
+def merge_code(chunks, responses, language=""):
+    """دمج نتائج optimize/convert محلياً: الكود بترتيب الأجزاء ثم ملاحظات كل جزء"""
+    codes = []
+    notes = []
+    for chunk, response in zip(chunks, responses):
+        code, note = _split_response(response)
+        codes.append(code)
+        if note:
+            notes.append(f"**{_label(chunk)}:** {note}")
+    merged = f"```{language}\n" + "\n\n".join(codes) + "\n```"
+    if notes:
+        merged += "\n\n" + "\n\n".join(notes)
+    return merged
+
+
+def _check_operation(operation):
+    if operation not in CHUNKED_OPERATIONS:
+        raise ValueError(f"عملية غير مدعومة في التقسيم: {operation}")
+
+
+def _chunk_key(operation, args, chunk):
+    return ResponseCache.make_key({"operation": operation, "args": list(args), "chunk": chunk["text"]})
+
+
+def _response_text(result):
+    """نص نتيجة {"success", "response"} أو رفع RuntimeError بخطئها"""
+    if not result.get("success"):
+        raise RuntimeError(result.get("error", "خطأ غير معروف"))
+    return result["response"]
+
+
+class ChunkedBackend:
+    """واجهة خلفية تقسم المدخلات الكبيرة لـ explain/optimize/convert وتمرر بقية العمليات كما هي
+
+    map: الأجزاء تُعالج بالتوازي عبر run_batch، ونتيجة كل جزء تُخزن بمفتاح من نصه والعملية،
+    فإعادة التشغيل على ملف معدل لا تعيد إلا الأجزاء التي تغيرت.
+    reduce: explain باستدعاء أخير يجمع الشروح (على مراحل إن تجاوزت reduce_tokens)،
+    وoptimize/convert بدمج الكود محلياً بالترتيب.
+    """
+
+    def __init__(self, backend, threshold=None, max_tokens=None, max_workers=None, cache=None, progress=None):
+        self.backend = backend
+        # progress(done, total) الافتراضي لمرحلة map (مثل تحديث تقدم مهمة خلفية)
+        self.progress = progress
+        self.threshold = threshold or DEFAULT_CHUNK_THRESHOLD
+        self.max_tokens = max_tokens or DEFAULT_CHUNK_TOKENS
+        self.max_workers = max_workers or DEFAULT_CHUNK_WORKERS
+        self.cache = get_chunk_cache() if cache is None else (cache or None)
+        self.reduce_tokens = DEFAULT_REDUCE_TOKENS
+
+    def __getattr__(self, attribute):
+        return getattr(self.backend, attribute)
+
+    def _map(self, operation, chunks, args, stats, progress=None):
+        """نتائج الأجزاء بالترتيب، أو رفع RuntimeError بأول خطأ (الأجزاء الناجحة تبقى مخزنة)
+
+        يسجل في stats["cached"] عدد الأجزاء التي جاءت من الذاكرة المؤقتة.
+        """
+        responses = [None] * len(chunks)
+        keys = [_chunk_key(operation, args, chunk) for chunk in chunks]
+        missing = []
+        for index, key in enumerate(keys):
+            cached = self.cache.get(key) if self.cache is not None else None
+            if cached is not None:
+                responses[index] = cached
+            else:
+                missing.append(index)
+        stats["cached"] = len(chunks) - len(missing)
+
+        done = len(chunks) - len(missing)
+        if progress:
+            progress(done, len(chunks))
+        items = [(chunks[index]["text"], *args) for index in missing]
+        for result in run_batch(self.backend, operation, items, max_workers=self.max_workers):
+            index = missing[result["index"]]
+            if not result.get("success"):
+                raise RuntimeError(f"{_label(chunks[index])}: {result.get('error', 'خطأ غير معروف')}")
+            responses[index] = result["response"]
+            if self.cache is not None:
+                self.cache.set(keys[index], result["response"])
+            done += 1
+            if progress:
+                progress(done, len(chunks))
+        return responses
+
+    def _reduce_group(self, group, language):
+        """استدعاء reduce جزئي لمجموعة أقسام (مخزن مؤقتاً بنص مدخله) وإرجاع قسم واحد يجمعها"""
+        prompt = reduce_prompt(group, language, PARTIAL_REDUCE_PROMPT)
+        key = ResponseCache.make_key({"operation": "reduce", "prompt": prompt})
+        text = self.cache.get(key) if self.cache is not None else None
+        if text is None:
+            result = self.backend.converse([{"role": "user", "content": prompt}], "reduce")
+            if not result.get("success"):
+                raise RuntimeError(f"{_section_label(group[0])}: {result.get('error', 'خطأ غير معروف')}")
+            text = result["response"]
+            if self.cache is not None:
+                self.cache.set(key, text)
+        return {
+            "first": group[0]["first"],
+            "last": group[-1]["last"],
+            "start_line": group[0]["start_line"],
+            "end_line": group[-1]["end_line"],
+            "names": [],
+            "text": text
+        }
+
+    def _reduce_input(self, chunks, responses, language):
+        """مدخل استدعاء reduce الأخير ضمن reduce_tokens، مع الجمع على مراحل إن كانت الشروح أكبر منه"""
+        overhead = estimate_tokens(PARTIAL_REDUCE_PROMPT)
+        # كل قسم لا يتجاوز نصف المتاح فتضم كل مجموعة قسمين على الأقل ويقل عدد الأقسام في كل مرحلة
+        section_tokens = max(1, (self.reduce_tokens - overhead) // 2)
+        sections = [_section(chunk, response) for chunk, response in zip(chunks, responses)]
+        while True:
+            sections = [dict(section, text=_truncate(section["text"], section_tokens)) for section in sections]
+            prompt = reduce_prompt(sections, language)
+            if estimate_tokens(prompt) <= self.reduce_tokens or len(sections) == 1:
+                return prompt
+            groups = _group_sections(sections, self.reduce_tokens - overhead)
+            with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+                sections = list(pool.map(lambda group: self._reduce_group(group, language), groups))
+
+    def _run(self, operation, code, args, language, progress=None):
+        """(النتيجة أو None مع prompt لاستدعاء reduce، prompt، إحصاء الأجزاء {"chunks", "cached"})"""
+        chunks = split_code(code, language, self.max_tokens)
+        # عدد الأجزاء وما جاء منها من الذاكرة المؤقتة، يُرجع مع النتيجة لا كحالة مشتركة بين الاستدعاءات
+        stats = {"chunks": len(chunks), "cached": 0}
+        try:
+            responses = self._map(operation, chunks, args, stats, progress or self.progress)
+            if operation == "explain_code":
+                return None, self._reduce_input(chunks, responses, language or "code"), stats
+        except RuntimeError as e:
+            return {"success": False, "error": str(e)}, None, stats
+        target = args[-1] if operation == "convert_code" else (language or "")
+        return {"success": True, "response": merge_code(chunks, responses, target)}, None, stats
+
+    def map_reduce(self, operation, code, *args, language=None, progress=None):
+        """تنفيذ operation على code مقسماً (أو مباشرة إن كان صغيراً)؛ progress(done, total) اختياري
+
+        نتيجة الملف المقسم تحمل chunks: {"chunks", "cached"}.
+        """
+        _check_operation(operation)
+        if not needs_chunking(code, self.threshold):
+            return getattr(self.backend, operation)(code, *args)
+        result, prompt, stats = self._run(operation, code, args, language, progress)
+        if result is None:
+            result = self.backend.converse([{"role": "user", "content": prompt}], "reduce")
+        return dict(result, chunks=stats)
+
+    def map_reduce_stream(self, operation, code, *args, language=None, progress=None):
+        """مثل map_reduce مع بث استدعاء reduce الأخير (الأجزاء نفسها لا تُبث)
+
+        المولد يُرجع (قيمة StopIteration) إحصاء الأجزاء أو None إن لم يُقسم الكود.
+        """
+        _check_operation(operation)
+        if not needs_chunking(code, self.threshold):
+            stream = getattr(self.backend, f"{operation}_stream", None)
+            if stream is not None:
+                yield from stream(code, *args)
+            else:
+                # الواجهات الخلفية لا تبث optimize وconvert، فنُرجع ردها كاملاً كجزء واحد
+                yield _response_text(getattr(self.backend, operation)(code, *args))
+            return None
+        result, prompt, stats = self._run(operation, code, args, language, progress)
+        if result is None:
+            yield from self.backend.converse_stream([{"role": "user", "content": prompt}], "reduce")
+        else:
+            yield _response_text(result)
+        return stats
+
+    def explain_code(self, code):
+        """شرح الكود (مقسماً إن كان كبيراً)"""
+        return self.map_reduce("explain_code", code)
+
+    def explain_code_stream(self, code):
+        """شرح الكود مع بث النص (يُبث الشرح المجمع للملفات الكبيرة)"""
+        return self.map_reduce_stream("explain_code", code)
+
+    def optimize_code(self, code, optimization_goal="performance"):
+        """تحسين الكود (مقسماً إن كان كبيراً)"""
+        return self.map_reduce("optimize_code", code, optimization_goal)
+
+    def optimize_code_stream(self, code, optimization_goal="performance"):
+        """تحسين الكود كمولد نصوص (الكود المدمج يُرجع دفعة واحدة)"""
+        return self.map_reduce_stream("optimize_code", code, optimization_goal)
+
+    def convert_code(self, code, from_language, to_language):
+        """تحويل الكود (مقسماً إن كان كبيراً)"""
+        return self.map_reduce("convert_code", code, from_language, to_language, language=from_language)
+
+    def convert_code_stream(self, code, from_language, to_language):
+        """تحويل الكود كمولد نصوص (الكود المدمج يُرجع دفعة واحدة)"""
+        return self.map_reduce_stream("convert_code", code, from_language, to_language, language=from_language)
+
+    def batch(self, operation, items, max_workers=None):
+        """تنفيذ عملية على عدة مدخلات بالتوازي، والكبيرة منها مقسمة"""
+        return run_batch(self, operation, items, max_workers=max_workers)
+
+
+_chunk_cache = None
+_chunk_cache_lock = threading.Lock()
+
+
+def get_chunk_cache():
+    """ذاكرة نتائج الأجزاء المشتركة (CHUNK_CACHE=0 للتعطيل، وCHUNK_CACHE_PATH لطبقة القرص)"""
+    global _chunk_cache
+    if os.getenv('CHUNK_CACHE', '1') != '1':
+        return None
+    with _chunk_cache_lock:
+        if _chunk_cache is None:
+            _chunk_cache = ResponseCache(ttl=DEFAULT_CHUNK_CACHE_TTL, disk_path=os.getenv('CHUNK_CACHE_PATH') or None)
+        return _chunk_cache
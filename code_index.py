@@ -0,0 +1,372 @@
+# code_index.py - فهرس محلي لمقاطع كود المشروع (BM25 على فهرس مقلوب في SQLite) يُحدّث تدريجياً ويغذي المحادثة بأقرب المقاطع
+import array
+import hashlib
+import math
+import os
+import random
+import re
+import sqlite3
+import threading
+import time
+from collections import Counter
+
+from chunking import split_code
+
+DEFAULT_INDEX_ROOT = os.getenv('CODE_INDEX_ROOT', '.')
+# ملف الفهرس داخل مجلد المشروع نفسه، فلكل مشروع فهرسه
+DEFAULT_INDEX_NAME = os.getenv('CODE_INDEX_NAME', '.code_index.db')
+DEFAULT_TOP_K = int(os.getenv('CODE_INDEX_TOP_K', '5'))
+DEFAULT_SNIPPET_TOKENS = int(os.getenv('CODE_INDEX_SNIPPET_TOKENS', '300'))
+DEFAULT_MAX_CONTEXT_CHARS = int(os.getenv('CODE_INDEX_MAX_CONTEXT_CHARS', '6000'))
+DEFAULT_MAX_FILE_BYTES = int(os.getenv('CODE_INDEX_MAX_FILE_BYTES', str(512 * 1024)))
+# MinHash لاستبعاد المقاطع شبه المكررة من النتائج (يبطئ الفهرسة، فهو اختياري)
+DEFAULT_MINHASH = os.getenv('CODE_INDEX_MINHASH', '0') == '1'
+DEFAULT_DUPLICATE_THRESHOLD = float(os.getenv('CODE_INDEX_DUPLICATE_THRESHOLD', '0.8'))
+
+LANGUAGES = {
+    ".py": "python",
+    ".js": "javascript",
+    ".mjs": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".jsx": "javascript",
+    ".java": "java",
+    ".c": "c",
+    ".h": "c",
+    ".cpp": "cpp",
+    ".hpp": "cpp",
+    ".cs": "csharp",
+    ".go": "go",
+    ".rs": "rust",
+    ".rb": "ruby",
+    ".php": "php",
+    ".sh": "bash",
+    ".sql": "sql",
+    ".html": "html",
+    ".css": "css",
+    ".md": "markdown",
+    ".json": "json",
+    ".toml": "toml",
+    ".yaml": "yaml",
+    ".yml": "yaml"
+}
+SKIP_DIRS = {"node_modules", "__pycache__", "venv", "dist", "build", "target", "attached_assets"}
+SKIP_FILES = {"package-lock.json", "yarn.lock", "Cargo.lock"}
+
+# ثوابت BM25 المعتادة
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+MINHASH_PERMUTATIONS = 64
+_MERSENNE_PRIME = (1 << 61) - 1
+_PERMUTATIONS = [
+    (random.Random(seed).randrange(1, _MERSENNE_PRIME), random.Random(-seed).randrange(_MERSENNE_PRIME))
+    for seed in range(1, MINHASH_PERMUTATIONS + 1)
+]
+
+_WORD = re.compile(r"\w+")
+_SUBWORD = re.compile(r"[A-Z]+(?![a-z])|[A-Z]?[a-z]+|\d+")
+_SUFFIXES = ("ing", "ed", "es", "s")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i in is it its me my of on or so that the this "
+    "to was what when where which who why with you your".split()
+)
+
+
+def _term(word):
+    """تطبيع كلمة: أحرف صغيرة مع حذف لواحق الإنجليزية الشائعة (jobs → job، recovered → recover)"""
+    word = word.lower()
+    if word.isascii():
+        for suffix in _SUFFIXES:
+            if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+                return word[:-len(suffix)]
+    return word
+
+
+def tokenize(text):
+    """مصطلحات النص مع أجزاء المعرفات المركبة (getUserName → get, user, name)، دون الكلمات الشائعة"""
+    tokens = []
+    for word in _WORD.findall(text):
+        if len(word) > 1 and word.lower() not in STOPWORDS:
+            tokens.append(_term(word))
+        parts = [part for piece in word.split("_") for part in _SUBWORD.findall(piece)]
+        if len(parts) > 1:
+            tokens.extend(_term(part) for part in parts if len(part) > 1 and part.lower() not in STOPWORDS)
+    return tokens
+
+
+def minhash(tokens):
+    """بصمة MinHash لثلاثيات الكلمات المتتالية؛ نسبة تطابق بصمتين تقدير لتشابه Jaccard"""
+    shingles = {" ".join(tokens[index:index + 3]) for index in range(max(1, len(tokens) - 2))}
+    hashes = [
+        int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "little")
+        for shingle in shingles
+    ]
+    return array.array("Q", (
+        min((a * value + b) % _MERSENNE_PRIME for value in hashes) for a, b in _PERMUTATIONS
+    )).tobytes()
+
+
+def similarity(signature, other):
+    first = array.array("Q", signature)
+    second = array.array("Q", other)
+    return sum(1 for left, right in zip(first, second) if left == right) / len(first)
+
+
+class CodeIndex:
+    """فهرس BM25 لمقاطع ملفات مشروع واحد، محفوظ في SQLite
+
+    - update() يعيد فهرسة الملفات التي تغير وقت تعديلها أو حجمها ثم بصمتها فقط، ويحذف المحذوفة
+    - search() يُرجع أفضل top_k مقطعاً (دالة أو صنف أو مجموعة منها) لسؤال
+    - context_for() يصوغ المقاطع سياقاً جاهزاً لـ chat() بدلاً من لصق الملفات كاملة
+    """
+
+    def __init__(self, root=None, path=None, snippet_tokens=None, minhash=None, max_file_bytes=None):
+        self.root = os.path.abspath(root or DEFAULT_INDEX_ROOT)
+        self.path = path or os.path.join(self.root, DEFAULT_INDEX_NAME)
+        self.snippet_tokens = snippet_tokens or DEFAULT_SNIPPET_TOKENS
+        self.minhash = DEFAULT_MINHASH if minhash is None else minhash
+        self.max_file_bytes = max_file_bytes or DEFAULT_MAX_FILE_BYTES
+        self._local = threading.local()
+        # تحديث واحد في كل مرة داخل العملية؛ العمليات الأخرى تتزامن عبر أقفال SQLite
+        self._update_lock = threading.Lock()
+        self._connection().executescript(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, mtime REAL NOT NULL, size INTEGER NOT NULL, hash TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS snippets ("
+            "id INTEGER PRIMARY KEY, path TEXT NOT NULL, start_line INTEGER, end_line INTEGER,"
+            " names TEXT, text TEXT NOT NULL, length INTEGER NOT NULL, signature BLOB);"
+            "CREATE INDEX IF NOT EXISTS snippets_path ON snippets (path);"
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, snippet_id INTEGER NOT NULL, tf INTEGER NOT NULL,"
+            " PRIMARY KEY (term, snippet_id)) WITHOUT ROWID;"
+            "CREATE INDEX IF NOT EXISTS postings_snippet ON postings (snippet_id);"
+        )
+
+    def _connection(self):
+        # اتصال SQLite لكل خيط لأن الاتصال الواحد لا يُشارك بين الخيوط بأمان
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def _files(self):
+        """ملفات المشروع القابلة للفهرسة كمسارات نسبية"""
+        for directory, subdirectories, filenames in os.walk(self.root):
+            subdirectories[:] = sorted(
+                name for name in subdirectories if not name.startswith(".") and name not in SKIP_DIRS
+            )
+            for filename in sorted(filenames):
+                if filename.startswith(".") or filename in SKIP_FILES:
+                    continue
+                if os.path.splitext(filename)[1].lower() in LANGUAGES:
+                    yield os.path.relpath(os.path.join(directory, filename), self.root)
+
+    def _delete_snippets(self, connection, path):
+        connection.execute(
+            "DELETE FROM postings WHERE snippet_id IN (SELECT id FROM snippets WHERE path = ?)", (path,)
+        )
+        connection.execute("DELETE FROM snippets WHERE path = ?", (path,))
+
+    def _index_file(self, connection, path, text):
+        language = LANGUAGES.get(os.path.splitext(path)[1].lower())
+        self._delete_snippets(connection, path)
+        count = 0
+        for chunk in split_code(text, language, self.snippet_tokens):
+            if not chunk["text"].strip():
+                continue
+            # مسار الملف جزء من نص المقطع المفهرس، فأسئلة مثل "server routes" تجد server.js
+            tokens = tokenize(f"{path} {chunk['text']}")
+            if not tokens:
+                continue
+            cursor = connection.execute(
+                "INSERT INTO snippets (path, start_line, end_line, names, text, length, signature)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    path, chunk["start_line"], chunk["end_line"], ",".join(chunk["names"]), chunk["text"],
+                    len(tokens), minhash(tokens) if self.minhash else None
+                )
+            )
+            connection.executemany(
+                "INSERT INTO postings (term, snippet_id, tf) VALUES (?, ?, ?)",
+                [(term, cursor.lastrowid, tf) for term, tf in Counter(tokens).items()]
+            )
+            count += 1
+        return count
+
+    def _remove_file(self, connection, path):
+        self._delete_snippets(connection, path)
+        connection.execute("DELETE FROM files WHERE path = ?", (path,))
+
+    def update(self, progress=None):
+        """تحديث الفهرس تدريجياً: الملفات الجديدة والمعدلة فقط، وحذف الملفات التي لم تعد موجودة
+
+        progress(done, total) يُستدعى بعد كل ملف. يُرجع إحصاءات التحديث.
+        """
+        started = time.perf_counter()
+        with self._update_lock:
+            connection = self._connection()
+            known = {
+                row["path"]: row
+                for row in connection.execute("SELECT path, mtime, size, hash FROM files").fetchall()
+            }
+            paths = list(self._files())
+            stats = {"files": len(paths), "indexed": 0, "snippets": 0, "unchanged": 0, "removed": 0, "skipped": 0}
+            for done, path in enumerate(paths, 1):
+                full_path = os.path.join(self.root, path)
+                try:
+                    stat = os.stat(full_path)
+                    previous = known.get(path)
+                    if previous is not None and previous["mtime"] == stat.st_mtime and previous["size"] == stat.st_size:
+                        stats["unchanged"] += 1
+                        continue
+                    if stat.st_size > self.max_file_bytes:
+                        stats["skipped"] += 1
+                        continue
+                    with open(full_path, "rb") as file:
+                        data = file.read()
+                    digest = hashlib.sha256(data).hexdigest()
+                    text = data.decode("utf-8")
+                except (OSError, UnicodeDecodeError):
+                    # ملف حُذف أثناء المسح أو ليس نصاً
+                    stats["skipped"] += 1
+                    continue
+                finally:
+                    if progress:
+                        progress(done, len(paths))
+
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    # نفس المحتوى بوقت تعديل جديد (checkout أو touch): لا حاجة لإعادة التقسيم
+                    if previous is None or previous["hash"] != digest:
+                        stats["snippets"] += self._index_file(connection, path, text)
+                        stats["indexed"] += 1
+                    else:
+                        stats["unchanged"] += 1
+                    connection.execute(
+                        "INSERT OR REPLACE INTO files (path, mtime, size, hash) VALUES (?, ?, ?, ?)",
+                        (path, stat.st_mtime, stat.st_size, digest)
+                    )
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+
+            removed = set(known) - set(paths)
+            if removed:
+                connection.execute("BEGIN IMMEDIATE")
+                try:
+                    for path in removed:
+                        self._remove_file(connection, path)
+                    connection.execute("COMMIT")
+                except BaseException:
+                    connection.execute("ROLLBACK")
+                    raise
+                stats["removed"] = len(removed)
+        stats["elapsed"] = time.perf_counter() - started
+        return stats
+
+    def search(self, query, top_k=None, dedupe=True):
+        """أفضل top_k مقطعاً للسؤال بترتيب BM25
+
+        كل نتيجة {"path", "start_line", "end_line", "names", "text", "score"}. مع dedupe تُستبعد
+        المقاطع المكررة نصاً، وشبه المكررة أيضاً إن كانت بصمات MinHash مفعلة.
+        """
+        top_k = top_k or DEFAULT_TOP_K
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+        connection = self._connection()
+        total, average = connection.execute("SELECT COUNT(*), AVG(length) FROM snippets").fetchone()
+        if not total:
+            return []
+
+        scores = Counter()
+        for term in terms:
+            rows = connection.execute(
+                "SELECT p.snippet_id, p.tf, s.length FROM postings p JOIN snippets s ON s.id = p.snippet_id"
+                " WHERE p.term = ?",
+                (term,)
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            for snippet_id, tf, length in rows:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * length / average)
+                scores[snippet_id] += idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        results = []
+        seen_texts = set()
+        signatures = []
+        # نفحص مرشحين أكثر من top_k لتعويض ما يُستبعد كتكرار
+        for snippet_id, score in scores.most_common(top_k * 4 if dedupe else top_k):
+            row = connection.execute(
+                "SELECT path, start_line, end_line, names, text, signature FROM snippets WHERE id = ?",
+                (snippet_id,)
+            ).fetchone()
+            if dedupe:
+                if row["text"] in seen_texts:
+                    continue
+                if row["signature"] is not None and any(
+                    similarity(row["signature"], other) >= DEFAULT_DUPLICATE_THRESHOLD for other in signatures
+                ):
+                    continue
+                seen_texts.add(row["text"])
+                if row["signature"] is not None:
+                    signatures.append(row["signature"])
+            results.append({
+                "path": row["path"],
+                "start_line": row["start_line"],
+                "end_line": row["end_line"],
+                "names": [name for name in row["names"].split(",") if name],
+                "text": row["text"],
+                "score": score
+            })
+            if len(results) == top_k:
+                break
+        return results
+
+    def context_for(self, query, top_k=None, max_chars=None):
+        """سياق من أقرب المقاطع للسؤال، لا يتجاوز max_chars حرفاً ("" إن لم يوجد شيء)"""
+        max_chars = max_chars or DEFAULT_MAX_CONTEXT_CHARS
+        parts = []
+        size = 0
+        for result in self.search(query, top_k):
+            language = LANGUAGES.get(os.path.splitext(result["path"])[1].lower(), "")
+            part = (
+                f"{result['path']} (lines {result['start_line']}-{result['end_line']}):\n"
+                f"```{language}\n{result['text'].rstrip()}\n```"
+            )
+            if parts and size + len(part) > max_chars:
+                break
+            parts.append(part[:max_chars])
+            size += len(part)
+        return "\n\n".join(parts)
+
+    def augment(self, message, context="", top_k=None, max_chars=None):
+        """إضافة المقاطع المسترجعة للسؤال إلى السياق الذي مرره المستدعي"""
+        retrieved = self.context_for(message, top_k, max_chars)
+        return "\n\n".join(part for part in (context, retrieved) if part)
+
+    def stats(self):
+        connection = self._connection()
+        files = connection.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        snippets = connection.execute("SELECT COUNT(*) FROM snippets").fetchone()[0]
+        terms = connection.execute("SELECT COUNT(DISTINCT term) FROM postings").fetchone()[0]
+        return {"files": files, "snippets": snippets, "terms": terms}
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def get_code_index(root=None):
+    """فهرس مشترك على مستوى العملية لكل مجلد مشروع (CODE_INDEX_ROOT افتراضياً)"""
+    root = os.path.abspath(root or DEFAULT_INDEX_ROOT)
+    with _indexes_lock:
+        if root not in _indexes:
+            _indexes[root] = CodeIndex(root)
+        return _indexes[root]
@@ -0,0 +1,377 @@
+# code_runner.py - مجمع مفسرات Python دافئة لتشغيل الكود المُولد بحدود موارد وعزل لكل تشغيل
+import ast
+import atexit
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import CODE_RUN_SECONDS, span
+
+DEFAULT_POOL_SIZE = int(os.getenv('RUNNER_POOL_SIZE', '2'))
+DEFAULT_MAX_RUNS_PER_WORKER = int(os.getenv('RUNNER_MAX_RUNS_PER_WORKER', '50'))
+DEFAULT_TIMEOUT = float(os.getenv('RUNNER_TIMEOUT', '10'))
+DEFAULT_CPU_SECONDS = int(os.getenv('RUNNER_CPU_SECONDS', '10'))
+DEFAULT_MEMORY_BYTES = int(os.getenv('RUNNER_MEMORY_MB', '256')) * 1024 * 1024
+DEFAULT_MAX_OUTPUT = int(os.getenv('RUNNER_MAX_OUTPUT', str(256 * 1024)))
+DEFAULT_CACHE_SIZE = int(os.getenv('RUNNER_CACHE_SIZE', '256'))
+
+# وحدات تجعل ناتج البرنامج غير حتمي أو تتعامل مع العالم الخارجي، فلا نخزن نتائجها
+NONDETERMINISTIC_MODULES = frozenset({
+    "random", "secrets", "uuid", "time", "datetime", "os", "sys", "subprocess", "socket",
+    "threading", "multiprocessing", "asyncio", "requests", "urllib", "http", "pathlib",
+    "shutil", "tempfile", "glob", "io", "signal", "platform", "getpass"
+})
+NONDETERMINISTIC_CALLS = frozenset({"input", "open", "id", "hash", "__import__", "exec", "eval"})
+
+
+def is_deterministic(code):
+    """تقدير محافظ لكون الكود حتمياً (لا يستورد وحدات غير حتمية ولا يقرأ مدخلات أو ملفات)"""
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        # أخطاء الصياغة حتمية دائماً
+        return True
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names = [alias.name for alias in node.names]
+        elif isinstance(node, ast.ImportFrom):
+            names = [node.module or ""]
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name):
+            if node.func.id in NONDETERMINISTIC_CALLS:
+                return False
+            continue
+        else:
+            continue
+        if any(name.split(".")[0] in NONDETERMINISTIC_MODULES for name in names):
+            return False
+    return True
+
+
+# ---------------------------------------------------------------------------
+# جانب العامل: يعمل داخل مفسر منفصل ويستقبل الطلبات عبر stdin سطراً سطراً
+# ---------------------------------------------------------------------------
+
+def _run_child(code, workdir, cpu_seconds, memory_bytes):
+    """يُنفذ داخل العملية الابنة بعد fork: حدود الموارد ثم تشغيل الكود"""
+    import resource
+    import traceback
+
+    os.setsid()
+    os.chdir(workdir)
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (memory_bytes, memory_bytes))
+    resource.setrlimit(resource.RLIMIT_FSIZE, (DEFAULT_MAX_OUTPUT * 4, DEFAULT_MAX_OUTPUT * 4))
+
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    stdout = os.open("stdout.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    stderr = os.open("stderr.txt", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    os.dup2(stdout, 1)
+    os.dup2(stderr, 2)
+    # الابن يرث كل واصفات العامل، ومنها قناة البروتوكول: لو بقيت مفتوحة لأمكن للكود غير الموثوق
+    # كتابة ردود JSON مزيفة تصل إلى جلسات أخرى، فنغلق كل ما فوق 2
+    os.closerange(3, os.sysconf("SC_OPEN_MAX"))
+    sys.stdout = os.fdopen(1, "w", encoding="utf-8", closefd=False)
+    sys.stderr = os.fdopen(2, "w", encoding="utf-8", closefd=False)
+    sys.stdin = open(os.devnull, "r")
+    sys.argv = ["<generated>"]
+
+    exit_code = 0
+    try:
+        exec(compile(code, "<generated>", "exec"), {"__name__": "__main__", "__builtins__": __builtins__})
+    except SystemExit as e:
+        exit_code = e.code if isinstance(e.code, int) else (0 if e.code is None else 1)
+    except BaseException as e:
+        # نحذف إطار العامل من التتبع ليظهر للمستخدم كوده فقط
+        traceback.print_exception(type(e), e, e.__traceback__.tb_next)
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+    os._exit(exit_code)
+
+
+def _read_output(path, limit):
+    try:
+        with open(path, "rb") as f:
+            data = f.read(limit + 1)
+    except OSError:
+        return ""
+    text = data[:limit].decode("utf-8", errors="replace")
+    if len(data) > limit:
+        text += "\n... [تم اقتطاع المخرجات]"
+    return text
+
+
+def _execute_job(job):
+    import shutil
+    import signal
+
+    workdir = tempfile.mkdtemp(prefix="run-")
+    started = time.perf_counter()
+    timed_out = False
+    try:
+        pid = os.fork()
+        if pid == 0:
+            try:
+                _run_child(job["code"], workdir, job["cpu_seconds"], job["memory_bytes"])
+            finally:
+                os._exit(1)
+
+        deadline = started + job["timeout"]
+        delay = 0.001
+        while True:
+            finished, status = os.waitpid(pid, os.WNOHANG)
+            if finished:
+                break
+            if time.perf_counter() >= deadline:
+                timed_out = True
+                try:
+                    os.killpg(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                _, status = os.waitpid(pid, 0)
+                break
+            time.sleep(delay)
+            delay = min(delay * 2, 0.02)
+
+        if os.WIFSIGNALED(status):
+            returncode = -os.WTERMSIG(status)
+        else:
+            returncode = os.WEXITSTATUS(status)
+        return {
+            "returncode": returncode,
+            "stdout": _read_output(os.path.join(workdir, "stdout.txt"), job["max_output"]),
+            "stderr": _read_output(os.path.join(workdir, "stderr.txt"), job["max_output"]),
+            "timed_out": timed_out,
+            "elapsed": time.perf_counter() - started
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def worker_main():
+    """حلقة العامل: طلب JSON في كل سطر على stdin ورد JSON في كل سطر على قناة خاصة"""
+    # نحجز stdout الأصلي للبروتوكول حتى لا تختلط به أي طباعة عرضية
+    protocol = os.fdopen(os.dup(1), "w", encoding="utf-8")
+    os.dup2(os.open(os.devnull, os.O_WRONLY), 1)
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            reply = _execute_job(json.loads(line))
+        except Exception as e:
+            reply = {"returncode": -1, "stdout": "", "stderr": f"خطأ في العامل: {str(e)}", "timed_out": False, "elapsed": 0.0}
+        protocol.write(json.dumps(reply, ensure_ascii=False) + "\n")
+        protocol.flush()
+
+
+# ---------------------------------------------------------------------------
+# جانب المجمع: يعمل داخل تطبيق Streamlit
+# ---------------------------------------------------------------------------
+
+class _Worker:
+    def __init__(self):
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.abspath(__file__), "--worker"],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            encoding="utf-8",
+            bufsize=1
+        )
+        self.runs = 0
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def run(self, job):
+        self.process.stdin.write(json.dumps(job, ensure_ascii=False) + "\n")
+        self.process.stdin.flush()
+        line = self.process.stdout.readline()
+        if not line:
+            raise RuntimeError("توقف العامل بشكل غير متوقع")
+        self.runs += 1
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=2)
+        except Exception:
+            self.process.kill()
+
+
+class CodeRunnerPool:
+    """مجمع عمال Python دافئين يشغل كل برنامج في عملية ابنة (fork) بحدود CPU والذاكرة
+
+    - الكود يُرسل عبر أنبوب، ولكل تشغيل مجلد مؤقت خاص يُحذف بعده
+    - يُعاد تشغيل العامل بعد max_runs_per_worker تشغيل
+    - نتائج الكود الحتمي تُخزن مؤقتاً ببصمة الكود
+    """
+
+    def __init__(self, size=None, max_runs_per_worker=None, timeout=None, cpu_seconds=None,
+                 memory_bytes=None, max_output=None, cache_size=None):
+        self.size = size or DEFAULT_POOL_SIZE
+        self.max_runs_per_worker = max_runs_per_worker or DEFAULT_MAX_RUNS_PER_WORKER
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self.cpu_seconds = cpu_seconds or DEFAULT_CPU_SECONDS
+        self.memory_bytes = memory_bytes or DEFAULT_MEMORY_BYTES
+        self.max_output = max_output or DEFAULT_MAX_OUTPUT
+        self.cache_size = DEFAULT_CACHE_SIZE if cache_size is None else cache_size
+        self._idle = []
+        self._total = 0
+        self._condition = threading.Condition()
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+
+    def warm_up(self):
+        """تشغيل العمال مسبقاً حتى لا يدفع أول مستخدم كلفة بدء المفسر"""
+        with self._condition:
+            while self._total < self.size:
+                self._idle.append(_Worker())
+                self._total += 1
+            self._condition.notify_all()
+
+    def _checkout(self):
+        with self._condition:
+            while True:
+                while self._idle:
+                    worker = self._idle.pop()
+                    if worker.alive():
+                        return worker
+                    self._total -= 1
+                if self._total < self.size:
+                    self._total += 1
+                    break
+                self._condition.wait()
+        try:
+            return _Worker()
+        except Exception:
+            with self._condition:
+                self._total -= 1
+                self._condition.notify()
+            raise
+
+    def _checkin(self, worker, healthy):
+        if healthy and worker.alive() and worker.runs < self.max_runs_per_worker:
+            with self._condition:
+                self._idle.append(worker)
+                self._condition.notify()
+            return
+        worker.close()
+        with self._condition:
+            self._total -= 1
+            self._condition.notify()
+
+    def _cached(self, key):
+        with self._cache_lock:
+            result = self._cache.get(key)
+            if result is not None:
+                self._cache.move_to_end(key)
+            return result
+
+    def _store(self, key, result):
+        with self._cache_lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def run(self, code, timeout=None):
+        """تشغيل الكود وإرجاع {"returncode", "stdout", "stderr", "timed_out", "elapsed", "cached"}"""
+        timeout = timeout or self.timeout
+        cache_key = None
+        if self.cache_size and is_deterministic(code):
+            # النتيجة تتبع الحدود أيضاً: تشغيل ناجح بحدود واسعة لا يصلح رداً على طلب بحدود أضيق
+            material = f"{timeout}\0{self.cpu_seconds}\0{self.memory_bytes}\0{self.max_output}\0{code}"
+            cache_key = hashlib.sha256(material.encode("utf-8")).hexdigest()
+            cached = self._cached(cache_key)
+            if cached is not None:
+                CODE_RUN_SECONDS.observe(0, outcome="cached")
+                return dict(cached, cached=True)
+
+        job = {
+            "code": code,
+            "timeout": timeout,
+            "cpu_seconds": self.cpu_seconds,
+            "memory_bytes": self.memory_bytes,
+            "max_output": self.max_output
+        }
+        with span("code_runner.run"):
+            if not hasattr(os, "fork"):
+                result = _run_without_pool(job)
+            else:
+                worker = self._checkout()
+                healthy = False
+                try:
+                    result = worker.run(job)
+                    healthy = True
+                finally:
+                    self._checkin(worker, healthy)
+
+        if result["timed_out"]:
+            outcome = "timeout"
+        else:
+            outcome = "ok" if result["returncode"] == 0 else "error"
+        CODE_RUN_SECONDS.observe(result["elapsed"], outcome=outcome)
+
+        if cache_key and not result["timed_out"]:
+            self._store(cache_key, result)
+        return dict(result, cached=False)
+
+    def close(self):
+        with self._condition:
+            idle, self._idle = self._idle, []
+            self._total -= len(idle)
+        for worker in idle:
+            worker.close()
+
+
+def _run_without_pool(job):
+    """بديل للأنظمة التي لا تدعم fork: مفسر جديد يقرأ الكود من stdin"""
+    started = time.perf_counter()
+    try:
+        completed = subprocess.run(
+            [sys.executable, "-"],
+            input=job["code"],
+            capture_output=True,
+            text=True,
+            timeout=job["timeout"],
+            cwd=tempfile.gettempdir()
+        )
+        return {
+            "returncode": completed.returncode,
+            "stdout": completed.stdout[:job["max_output"]],
+            "stderr": completed.stderr[:job["max_output"]],
+            "timed_out": False,
+            "elapsed": time.perf_counter() - started
+        }
+    except subprocess.TimeoutExpired:
+        return {"returncode": -1, "stdout": "", "stderr": "", "timed_out": True, "elapsed": job["timeout"]}
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_code_runner():
+    """المجمع المشترك بين جميع جلسات Streamlit في العملية"""
+    global _runner
+    with _runner_lock:
+        if _runner is None:
+            _runner = CodeRunnerPool()
+            threading.Thread(target=_runner.warm_up, daemon=True).start()
+            atexit.register(_runner.close)
+        return _runner
+
+
+if __name__ == "__main__" and "--worker" in sys.argv:
+    worker_main()
@@ -0,0 +1,203 @@
+# conversation.py - جلسات محادثة بسياق تراكمي: سجل بميزانية رموز مع تلخيص متدرج، وإرسال فرق الكود فقط في الأدوار اللاحقة
+import difflib
+import os
+
+DEFAULT_TOKEN_BUDGET = int(os.getenv('CONVERSATION_TOKEN_BUDGET', '6000'))
+# عدد الرسائل الأخيرة التي لا تُلخص أبداً
+DEFAULT_KEEP_RECENT = int(os.getenv('CONVERSATION_KEEP_RECENT', '4'))
+# إذا تجاوز الفرق هذه النسبة من حجم الكود الكامل نرسل الكود كاملاً
+DEFAULT_MAX_DIFF_RATIO = float(os.getenv('CONVERSATION_MAX_DIFF_RATIO', '0.6'))
+
+SYSTEM_PROMPT = (
+    "You are a coding assistant helping the user fix their code over several turns. "
+    "When the user sends a unified diff, it is relative to their code as of their previous turn: "
+    "the last full listing they sent with every later diff applied in order."
+)
+
+SUMMARY_PROMPT = (
+    "Summarize the following coding conversation in under 200 words. Keep the bugs found, "
+    "the fixes agreed on and any open questions; omit code listings.\n\n"
+)
+
+
+def estimate_tokens(text):
+    """تقدير تقريبي لعدد الرموز (~4 أحرف لكل رمز) يكفي لميزانية السياق دون مُرمّز"""
+    return len(text) // 4 + 1
+
+
+def code_diff(old, new):
+    """فرق unified بين نسختين من الكود، أو "" إن كانتا متطابقتين"""
+    return "".join(difflib.unified_diff(
+        old.splitlines(keepends=True),
+        new.splitlines(keepends=True),
+        fromfile="previous",
+        tofile="current"
+    ))
+
+
+class Conversation:
+    """سجل محادثة متعدد الأدوار فوق واجهة خلفية تدعم converse / converse_stream
+
+    - قبل كل دور تُلخص أقدم الرسائل (أو تُحذف إن فشل التلخيص) حتى يبقى السياق ضمن token_budget
+    - debug() يرسل الكود كاملاً في الدور الأول ثم الفرق عن آخر نسخة مرسلة فقط
+    - الحالة قابلة للتحويل إلى JSON (to_state / from_state) لتُحفظ في الجلسة أو تُمرر لمهمة خلفية
+    """
+
+    def __init__(self, backend=None, token_budget=None, keep_recent=None, summarize=True, system=SYSTEM_PROMPT):
+        if backend is None:
+            from backends import get_backend
+            backend = get_backend()
+        self.backend = backend
+        self.token_budget = token_budget or DEFAULT_TOKEN_BUDGET
+        self.keep_recent = DEFAULT_KEEP_RECENT if keep_recent is None else keep_recent
+        self.summarize = summarize
+        self.system = system
+        self.messages = []
+        self.summary = ""
+        # آخر كود أُرسل كاملاً أو كفرق، وموضع آخر رسالة فيها الكود كاملاً (أساس سلسلة الفروق)
+        self.last_code = None
+        self.anchor_index = None
+        # ما كان سيُرسل في وضع بلا حالة مقابل ما أُرسل فعلاً (بالأحرف) لعرض التوفير
+        self.full_chars = 0
+        self.sent_chars = 0
+
+    def to_state(self):
+        return {
+            "messages": self.messages,
+            "summary": self.summary,
+            "last_code": self.last_code,
+            "anchor_index": self.anchor_index,
+            "full_chars": self.full_chars,
+            "sent_chars": self.sent_chars
+        }
+
+    @classmethod
+    def from_state(cls, state, backend=None, **kwargs):
+        conversation = cls(backend=backend, **kwargs)
+        for key in conversation.to_state():
+            if state and key in state:
+                setattr(conversation, key, state[key])
+        conversation.messages = list(conversation.messages)
+        return conversation
+
+    def reset(self):
+        self.messages = []
+        self.summary = ""
+        self.last_code = None
+        self.anchor_index = None
+
+    @property
+    def turns(self):
+        return sum(1 for message in self.messages if message["role"] == "user")
+
+    def _context(self):
+        context = [{"role": "system", "content": self.system}] if self.system else []
+        if self.summary:
+            context.append({"role": "system", "content": f"Summary of the earlier conversation:\n{self.summary}"})
+        return context + self.messages
+
+    def context_tokens(self, extra=""):
+        return sum(estimate_tokens(message["content"]) for message in self._context()) + estimate_tokens(extra)
+
+    def _fit(self, content):
+        """تلخيص أو حذف أقدم الرسائل حتى يتسع السياق للرسالة الجديدة"""
+        dropped = []
+        while self.context_tokens(content) > self.token_budget and len(self.messages) > self.keep_recent:
+            # نحذف دوراً كاملاً (سؤال وجواب) حتى لا يبدأ السجل برد بلا سؤال
+            dropped.extend(self.messages[:2])
+            del self.messages[:2]
+        if not dropped:
+            return
+        if self.anchor_index is not None:
+            # إن حُذفت النسخة الكاملة من الكود فلا معنى للفروق، والدور التالي يرسل الكود كاملاً
+            self.anchor_index -= len(dropped)
+            if self.anchor_index < 0:
+                self.anchor_index = None
+        if self.summarize:
+            transcript = "\n\n".join(f"{message['role']}: {message['content']}" for message in dropped)
+            previous = f"Earlier summary:\n{self.summary}\n\n" if self.summary else ""
+            result = self.backend.converse(
+                [{"role": "user", "content": SUMMARY_PROMPT + previous + transcript}],
+                "summarize"
+            )
+            if result.get("success"):
+                self.summary = result["response"]
+
+    def _prepare(self, content, full_content=None):
+        self._fit(content)
+        self.full_chars += len(full_content or content)
+        self.sent_chars += len(content)
+        return self._context() + [{"role": "user", "content": content}]
+
+    def _record(self, content, reply):
+        self.messages.append({"role": "user", "content": content})
+        self.messages.append({"role": "assistant", "content": reply})
+
+    def send(self, content, operation="chat", full_content=None):
+        """إرسال رسالة ضمن المحادثة وإرجاع {"success", "response"} أو {"success": False, "error"}"""
+        result = self.backend.converse(self._prepare(content, full_content), operation)
+        if result.get("success"):
+            self._record(content, result["response"])
+        return result
+
+    def send_stream(self, content, operation="chat", full_content=None):
+        """مثل send مع بث نص الرد؛ يُضاف الدور إلى السجل بعد اكتمال البث فقط"""
+        parts = []
+        for chunk in self.backend.converse_stream(self._prepare(content, full_content), operation):
+            parts.append(chunk)
+            yield chunk
+        self._record(content, "".join(parts))
+
+    def _debug_message(self, code, error_message=""):
+        """رسالة دور التصحيح: الكود كاملاً أول مرة، ثم الفرق عن آخر نسخة فقط
+
+        يُرجع (الرسالة، نظيرتها الكاملة في وضع بلا حالة، هل الرسالة تتضمن الكود كاملاً).
+        """
+        full = f"Debug this code and fix any issues:\n\nCode:\n```\n{code}\n```"
+        if error_message:
+            full += f"\n\nError message: {error_message}"
+        if self.last_code is None or self.anchor_index is None:
+            return full, full, True
+
+        if code == self.last_code:
+            content = "The code is unchanged since my last message. Please look again."
+        else:
+            diff = code_diff(self.last_code, code)
+            if len(diff) > len(code) * DEFAULT_MAX_DIFF_RATIO:
+                return full, full, True
+            content = f"I changed the code since my last message. Here is the diff against that version:\n\n```diff\n{diff}```"
+        if error_message:
+            content += f"\n\nError message: {error_message}"
+        # إفساح المكان للفرق قد يُخرج النسخة الكاملة التي يستند إليها من السياق
+        self._fit(content)
+        if self.anchor_index is None:
+            return full, full, True
+        return content, full, False
+
+    def debug(self, code, error_message=""):
+        """دور تصحيح متكرر على نفس الكود"""
+        content, full, complete = self._debug_message(code, error_message)
+        result = self.send(content, "debug_code", full_content=full)
+        if result.get("success"):
+            self._remember_code(code, complete)
+        return result
+
+    def debug_stream(self, code, error_message=""):
+        """دور تصحيح مع بث نص الرد"""
+        content, full, complete = self._debug_message(code, error_message)
+        yield from self.send_stream(content, "debug_code", full_content=full)
+        self._remember_code(code, complete)
+
+    def _remember_code(self, code, complete):
+        if complete:
+            # رسالة المستخدم في الدور الذي سُجل للتو
+            self.anchor_index = len(self.messages) - 2
+        self.last_code = code
+
+    def stats(self):
+        return {
+            "turns": self.turns,
+            "context_tokens": self.context_tokens(),
+            "summarized": bool(self.summary),
+            "saved": 1 - self.sent_chars / self.full_chars if self.full_chars else 0.0
+        }
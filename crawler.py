@@ -0,0 +1,223 @@
+# crawler.py - زحف متزامن على عدة صفحات مع إزالة التكرار واحترام robots.txt وحدود كل مضيف
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, urldefrag, urlencode, urljoin, urlsplit, urlunsplit
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+from html_extract import extract_page
+from http_transport import get_session, get_timeout
+from page_fetcher import USER_AGENT, get_page_fetcher
+
+DEFAULT_MAX_PAGES = int(os.getenv('CRAWL_MAX_PAGES', '30'))
+DEFAULT_MAX_DEPTH = int(os.getenv('CRAWL_MAX_DEPTH', '2'))
+DEFAULT_WORKERS = int(os.getenv('CRAWL_WORKERS', '8'))
+DEFAULT_PER_HOST = int(os.getenv('CRAWL_PER_HOST', '2'))
+ROBOTS_TTL = float(os.getenv('CRAWL_ROBOTS_TTL', '3600'))
+
+# معاملات التتبع التي لا تغير محتوى الصفحة
+_TRACKING_PARAMS = ("utm_", "fbclid", "gclid")
+
+
+def normalize_url(url, base=None):
+    """توحيد الرابط لإزالة التكرار: رابط مطلق، مضيف بأحرف صغيرة، بلا fragment أو معاملات تتبع"""
+    if base:
+        url = urljoin(base, url)
+    url, _ = urldefrag(url)
+    parts = urlsplit(url)
+    if parts.scheme not in ("http", "https"):
+        return None
+    host = (parts.hostname or "").lower()
+    if parts.port and (parts.scheme, parts.port) not in (("http", 80), ("https", 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.startswith(_TRACKING_PARAMS)
+    ))
+    return urlunsplit((parts.scheme, host, parts.path or "/", query, ""))
+
+
+class RobotsCache:
+    """تخزين ملفات robots.txt لكل مضيف مع مدة صلاحية؛ الفشل في الجلب يعني السماح"""
+
+    def __init__(self, session=None, ttl=None):
+        self.session = session or get_session()
+        self.ttl = ttl or ROBOTS_TTL
+        self._parsers = {}
+        self._lock = threading.Lock()
+
+    def _parser(self, url):
+        parts = urlsplit(url)
+        origin = f"{parts.scheme}://{parts.netloc}"
+        now = time.monotonic()
+        with self._lock:
+            cached = self._parsers.get(origin)
+            if cached and now - cached[0] < self.ttl:
+                return cached[1]
+
+        parser = RobotFileParser()
+        try:
+            response = self.session.get(f"{origin}/robots.txt", timeout=get_timeout(read_timeout=10))
+            if response.status_code == 200:
+                parser.parse(response.text.splitlines())
+            elif response.status_code in (401, 403):
+                parser.disallow_all = True
+            else:
+                parser.allow_all = True
+        except requests.exceptions.RequestException:
+            parser.allow_all = True
+
+        with self._lock:
+            self._parsers[origin] = (now, parser)
+        return parser
+
+    def allowed(self, url):
+        return self._parser(url).can_fetch(USER_AGENT, url)
+
+    def crawl_delay(self, url):
+        return self._parser(url).crawl_delay(USER_AGENT) or 0
+
+
+class Crawler:
+    """زاحف بمجمع عمال متزامن وحدود للعمق وعدد الصفحات والتزامن لكل مضيف
+
+    crawl() مولد يُرجع كل صفحة فور اكتمالها، ويكتبها في ملف JSONL إن حُدد.
+    """
+
+    def __init__(self, fetcher=None, max_pages=None, max_depth=None, max_workers=None,
+                 per_host=None, same_host=True, respect_robots=True, max_paragraphs=10, max_links=100,
+                 force_browser=False):
+        self.fetcher = fetcher or get_page_fetcher()
+        self.max_pages = max_pages or DEFAULT_MAX_PAGES
+        self.max_depth = DEFAULT_MAX_DEPTH if max_depth is None else max_depth
+        self.max_workers = max_workers or DEFAULT_WORKERS
+        self.per_host = per_host or DEFAULT_PER_HOST
+        self.same_host = same_host
+        self.robots = RobotsCache() if respect_robots else None
+        self.max_paragraphs = max_paragraphs
+        self.max_links = max_links
+        self.force_browser = force_browser
+        self._host_slots = {}
+        self._host_last_request = {}
+        self._lock = threading.Lock()
+
+    def _host_slot(self, host):
+        with self._lock:
+            slot = self._host_slots.get(host)
+            if slot is None:
+                slot = threading.BoundedSemaphore(self.per_host)
+                self._host_slots[host] = slot
+            return slot
+
+    def _wait_for_politeness(self, url, host):
+        """احترام Crawl-delay من robots.txt بين طلبات نفس المضيف"""
+        delay = self.robots.crawl_delay(url) if self.robots else 0
+        if not delay:
+            return
+        with self._lock:
+            next_allowed = self._host_last_request.get(host, 0) + delay
+            now = time.monotonic()
+            self._host_last_request[host] = max(now, next_allowed)
+        if next_allowed > now:
+            time.sleep(next_allowed - now)
+
+    def _visit(self, url, depth):
+        host = urlsplit(url).netloc
+        if self.robots and not self.robots.allowed(url):
+            return {"url": url, "depth": depth, "error": "ممنوع بواسطة robots.txt"}
+
+        with self._host_slot(host):
+            self._wait_for_politeness(url, host)
+            try:
+                fetched = self.fetcher.fetch(url, force_browser=self.force_browser)
+            except Exception as e:
+                return {"url": url, "depth": depth, "error": str(e)}
+
+        # صفحة لا يستطيع المحلل قراءتها تُسجل كخطأ لها وحدها ولا توقف الزحف كله
+        try:
+            page = extract_page(fetched["html"], max_paragraphs=self.max_paragraphs, max_links=self.max_links)
+            links = []
+            for link in page["links"]:
+                normalized = normalize_url(link["href"], base=url)
+                if normalized:
+                    links.append(normalized)
+        except Exception as e:
+            return {"url": url, "depth": depth, "error": f"تعذر تحليل الصفحة: {e}"}
+        return {
+            "url": url,
+            "depth": depth,
+            "title": page["title"],
+            "paragraphs": page["paragraphs"],
+            "links": links,
+            "tier": fetched["tier"],
+            "elapsed": fetched["elapsed"]
+        }
+
+    def crawl(self, start_url, jsonl_path=None):
+        """بدء الزحف من start_url وإرجاع الصفحات فور اكتمال كل منها"""
+        start = normalize_url(start_url)
+        if start is None:
+            raise ValueError(f"رابط غير صالح: {start_url}")
+        start_host = urlsplit(start).netloc
+
+        seen = {start}
+        frontier = deque([(start, 0)])
+        scheduled = 0
+        in_flight = {}
+        output = open(jsonl_path, "a", encoding="utf-8") if jsonl_path else None
+        pool = ThreadPoolExecutor(max_workers=self.max_workers)
+
+        try:
+            while frontier or in_flight:
+                while frontier and scheduled < self.max_pages and len(in_flight) < self.max_workers:
+                    url, depth = frontier.popleft()
+                    in_flight[pool.submit(self._visit, url, depth)] = url
+                    scheduled += 1
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    del in_flight[future]
+                    page = future.result()
+
+                    if "error" not in page and page["depth"] < self.max_depth:
+                        for link in page["links"]:
+                            if link in seen:
+                                continue
+                            if self.same_host and urlsplit(link).netloc != start_host:
+                                continue
+                            seen.add(link)
+                            frontier.append((link, page["depth"] + 1))
+
+                    if output:
+                        output.write(json.dumps(page, ensure_ascii=False) + "\n")
+                        output.flush()
+                    yield page
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            if output:
+                output.close()
+
+
+def crawl_context(pages, max_chars=8000):
+    """تحويل صفحات الزحف إلى نص سياق مختصر يُمرر إلى chat(message, context=...)"""
+    sections = []
+    used = 0
+    for page in pages:
+        if page.get("error"):
+            continue
+        section = f"# {page.get('title') or page['url']}\n{page['url']}\n" + "\n".join(page.get("paragraphs", []))
+        if used + len(section) > max_chars:
+            section = section[:max(0, max_chars - used)]
+        if section:
+            sections.append(section)
+            used += len(section)
+        if used >= max_chars:
+            break
+    return "\n\n".join(sections)
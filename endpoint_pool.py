@@ -0,0 +1,313 @@
+# endpoint_pool.py - توزيع الطلبات على عدة نقاط ومفاتيح Blackbox حسب زمن الاستجابة (EWMA) والحصة المتبقية، مع طلبات تحوط
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import urlsplit
+
+import requests
+
+from metrics import ENDPOINT_SECONDS, HEDGES, RETRIES
+from resilience import (
+    CircuitBreaker,
+    CircuitOpenError,
+    RetryPolicy,
+    get_circuit_breaker,
+    get_rate_limiter,
+    parse_retry_after,
+    send_with_retries
+)
+
+# "url|key,url|key" — عنوان دون مفتاح يستخدم BLACKBOX_API_KEY، ومفتاح دون عنوان ("|key") يستخدم BLACKBOX_BASE_URL
+DEFAULT_ENDPOINTS = os.getenv('BLACKBOX_ENDPOINTS', '')
+DEFAULT_HEDGE = os.getenv('BLACKBOX_HEDGE', '0') == '1'
+# أقل عدد قياسات قبل اعتماد p95 النقطة كمهلة للتحوط، وعدد آخر القياسات التي يُحسب منها
+DEFAULT_HEDGE_MIN_SAMPLES = int(os.getenv('BLACKBOX_HEDGE_MIN_SAMPLES', '20'))
+DEFAULT_HEDGE_WINDOW = int(os.getenv('BLACKBOX_HEDGE_WINDOW', '200'))
+DEFAULT_EWMA_ALPHA = float(os.getenv('BLACKBOX_EWMA_ALPHA', '0.3'))
+
+# أسماء ترويسات الحصة الشائعة (OpenAI وRFC draft ratelimit-headers)
+REMAINING_HEADERS = ("x-ratelimit-remaining-requests", "x-ratelimit-remaining", "ratelimit-remaining")
+LIMIT_HEADERS = ("x-ratelimit-limit-requests", "x-ratelimit-limit", "ratelimit-limit")
+RESET_HEADERS = ("x-ratelimit-reset-requests", "x-ratelimit-reset", "ratelimit-reset")
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset(value):
+    """تحويل ترويسة إعادة ضبط الحصة إلى ثوانٍ متبقية: "30" أو "1m30s" أو "250ms" أو طابع زمني"""
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        parts = _DURATION_PART.findall(value)
+        if not parts:
+            return None
+        return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+    # بعض الخوادم ترسل وقت إعادة الضبط كطابع زمني بدلاً من المدة
+    if seconds > 1e9:
+        return max(0.0, seconds - time.time())
+    return max(0.0, seconds)
+
+
+def _header(headers, names):
+    for name in names:
+        value = headers.get(name)
+        if value is not None:
+            return value
+    return None
+
+
+class Endpoint:
+    """نقطة Blackbox واحدة (عنوان + مفتاح) مع زمن الاستجابة المقدّر والحصة المتبقية"""
+
+    def __init__(self, base_url, api_key, name=None, alpha=None):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        # الاسم يظهر في المقاييس، فلا يتضمن المفتاح
+        self.name = name or urlsplit(self.base_url).netloc
+        self.alpha = alpha or DEFAULT_EWMA_ALPHA
+        self.breaker = get_circuit_breaker(self.name)
+        # لكل مفتاح حصته لدى المزود، فلكل نقطة محدد معدل مستقل (BLACKBOX_RATE_LIMIT لكل نقطة)
+        self.limiter = get_rate_limiter(self.name)
+        self.latency = None
+        # آخر الأزمنة فقط: p95 يتبع تغير النقطة بدلاً من تاريخها كله
+        self._recent = deque(maxlen=DEFAULT_HEDGE_WINDOW)
+        self.in_flight = 0
+        self.remaining = None
+        self.limit = None
+        self.reset_at = 0.0
+        self._lock = threading.Lock()
+
+    def headers(self, headers):
+        return dict(headers, Authorization=f"Bearer {self.api_key}")
+
+    def observe(self, elapsed, response=None):
+        """تحديث EWMA لزمن الاستجابة والحصة من ترويسات الرد"""
+        ENDPOINT_SECONDS.observe(elapsed, endpoint=self.name)
+        with self._lock:
+            self.latency = elapsed if self.latency is None else self.alpha * elapsed + (1 - self.alpha) * self.latency
+            self._recent.append(elapsed)
+            if response is None:
+                return
+            remaining = _header(response.headers, REMAINING_HEADERS)
+            limit = _header(response.headers, LIMIT_HEADERS)
+            reset = parse_reset(_header(response.headers, RESET_HEADERS))
+            if response.status_code == 429:
+                # الحصة نفدت: نتجنب هذه النقطة حتى Retry-After أو موعد إعادة الضبط
+                reset = parse_retry_after(response.headers.get("Retry-After")) or reset or 1.0
+                self.remaining = 0
+            elif remaining is not None:
+                try:
+                    self.remaining = int(float(remaining))
+                except ValueError:
+                    pass
+            if limit is not None:
+                try:
+                    self.limit = int(float(limit))
+                except ValueError:
+                    pass
+            if reset is not None:
+                self.reset_at = time.monotonic() + reset
+
+    def exhausted(self, now=None):
+        now = time.monotonic() if now is None else now
+        return self.remaining is not None and self.remaining <= 0 and now < self.reset_at
+
+    def score(self, now=None):
+        """الزمن المتوقع لطلب جديد؛ الأقل أفضل (النقطة غير المقاسة بعد تُجرب أولاً)"""
+        now = time.monotonic() if now is None else now
+        if self.breaker.state == CircuitBreaker.OPEN or self.exhausted(now):
+            return float("inf")
+        with self._lock:
+            score = (self.latency or 0.0) * (1 + self.in_flight)
+            # تفضيل المفاتيح التي بقي لها نسبة أكبر من حصتها
+            if self.remaining is not None and self.limit and now < self.reset_at:
+                score /= max(self.remaining / self.limit, 0.05)
+        return score
+
+    def p95(self, min_samples=None):
+        """p95 لزمن الاستجابة من آخر DEFAULT_HEDGE_WINDOW قياساً، أو None قبل جمع عينات كافية"""
+        min_samples = DEFAULT_HEDGE_MIN_SAMPLES if min_samples is None else min_samples
+        with self._lock:
+            recent = sorted(self._recent)
+        if not recent or len(recent) < min_samples:
+            return None
+        return recent[min(len(recent) - 1, int(0.95 * len(recent)))]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "endpoint": self.name,
+                "latency": self.latency,
+                "in_flight": self.in_flight,
+                "remaining": self.remaining,
+                "breaker": self.breaker.state
+            }
+
+
+class EndpointPool:
+    """اختيار أفضل نقطة لكل طلب، والانتقال إلى نقطة أخرى عند 429 أو 5xx أو فشل الاتصال
+
+    مع hedge=True يُرسل طلب مكرر إلى نقطة ثانية إذا تجاوز الطلب الأول p95 لنقطته،
+    ويُعتمد أول رد ناجح. التحوط للطلبات غير المبثوثة فقط.
+    """
+
+    def __init__(self, endpoints, hedge=None, retry_exceptions=(requests.ConnectionError, requests.Timeout)):
+        if not endpoints:
+            raise ValueError("مجمع النقاط يحتاج نقطة واحدة على الأقل")
+        self.endpoints = list(endpoints)
+        self.hedge = DEFAULT_HEDGE if hedge is None else hedge
+        self.retry_exceptions = retry_exceptions
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @classmethod
+    def from_spec(cls, spec, default_base_url, default_api_key, **kwargs):
+        """بناء المجمع من صيغة BLACKBOX_ENDPOINTS"""
+        endpoints = []
+        for index, entry in enumerate(part.strip() for part in spec.split(",")):
+            if not entry:
+                continue
+            base_url, _, api_key = entry.partition("|")
+            base_url = base_url.strip() or default_base_url
+            # نفس العنوان قد يتكرر بمفاتيح مختلفة، فالترتيب جزء من الاسم
+            name = f"{urlsplit(base_url).netloc}#{index}"
+            endpoints.append(Endpoint(base_url, api_key.strip() or default_api_key, name=name))
+        return cls(endpoints, **kwargs)
+
+    def choose(self, exclude=()):
+        """أفضل نقطة غير مستبعدة؛ إن كانت كلها متعطلة فالتي تُستعاد حصتها أولاً"""
+        now = time.monotonic()
+        candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+        if not candidates:
+            return None
+        return min(
+            candidates,
+            key=lambda endpoint: (endpoint.score(now), endpoint.reset_at, endpoint.in_flight, random.random())
+        )
+
+    def _send_once(self, endpoint, send):
+        """محاولة واحدة على endpoint عبر قاطع دائرتها ومحدد معدلها (دون إعادة محاولة على نفس النقطة)"""
+        with endpoint._lock:
+            endpoint.in_flight += 1
+        started = time.perf_counter()
+        try:
+            response = send_with_retries(
+                lambda: send(endpoint), endpoint.breaker, endpoint.limiter, RetryPolicy(max_retries=0),
+                self.retry_exceptions
+            )
+        except self.retry_exceptions as e:
+            # رفض القاطع الفوري ليس قياساً لزمن النقطة
+            if not isinstance(e, CircuitOpenError):
+                endpoint.observe(time.perf_counter() - started)
+            raise
+        finally:
+            with endpoint._lock:
+                endpoint.in_flight -= 1
+        endpoint.observe(time.perf_counter() - started, response)
+        return response
+
+    def _send_with_failover(self, send, policy, first=None):
+        """إرسال مع إعادة المحاولة على أفضل نقطة أخرى؛ الانتظار فقط عند عدم وجود بديل"""
+        endpoint = first or self.choose()
+        tried = []
+        for attempt in range(policy.max_retries + 1):
+            tried.append(endpoint)
+            try:
+                response = self._send_once(endpoint, send)
+            except self.retry_exceptions as e:
+                if attempt == policy.max_retries:
+                    raise
+                RETRIES.inc(reason=type(e).__name__)
+                retry_after = None
+            else:
+                if response.status_code not in policy.retry_statuses or attempt == policy.max_retries:
+                    return response
+                RETRIES.inc(reason=response.status_code)
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                response.close()
+
+            following = self.choose(exclude=tried) or self.choose()
+            if following is endpoint or following.score() == float("inf"):
+                time.sleep(policy.delay(attempt, retry_after))
+            endpoint = following
+
+    def _pool(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=2 * len(self.endpoints) + 2)
+            return self._executor
+
+    def send(self, send, policy, hedge=None):
+        """تنفيذ send(endpoint) على أفضل نقطة مع الانتقال عند الفشل والتحوط الاختياري"""
+        hedge = self.hedge if hedge is None else hedge
+        primary = self.choose()
+        delay = primary.p95() if hedge and len(self.endpoints) > 1 else None
+        if delay is None:
+            return self._send_with_failover(send, policy, primary)
+
+        executor = self._pool()
+        first = executor.submit(self._send_with_failover, send, policy, primary)
+        done, _ = wait([first], timeout=delay)
+        secondary = None if done else self.choose(exclude=[primary])
+        if secondary is None or secondary.score() == float("inf"):
+            return first.result()
+
+        HEDGES.inc(outcome="fired")
+        second = executor.submit(self._send_with_failover, send, policy, secondary)
+        pending = {first, second}
+        fallback = None
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except Exception as e:
+                    error = e
+                    continue
+                if response.ok:
+                    if future is second:
+                        HEDGES.inc(outcome="won")
+                    # الطلب الخاسر يكتمل في الخلفية ثم يُغلق لإرجاع اتصاله إلى المجمع
+                    for loser in pending:
+                        loser.add_done_callback(_close_response)
+                    if fallback is not None:
+                        fallback.close()
+                    return response
+                if fallback is None:
+                    fallback = response
+                else:
+                    response.close()
+        if fallback is not None:
+            return fallback
+        raise error
+
+    def stats(self):
+        return [endpoint.stats() for endpoint in self.endpoints]
+
+
+def _close_response(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result().close()
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_endpoint_pool(default_base_url, default_api_key):
+    """المجمع المشترك على مستوى العملية من BLACKBOX_ENDPOINTS، أو None إن لم يُضبط"""
+    global _pool
+    if not DEFAULT_ENDPOINTS.strip():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = EndpointPool.from_spec(DEFAULT_ENDPOINTS, default_base_url, default_api_key)
+        return _pool
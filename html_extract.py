@@ -0,0 +1,214 @@
+# html_extract.py - استخراج العنوان والفقرات والروابط بتحليل تدريجي يتوقف عند بلوغ الحدود
+import os
+from html.parser import HTMLParser
+from importlib.util import find_spec
+
+DEFAULT_MAX_PARAGRAPHS = int(os.getenv('EXTRACT_MAX_PARAGRAPHS', '5'))
+DEFAULT_MAX_LINKS = int(os.getenv('EXTRACT_MAX_LINKS', '10'))
+DEFAULT_BACKEND = os.getenv('EXTRACT_BACKEND', 'auto')
+CHUNK_SIZE = 64 * 1024
+
+# نتحقق من وجود lxml دون استيرادها؛ تُحمّل عند أول تحليل بها فقط
+HAS_LXML = find_spec("lxml") is not None
+_etree = None
+
+
+def _lxml_etree():
+    global _etree
+    if _etree is None:
+        from lxml import etree
+        _etree = etree
+    return _etree
+
+
+def _clean(parts):
+    return " ".join("".join(parts).split())
+
+
+def _chunks(source):
+    """تقسيم النص إلى أجزاء إن لم يكن مصدراً مجزأً أصلاً"""
+    if isinstance(source, (str, bytes)):
+        for start in range(0, len(source), CHUNK_SIZE):
+            yield source[start:start + CHUNK_SIZE]
+    else:
+        yield from source
+
+
+class _Collector:
+    """حالة الاستخراج المشتركة بين الواجهتين الخلفيتين"""
+
+    def __init__(self, max_paragraphs, max_links):
+        self.max_paragraphs = max_paragraphs
+        self.max_links = max_links
+        self.title = None
+        self.title_done = False
+        self.paragraphs = []
+        self.links = []
+
+    def add_title(self, text):
+        if self.title is None and text:
+            self.title = text
+        self.title_done = True
+
+    def add_paragraph(self, text):
+        if text and len(self.paragraphs) < self.max_paragraphs:
+            self.paragraphs.append(text)
+
+    def add_link(self, text, href):
+        if text and href and len(self.links) < self.max_links:
+            self.links.append({"text": text, "href": href})
+
+    @property
+    def done(self):
+        return (
+            self.title_done
+            and len(self.paragraphs) >= self.max_paragraphs
+            and len(self.links) >= self.max_links
+        )
+
+    def result(self, complete):
+        return {
+            "title": self.title,
+            "paragraphs": self.paragraphs,
+            "links": self.links,
+            # False يعني أننا توقفنا قبل نهاية المستند لاكتمال الحدود
+            "complete": complete
+        }
+
+
+class _StopParsing(Exception):
+    pass
+
+
+class _StreamingParser(HTMLParser):
+    def __init__(self, collector):
+        super().__init__(convert_charrefs=True)
+        self.collector = collector
+        self._title = None
+        self._paragraph = None
+        self._link = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "title" and not self.collector.title_done:
+            self._title = []
+        elif tag == "body" and self._title is None:
+            # لا عنوان بعد بداية body
+            self.collector.title_done = True
+        elif tag == "p":
+            # الفقرات لا تتداخل في HTML، و<p> جديدة تغلق السابقة ضمنياً
+            self._close_paragraph()
+            self._paragraph = []
+        elif tag == "a":
+            href = dict(attrs).get("href")
+            self._link = ([], href) if href else None
+
+    def handle_endtag(self, tag):
+        if tag == "title" and self._title is not None:
+            self.collector.add_title(_clean(self._title))
+            self._title = None
+        elif tag == "p" and self._paragraph is not None:
+            self._close_paragraph()
+        elif tag == "a" and self._link is not None:
+            parts, href = self._link
+            self.collector.add_link(_clean(parts), href)
+            self._link = None
+        else:
+            return
+        if self.collector.done:
+            raise _StopParsing()
+
+    def _close_paragraph(self):
+        if self._paragraph is not None:
+            self.collector.add_paragraph(_clean(self._paragraph))
+            self._paragraph = None
+
+    def close(self):
+        super().close()
+        self._close_paragraph()
+
+    def handle_data(self, data):
+        if self._title is not None:
+            self._title.append(data)
+        if self._paragraph is not None:
+            self._paragraph.append(data)
+        if self._link is not None:
+            self._link[0].append(data)
+
+
+def _extract_stdlib(source, collector):
+    parser = _StreamingParser(collector)
+    try:
+        for chunk in _chunks(source):
+            if isinstance(chunk, bytes):
+                chunk = chunk.decode("utf-8", errors="replace")
+            parser.feed(chunk)
+        parser.close()
+    except _StopParsing:
+        return False
+    return True
+
+
+def _extract_lxml(source, collector):
+    parser = _lxml_etree().HTMLPullParser(events=("start", "end"))
+    open_paragraphs = 0
+    for chunk in _chunks(source):
+        parser.feed(chunk)
+        for event, element in parser.read_events():
+            tag = element.tag if isinstance(element.tag, str) else ""
+            if event == "start":
+                if tag == "p":
+                    open_paragraphs += 1
+                elif tag == "body" and not collector.title_done:
+                    collector.title_done = True
+                continue
+
+            if tag == "title" and not collector.title_done:
+                collector.add_title(_clean(element.itertext()))
+            elif tag == "p":
+                open_paragraphs -= 1
+                collector.add_paragraph(_clean(element.itertext()))
+                if not open_paragraphs:
+                    element.clear()
+            elif tag == "a" and element.get("href"):
+                collector.add_link(_clean(element.itertext()), element.get("href"))
+                if not open_paragraphs:
+                    element.clear()
+            else:
+                continue
+            if collector.done:
+                return False
+    parser.close()
+    return True
+
+
+def available_backends():
+    """الواجهات الخلفية المتاحة في هذه البيئة"""
+    return ["lxml", "html.parser"] if HAS_LXML else ["html.parser"]
+
+
+def extract_page(source, max_paragraphs=None, max_links=None, backend=None):
+    """استخراج العنوان وأول max_paragraphs فقرات وأول max_links روابط
+
+    source: نص HTML أو أي مُكرر لأجزاء النص (مثل iter_content) ليبدأ التحليل قبل اكتمال التحميل.
+    backend: "lxml" أو "html.parser" أو "auto" (lxml إن كان مثبتاً).
+    """
+    collector = _Collector(
+        DEFAULT_MAX_PARAGRAPHS if max_paragraphs is None else max_paragraphs,
+        DEFAULT_MAX_LINKS if max_links is None else max_links
+    )
+    backend = backend or DEFAULT_BACKEND
+    if backend == "auto":
+        backend = available_backends()[0]
+
+    if backend == "lxml":
+        if not HAS_LXML:
+            raise ValueError("الواجهة lxml غير مثبتة")
+        complete = _extract_lxml(source, collector)
+    elif backend == "html.parser":
+        complete = _extract_stdlib(source, collector)
+    else:
+        raise ValueError(f"واجهة تحليل غير معروفة: {backend}")
+
+    result = collector.result(complete)
+    result["backend"] = backend
+    return result
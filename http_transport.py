@@ -0,0 +1,117 @@
+# http_transport.py - طبقة نقل HTTP مشتركة مع تجميع الاتصالات (keep-alive)
+import os
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+from metrics import CONNECT_SECONDS
+
+# القيم الافتراضية، ويمكن تغييرها عبر متغيرات البيئة
+DEFAULT_POOL_CONNECTIONS = int(os.getenv('BLACKBOX_POOL_CONNECTIONS', '10'))
+DEFAULT_POOL_MAXSIZE = int(os.getenv('BLACKBOX_POOL_MAXSIZE', '20'))
+DEFAULT_POOL_BLOCK = os.getenv('BLACKBOX_POOL_BLOCK', '0') == '1'
+DEFAULT_CONNECT_TIMEOUT = float(os.getenv('BLACKBOX_CONNECT_TIMEOUT', '5'))
+DEFAULT_READ_TIMEOUT = float(os.getenv('BLACKBOX_READ_TIMEOUT', '60'))
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+class _TimedHTTPConnection(HTTPConnection):
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        CONNECT_SECONDS.observe(time.perf_counter() - started, host=self.host)
+
+
+class _TimedHTTPSConnection(HTTPSConnection):
+    def connect(self):
+        # يشمل زمن مصافحة TLS
+        started = time.perf_counter()
+        super().connect()
+        CONNECT_SECONDS.observe(time.perf_counter() - started, host=self.host)
+
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+
+class TimedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter يسجل زمن إنشاء كل اتصال جديد في http_connect_seconds (الاتصالات المعاد استخدامها لا تُحسب)"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool
+        }
+
+
+def build_session(pool_connections=None, pool_maxsize=None, pool_block=None):
+    """إنشاء جلسة requests جديدة بمجمع اتصالات دائمة
+
+    pool_connections: عدد المضيفين المختلفين الذين يُحتفظ بمجمع لكل منهم
+    pool_maxsize: الحد الأقصى للاتصالات المفتوحة لكل مضيف
+    pool_block: انتظار اتصال متاح بدلاً من فتح اتصالات إضافية عند امتلاء المجمع
+    """
+    adapter = TimedHTTPAdapter(
+        pool_connections=pool_connections or DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize=pool_maxsize or DEFAULT_POOL_MAXSIZE,
+        pool_block=DEFAULT_POOL_BLOCK if pool_block is None else pool_block
+    )
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Connection": "keep-alive"})
+    return session
+
+
+def get_session(pool_connections=None, pool_maxsize=None, pool_block=None):
+    """إرجاع جلسة مشتركة على مستوى العملية لنفس إعدادات المجمع"""
+    key = (
+        pool_connections or DEFAULT_POOL_CONNECTIONS,
+        pool_maxsize or DEFAULT_POOL_MAXSIZE,
+        DEFAULT_POOL_BLOCK if pool_block is None else pool_block
+    )
+    with _sessions_lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = build_session(*key)
+            _sessions[key] = session
+        return session
+
+
+def get_timeout(connect_timeout=None, read_timeout=None):
+    """مهلة (الاتصال، القراءة) بالصيغة التي يقبلها requests"""
+    return (
+        connect_timeout or DEFAULT_CONNECT_TIMEOUT,
+        read_timeout or DEFAULT_READ_TIMEOUT
+    )
+
+
+def close_sessions():
+    """إغلاق جميع الجلسات المشتركة وتحرير اتصالاتها"""
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def iter_sse_data(response):
+    """قراءة حقول data من استجابة بث SSE سطراً بسطر حتى [DONE]"""
+    for raw_line in response.iter_lines():
+        line = raw_line.decode("utf-8", errors="replace")
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        yield data
@@ -0,0 +1,297 @@
+# job_queue.py - طابور مهام دائم (SQLite) مع مجمع عمال حتى لا تتوقف العمليات الطويلة عند إعادة تشغيل Streamlit
+import json
+import os
+import threading
+import time
+import uuid
+
+import sqlite3
+
+DEFAULT_JOBS_PATH = os.getenv('JOBS_DB_PATH', 'jobs.db')
+DEFAULT_JOB_WORKERS = int(os.getenv('JOBS_WORKERS', '4'))
+DEFAULT_POLL_INTERVAL = float(os.getenv('JOBS_POLL_INTERVAL', '1'))
+DEFAULT_RETENTION = float(os.getenv('JOBS_RETENTION', str(24 * 3600)))
+# أقل فاصل بين كتابات التقدم والنتائج الجزئية في قاعدة البيانات
+PROGRESS_WRITE_INTERVAL = 0.25
+
+# حالات المهمة
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (QUEUED, RUNNING)
+
+
+class JobCancelled(Exception):
+    """تُرفع داخل معالج المهمة عند طلب إلغائها"""
+
+
+class JobContext:
+    """ما يراه معالج المهمة: تحديث التقدم والنتيجة الجزئية، والتحقق من الإلغاء"""
+
+    def __init__(self, queue, job_id):
+        self.queue = queue
+        self.job_id = job_id
+        self._last_write = 0.0
+        self._last_cancel_check = 0.0
+        self._cancelled = False
+
+    def update(self, progress=None, partial=None, force=False):
+        """حفظ التقدم (0..1) و/أو النتيجة الجزئية (أي قيمة JSON) مع تقليل عدد الكتابات"""
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now
+        self.queue._update_progress(self.job_id, progress, partial)
+
+    @property
+    def cancelled(self):
+        now = time.monotonic()
+        if not self._cancelled and now - self._last_cancel_check >= PROGRESS_WRITE_INTERVAL:
+            self._last_cancel_check = now
+            self._cancelled = self.queue._cancel_requested(self.job_id)
+        return self._cancelled
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled()
+
+    def stream(self, chunks):
+        """استهلاك مولد نصوص مع حفظ النص المتراكم كنتيجة جزئية، وإرجاع النص الكامل"""
+        text = ""
+        for chunk in chunks:
+            self.check_cancelled()
+            text += chunk
+            self.update(partial=text)
+        self.update(partial=text, force=True)
+        return text
+
+
+class JobQueue:
+    """طابور مهام في SQLite يشترك فيه كل المستخدمين (وكل العمليات التي تستخدم نفس الملف)
+
+    - submit() يُرجع معرف المهمة فوراً، والعمال ينفذونها في الخلفية
+    - get() يُرجع الحالة والتقدم والنتيجة الجزئية أو النهائية
+    - cancel() يلغي المهمة المنتظرة فوراً، ويطلب من المهمة الجارية التوقف عند أول فحص
+    """
+
+    def __init__(self, path=None, workers=None, poll_interval=None, retention=None):
+        self.path = path or DEFAULT_JOBS_PATH
+        self.workers = workers or DEFAULT_JOB_WORKERS
+        self.poll_interval = poll_interval or DEFAULT_POLL_INTERVAL
+        self.retention = retention or DEFAULT_RETENTION
+        self._handlers = {}
+        self._local = threading.local()
+        self._wakeup = threading.Condition()
+        self._threads = []
+        self._stopped = False
+        self._connection().executescript(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, params TEXT NOT NULL, status TEXT NOT NULL,"
+            " progress REAL, partial TEXT, result TEXT, error TEXT, cancel_requested INTEGER DEFAULT 0,"
+            " owner_pid INTEGER, created_at REAL NOT NULL, started_at REAL, finished_at REAL);"
+            "CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at);"
+        )
+
+    def _connection(self):
+        # اتصال SQLite لكل خيط لأن الاتصال الواحد لا يُشارك بين الخيوط بأمان
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.row_factory = sqlite3.Row
+            self._local.connection = connection
+        return connection
+
+    def register(self, kind, handler):
+        """تسجيل معالج لنوع مهمة: handler(job, **params) يُرجع نتيجة قابلة للتحويل إلى JSON"""
+        self._handlers[kind] = handler
+
+    def submit(self, kind, **params):
+        """إضافة مهمة إلى الطابور وإرجاع معرفها"""
+        if kind not in self._handlers:
+            raise ValueError(f"نوع مهمة غير معروف: {kind}")
+        job_id = uuid.uuid4().hex
+        self._connection().execute(
+            "INSERT INTO jobs (id, kind, params, status, progress, created_at) VALUES (?, ?, ?, ?, 0, ?)",
+            (job_id, kind, json.dumps(params, ensure_ascii=False), QUEUED, time.time())
+        )
+        with self._wakeup:
+            self._wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """حالة المهمة كقاموس، أو None إن لم تكن موجودة"""
+        row = self._connection().execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        for field in ("params", "partial", "result"):
+            if job[field] is not None:
+                job[field] = json.loads(job[field])
+        job["cancel_requested"] = bool(job["cancel_requested"])
+        return job
+
+    def cancel(self, job_id):
+        """إلغاء المهمة؛ المنتظرة تُلغى فوراً والجارية عند أول فحص في معالجها
+
+        المعالج يرى الإلغاء فقط عند نقاط الفحص (check_cancelled أو stream أو بين مراحله)؛
+        العملية الواحدة الجارية (تشغيل كود، طلب AI غير مبثوث) تكتمل ثم تُهمل نتيجتها وتُسجل المهمة ملغاة.
+        """
+        connection = self._connection()
+        connection.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+        connection.execute(
+            "UPDATE jobs SET status = ?, finished_at = ? WHERE id = ? AND status = ?",
+            (CANCELLED, time.time(), job_id, QUEUED)
+        )
+
+    def _claim(self):
+        """حجز أقدم مهمة منتظرة لها معالج في هذه العملية"""
+        if not self._handlers:
+            return None
+        connection = self._connection()
+        placeholders = ",".join("?" * len(self._handlers))
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            row = connection.execute(
+                f"SELECT id, kind, params FROM jobs WHERE status = ? AND kind IN ({placeholders})"
+                " ORDER BY created_at LIMIT 1",
+                (QUEUED, *self._handlers)
+            ).fetchone()
+            if row is not None:
+                connection.execute(
+                    "UPDATE jobs SET status = ?, owner_pid = ?, started_at = ? WHERE id = ?",
+                    (RUNNING, os.getpid(), time.time(), row["id"])
+                )
+            connection.execute("COMMIT")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, status, result=None, error=None):
+        """تسجيل نهاية المهمة؛ result نص JSON مرمّز مسبقاً أو None"""
+        self._connection().execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ?,"
+            " progress = CASE WHEN ? = 'done' THEN 1 ELSE progress END WHERE id = ?",
+            (status, result, error, time.time(), status, job_id)
+        )
+
+    def _update_progress(self, job_id, progress, partial):
+        connection = self._connection()
+        if progress is not None:
+            connection.execute("UPDATE jobs SET progress = ? WHERE id = ?", (progress, job_id))
+        if partial is not None:
+            connection.execute(
+                "UPDATE jobs SET partial = ? WHERE id = ?",
+                (json.dumps(partial, ensure_ascii=False), job_id)
+            )
+
+    def _cancel_requested(self, job_id):
+        row = self._connection().execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row["cancel_requested"])
+
+    def _run(self, row):
+        job = JobContext(self, row["id"])
+        status, result, error = DONE, None, None
+        try:
+            # فحص مباشر دون تقليل الاستعلامات: مهمة أُلغيت قبل حجزها بلحظة لا تبدأ أصلاً
+            if self._cancel_requested(row["id"]):
+                raise JobCancelled()
+            value = self._handlers[row["kind"]](job, **json.loads(row["params"]))
+            if self._cancel_requested(row["id"]):
+                status = CANCELLED
+            elif value is not None:
+                # الترميز قبل الكتابة حتى تُسجل النتيجة غير القابلة للتحويل إلى JSON كإخفاق للمهمة
+                result = json.dumps(value, ensure_ascii=False)
+        except JobCancelled:
+            status = CANCELLED
+        except Exception as e:
+            status, error = FAILED, str(e)
+        try:
+            self._finish(row["id"], status, result=result, error=error)
+        except Exception as e:
+            # مثلاً قاعدة البيانات مقفلة أطول من المهلة: محاولة أخيرة لتسجيل الإخفاق بدل بقاء المهمة "جارية"
+            self._finish(row["id"], FAILED, error=f"تعذر حفظ نتيجة المهمة: {e}")
+
+    def _worker(self):
+        while not self._stopped:
+            try:
+                row = self._claim()
+            except sqlite3.OperationalError:
+                row = None
+            if row is not None:
+                try:
+                    self._run(row)
+                except Exception:
+                    # لا يتوقف العامل بسبب مهمة واحدة؛ تبقى "جارية" حتى يعيدها recover() بعد إعادة التشغيل
+                    pass
+                continue
+            # ننتظر إشعاراً من submit() في هذه العملية، أو نعيد الفحص دورياً لمهام العمليات الأخرى
+            with self._wakeup:
+                self._wakeup.wait(self.poll_interval)
+
+    def recover(self):
+        """إعادة المهام الجارية لعمليات انتهت (مثل إعادة تشغيل الخادم) إلى الطابور"""
+        connection = self._connection()
+        rows = connection.execute("SELECT id, owner_pid FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+        for row in rows:
+            if row["owner_pid"] == os.getpid() or _process_alive(row["owner_pid"]):
+                continue
+            connection.execute(
+                "UPDATE jobs SET status = ?, owner_pid = NULL, started_at = NULL WHERE id = ? AND status = ?",
+                (QUEUED, row["id"], RUNNING)
+            )
+
+    def purge(self):
+        """حذف المهام المنتهية الأقدم من retention ثانية"""
+        self._connection().execute(
+            "DELETE FROM jobs WHERE status NOT IN (?, ?) AND finished_at < ?",
+            (QUEUED, RUNNING, time.time() - self.retention)
+        )
+
+    def start(self):
+        """تشغيل العمال في خيوط خلفية (مرة واحدة)"""
+        if not self._threads:
+            self.recover()
+            self.purge()
+            for _ in range(self.workers):
+                thread = threading.Thread(target=self._worker, daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return self
+
+    def stop(self):
+        self._stopped = True
+        with self._wakeup:
+            self._wakeup.notify_all()
+
+    def stats(self):
+        rows = self._connection().execute("SELECT status, COUNT(*) AS count FROM jobs GROUP BY status").fetchall()
+        return {row["status"]: row["count"] for row in rows}
+
+
+def _process_alive(pid):
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """الطابور المشترك على مستوى العملية (عدد محدود من العمال لجميع الجلسات)"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = JobQueue()
+        return _queue
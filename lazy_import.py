@@ -0,0 +1,91 @@
+# lazy_import.py - تحميل الوحدات عند أول استخدام مع تسجيل زمن الاستيراد لتقرير البدء
+import importlib
+import sys
+import threading
+import time
+
+# وحدات التطبيق التي يقيسها تقرير البدء (python lazy_import.py)
+APP_MODULES = (
+    "http_transport", "metrics", "serialization", "response_cache", "backends", "blackbox_client", "batch",
+    "stats_provider", "job_queue", "chunking", "code_runner", "conversation", "html_extract", "page_fetcher",
+    "crawler", "browser_pool", "code_index"
+)
+
+_timings = {}
+_timings_lock = threading.Lock()
+
+
+class LazyModule:
+    """وكيل لوحدة لا تُستورد إلا عند أول وصول لإحدى خصائصها
+
+    مثال: code_runner = lazy_import("code_runner") ثم code_runner.get_code_runner()
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                started = time.perf_counter()
+                self._module = importlib.import_module(self._name)
+                with _timings_lock:
+                    _timings[self._name] = time.perf_counter() - started
+        return self._module
+
+    def __getattr__(self, attribute):
+        return getattr(self._module or self._load(), attribute)
+
+    @property
+    def loaded(self):
+        return self._module is not None
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def lazy_import(name):
+    """إرجاع وكيل كسول للوحدة name (إن كانت محملة مسبقاً يُرجع الوحدة نفسها)"""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def import_timings():
+    """أزمنة استيراد الوحدات الكسولة التي حُملت حتى الآن بالثواني"""
+    with _timings_lock:
+        return dict(_timings)
+
+
+def measure_import(name):
+    """زمن الاستيراد (ms) والزيادة في الذاكرة المقيمة (MB) لوحدة في مفسر جديد بارد"""
+    # أدوات القياس فقط، فلا نحملها مع التطبيق
+    import json
+    import subprocess
+
+    script = (
+        "import importlib, json, resource, time\n"
+        "rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss\n"
+        "started = time.perf_counter()\n"
+        f"importlib.import_module({name!r})\n"
+        "print(json.dumps({'ms': (time.perf_counter() - started) * 1000,"
+        " 'rss_mb': (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss) / 1024}))\n"
+    )
+    completed = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True)
+    if completed.returncode != 0:
+        return {"module": name, "error": completed.stderr.strip().splitlines()[-1]}
+    return dict(json.loads(completed.stdout.strip().splitlines()[-1]), module=name)
+
+
+def startup_report(modules=APP_MODULES):
+    """قياس كل وحدة على حدة في مفسر جديد حتى لا تتأثر بما حُمّل قبلها"""
+    return [measure_import(name) for name in modules]
+
+
+if __name__ == "__main__":
+    for row in startup_report(sys.argv[1:] or APP_MODULES):
+        if "error" in row:
+            print(f"{row['module']:<16} ⚠️ {row['error']}")
+        else:
+            print(f"{row['module']:<16} {row['ms']:8.1f} ms {row['rss_mb']:7.1f} MB")
@@ -1,17 +1,29 @@
-
 # main.py - التطبيق الرئيسي في Replit
 import streamlit as st
 import os
-import requests
 import json
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.chrome.service import Service
-from webdriver_manager.chrome import ChromeDriverManager
-from bs4 import BeautifulSoup
 from dotenv import load_dotenv
-import tempfile
-import subprocess
+import time
+import resource
+
+run_started = time.perf_counter()
+
+from backends import get_backend
+from batch import BATCH_OPERATIONS
+from job_queue import ACTIVE_STATUSES, CANCELLED, FAILED, QUEUED, get_job_queue
+from lazy_import import import_timings, lazy_import
+from metrics import REGISTRY, start_metrics_server
+from response_cache import get_default_cache
+from stats_provider import get_stats_provider
+
+# وحدات التصفح والتشغيل تُحمّل عند أول استخدام فقط حتى لا تدفع كل جلسة كلفتها عند البدء
+chunking = lazy_import("chunking")
+code_index = lazy_import("code_index")
+code_runner = lazy_import("code_runner")
+conversation = lazy_import("conversation")
+crawler = lazy_import("crawler")
+html_extract = lazy_import("html_extract")
+page_fetcher = lazy_import("page_fetcher")
 
 # تحميل متغيرات البيئة
 load_dotenv()
@@ -23,78 +35,182 @@ st.set_page_config(
     layout="wide"
 )
 
-class BlackboxAIClient:
-    def __init__(self):
-        self.base_url = "http://0.0.0.0:5000"
-        
-    def generate_code(self, prompt, language="python"):
-        """توليد كود برمجي بناءً على الوصف المطلوب"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/blackbox/code",
-                json={
-                    "action": "generate",
-                    "prompt": prompt,
-                    "language": language
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"success": False, "error": f"خطأ HTTP: {response.status_code}"}
-                
-        except Exception as e:
-            return {"success": False, "error": f"خطأ في الاتصال: {str(e)}"}
-    
-    def explain_code(self, code):
-        """شرح الكود المُرسل"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/blackbox/code",
-                json={
-                    "action": "explain",
-                    "code": code
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"success": False, "error": f"خطأ HTTP: {response.status_code}"}
-                
-        except Exception as e:
-            return {"success": False, "error": f"خطأ في الاتصال: {str(e)}"}
-    
-    def debug_code(self, code, error_message=""):
-        """تصحيح الأخطاء في الكود"""
-        try:
-            response = requests.post(
-                f"{self.base_url}/api/blackbox/code",
-                json={
-                    "action": "debug",
-                    "code": code,
-                    "error_message": error_message
-                },
-                timeout=30
-            )
-            
-            if response.status_code == 200:
-                return response.json()
-            else:
-                return {"success": False, "error": f"خطأ HTTP: {response.status_code}"}
-                
-        except Exception as e:
-            return {"success": False, "error": f"خطأ في الاتصال: {str(e)}"}
+# معالجات المهام الخلفية: تعمل في عمال طابور المهام لا في إعادة تشغيل السكربت
+def ai_job(operation):
+    def handler(job, args, stream):
+        def progress(done, total):
+            # الإلغاء يُفحص بين الأجزاء فلا تُرسل بقية أجزاء ملف كبير بعد طلب الإلغاء
+            job.check_cancelled()
+            job.update(progress=0.9 * done / total, force=True)
+        # الملفات الكبيرة تُقسم على حدود الدوال وتُعالج أجزاؤها بالتوازي ثم تُجمع
+        backend = chunking.ChunkedBackend(get_backend(), progress=progress)
+        if stream:
+            run = {}
+            def chunks():
+                # مولد map_reduce_stream يُرجع إحصاء الأجزاء في نهايته
+                run["chunks"] = yield from getattr(backend, f"{operation}_stream")(*args)
+            # النص المتراكم يُحفظ كنتيجة جزئية يعرضها الاستطلاع أثناء البث
+            text = job.stream(chunks())
+            return {"success": True, "response": text, "chunks": run.get("chunks")}
+        return getattr(backend, operation)(*args)
+    return handler
+
+def debug_session_job(job, state, code, error_message, stream):
+    # جلسة التصحيح تُعاد من حالتها المحفوظة، فيُرسل فرق الكود فقط في الأدوار اللاحقة
+    session = conversation.Conversation.from_state(state, backend=get_backend())
+    if stream:
+        text = job.stream(session.debug_stream(code, error_message))
+    else:
+        result = session.debug(code, error_message)
+        if not result.get("success"):
+            return result
+        text = result["response"]
+    return {"success": True, "response": text, "state": session.to_state(), "stats": session.stats()}
+
+def run_code_job(job, code):
+    # تشغيل على عامل دافئ بحدود CPU والذاكرة بدلاً من مفسر جديد لكل نقرة
+    # التشغيل الجاري لا يُقاطع عند الإلغاء (محدود بمهلته) وتُهمل نتيجته
+    return code_runner.get_code_runner().run(code)
+
+def browse_job(job, url, force_browser, max_paragraphs, max_links):
+    # طلب HTTP مباشر أولاً، والمتصفح الدافئ فقط للصفحات الديناميكية
+    fetched = page_fetcher.get_page_fetcher().fetch(url, force_browser=force_browser)
+    job.check_cancelled()
+    job.update(progress=0.5, force=True)
+    # تحليل تدريجي يتوقف بمجرد جمع العنوان والفقرات والروابط المطلوبة
+    page = html_extract.extract_page(fetched["html"], max_paragraphs=max_paragraphs, max_links=max_links)
+    return {"tier": fetched["tier"], "elapsed": fetched["elapsed"], "page": page}
+
+def crawl_job(job, url, max_pages, max_depth, max_workers, max_paragraphs, force_browser):
+    site_crawler = crawler.Crawler(
+        max_pages=max_pages,
+        max_depth=max_depth,
+        max_workers=max_workers,
+        max_paragraphs=max_paragraphs,
+        force_browser=force_browser
+    )
+    pages = []
+    for page in site_crawler.crawl(url):
+        job.check_cancelled()
+        pages.append(page)
+        job.update(progress=min(1.0, len(pages) / max_pages), partial=pages)
+    return pages
+
+def batch_job(job, operation, items, max_workers):
+    results = []
+    for result in chunking.ChunkedBackend(get_backend()).batch(operation, items, max_workers=max_workers):
+        job.check_cancelled()
+        results.append(result)
+        job.update(progress=len(results) / len(items), partial=results)
+    return results
+
+def index_job(job, root):
+    # تحديث تدريجي: لا يُعاد تقسيم إلا الملفات التي تغيرت منذ آخر تحديث
+    index = code_index.get_code_index(root)
+    update = index.update(progress=lambda done, total: job.update(progress=done / total))
+    return {"update": update, "index": index.stats()}
+
+def chat_job(job, message, context, root, top_k, stream):
+    # أقرب top_k مقاطع من المشروع بدلاً من لصق الملفات كاملة في السياق
+    index = code_index.get_code_index(root)
+    index.update()
+    job.check_cancelled()
+    job.update(progress=0.1, force=True)
+    sources = [
+        {key: snippet[key] for key in ("path", "start_line", "end_line", "score")}
+        for snippet in index.search(message, top_k)
+    ]
+    backend = get_backend()
+    if stream:
+        text = job.stream(backend.chat_stream(message, context, index=index, top_k=top_k))
+        result = {"success": True, "response": text}
+    else:
+        result = backend.chat(message, context, index=index, top_k=top_k)
+    return dict(result, sources=sources)
+
+@st.cache_resource
+def init_job_queue():
+    # طابور واحد لكل العملية: عدد محدود من العمال (JOBS_WORKERS) لكل الجلسات
+    queue = get_job_queue()
+    for operation in ("generate_code", "explain_code"):
+        queue.register(operation, ai_job(operation))
+    queue.register("debug_session", debug_session_job)
+    queue.register("run_code", run_code_job)
+    queue.register("browse", browse_job)
+    queue.register("crawl", crawl_job)
+    queue.register("batch", batch_job)
+    queue.register("index_project", index_job)
+    queue.register("chat", chat_job)
+    return queue.start()
+
+# المهام التي ما زالت تعمل في هذا العرض؛ وجودها يعني إعادة التشغيل تلقائياً لمتابعتها
+active_jobs = []
+
+def submit_job(state_key, kind, **params):
+    """إرسال مهمة وحفظ معرفها في الجلسة حتى تنجو من إعادة التشغيل"""
+    st.session_state[state_key] = job_queue.submit(kind, **params)
+
+def poll_job(state_key, placeholder=None, language=None):
+    """متابعة المهمة المحفوظة في st.session_state[state_key]
+
+    أثناء التنفيذ تعرض التقدم والنتيجة الجزئية وزر الإلغاء وتُرجع None؛ عند الانتهاء تحذف المعرف
+    من الجلسة وتُرجع المهمة مرة واحدة ليحفظ المستدعي نتيجتها.
+    """
+    job_id = st.session_state.get(state_key)
+    if job_id is None:
+        return None
+    job = job_queue.get(job_id)
+    if job is None:
+        # حُذفت من قاعدة البيانات (انتهت مدة الاحتفاظ)
+        del st.session_state[state_key]
+        return None
+
+    if job["status"] in ACTIVE_STATUSES:
+        active_jobs.append(job_id)
+        with (placeholder or st.empty()).container():
+            label = "⏳ في الانتظار..." if job["status"] == QUEUED else "⚙️ جاري التنفيذ..."
+            if job["cancel_requested"]:
+                label = "⏹️ جاري الإلغاء..."
+            st.progress(min(1.0, job["progress"] or 0.0), text=label)
+            if isinstance(job["partial"], str):
+                if language:
+                    st.code(job["partial"], language=language)
+                else:
+                    st.markdown(job["partial"])
+            if not job["cancel_requested"] and st.button("⏹️ إلغاء", key=f"cancel_{state_key}"):
+                job_queue.cancel(job_id)
+        return None
+
+    del st.session_state[state_key]
+    if placeholder is not None:
+        placeholder.empty()
+    return job
+
+def job_error(job):
+    """رسالة الخطأ لمهمة منتهية، أو None إن نجحت"""
+    if job["status"] == CANCELLED:
+        return "تم إلغاء المهمة"
+    if job["status"] == FAILED:
+        return job["error"] or "خطأ غير معروف"
+    result = job["result"]
+    if isinstance(result, dict) and result.get("success") is False:
+        return result.get("error", "خطأ غير معروف")
+    return None
 
 # تهيئة العميل
 @st.cache_resource
 def init_blackbox_client():
-    return BlackboxAIClient()
+    # proxy عبر خادم Node أو direct إلى Blackbox من داخل العملية حسب BLACKBOX_BACKEND
+    return get_backend()
+
+@st.cache_resource
+def init_metrics_server():
+    # نقطة /metrics لـ Prometheus (BLACKBOX_METRICS_PORT، و0 للتعطيل)
+    return start_metrics_server()
 
 client = init_blackbox_client()
+metrics_port = init_metrics_server()
+job_queue = init_job_queue()
 
 # العنوان الرئيسي
 st.title("🔥 BlackboxAI مع Replit - مولد الكود الذكي")
@@ -113,15 +229,22 @@ with st.sidebar:
     include_comments = st.checkbox("تضمين التعليقات", True)
     
     include_error_handling = st.checkbox("تضمين معالجة الأخطاء", True)
+    
+    stream_output = st.checkbox("بث الاستجابة تدريجياً", True)
 
 # التبويبات الرئيسية
-tab1, tab2, tab3, tab4 = st.tabs(["🚀 توليد الكود", "📖 شرح الكود", "🐛 تصحيح الأخطاء", "🌐 تصفح الويب"])
+tab1, tab2, tab3, tab4, tab5, tab6 = st.tabs(
+    ["🚀 توليد الكود", "📖 شرح الكود", "🐛 تصحيح الأخطاء", "🌐 تصفح الويب", "📁 ملفات متعددة", "💬 محادثة المشروع"]
+)
 
 with tab1:
     st.header("📝 توليد الكود")
     
     col1, col2 = st.columns([1, 1])
     
+    with col2:
+        live_output = st.empty()
+    
     with col1:
         user_prompt = st.text_area(
             "اكتب وصف للكود المطلوب:",
@@ -131,23 +254,27 @@ with tab1:
         
         if st.button("🚀 توليد الكود", type="primary"):
             if user_prompt:
-                with st.spinner("جاري توليد الكود..."):
-                    # تحسين الطلب
-                    enhanced_prompt = f"""
-                    Create a {language} program that {user_prompt}.
-                    Requirements:
-                    - Complexity level: {complexity}/5
-                    - Include comments: {include_comments}
-                    - Include error handling: {include_error_handling}
-                    - Make it production-ready
-                    """
-                    
-                    result = client.generate_code(enhanced_prompt, language)
-                    
-                    if result.get("success"):
-                        st.session_state.generated_code = result["result"]["response"]
-                    else:
-                        st.error(f"فشل في توليد الكود: {result.get('error', 'خطأ غير معروف')}")
+                # تحسين الطلب
+                enhanced_prompt = f"""
+                Create a {language} program that {user_prompt}.
+                Requirements:
+                - Complexity level: {complexity}/5
+                - Include comments: {include_comments}
+                - Include error handling: {include_error_handling}
+                - Make it production-ready
+                """
+                
+                # التوليد يعمل في الخلفية ويستمر حتى لو أعيد تشغيل الصفحة
+                submit_job("generate_job", "generate_code", args=[enhanced_prompt, language], stream=stream_output)
+        
+        generate_job = poll_job("generate_job", live_output, language=language)
+        if generate_job:
+            error = job_error(generate_job)
+            if error:
+                st.error(f"فشل في توليد الكود: {error}")
+            else:
+                st.session_state.generated_code = generate_job["result"]["response"]
+                st.session_state.pop("run_result", None)
     
     with col2:
         if 'generated_code' in st.session_state:
@@ -166,33 +293,33 @@ with tab1:
             
             with col_run:
                 if language == "python" and st.button("▶️ تشغيل الكود"):
-                    with st.spinner("جاري تشغيل الكود..."):
-                        try:
-                            with tempfile.NamedTemporaryFile(mode='w', suffix='.py', delete=False, encoding='utf-8') as f:
-                                f.write(st.session_state.generated_code)
-                                temp_file = f.name
-                            
-                            result = subprocess.run(['python', temp_file], 
-                                                  capture_output=True, text=True, timeout=10)
-                            
-                            if result.returncode == 0:
-                                st.success("تم تشغيل الكود بنجاح!")
-                                if result.stdout:
-                                    st.code(result.stdout, language="text")
-                            else:
-                                st.error("خطأ في تشغيل الكود:")
-                                st.code(result.stderr, language="text")
-                                
-                        except subprocess.TimeoutExpired:
-                            st.error("انتهت مهلة تشغيل الكود")
-                        except Exception as e:
-                            st.error(f"خطأ في التشغيل: {str(e)}")
-                        finally:
-                            if 'temp_file' in locals():
-                                try:
-                                    os.unlink(temp_file)
-                                except:
-                                    pass
+                    submit_job("run_job", "run_code", code=st.session_state.generated_code)
+            
+            run_job = poll_job("run_job")
+            if run_job:
+                error = job_error(run_job)
+                if error:
+                    st.error(f"خطأ في التشغيل: {error}")
+                else:
+                    st.session_state.run_result = run_job["result"]
+            
+            if 'run_result' in st.session_state:
+                result = st.session_state.run_result
+                
+                if result["timed_out"]:
+                    st.error("انتهت مهلة تشغيل الكود")
+                elif result["returncode"] == 0:
+                    st.success("تم تشغيل الكود بنجاح!")
+                    if result["stdout"]:
+                        st.code(result["stdout"], language="text")
+                else:
+                    st.error("خطأ في تشغيل الكود:")
+                    st.code(result["stderr"], language="text")
+                
+                st.caption(
+                    f"⏱️ {result['elapsed'] * 1000:.0f} ms"
+                    + (" — 🗄️ من الذاكرة المؤقتة" if result["cached"] else "")
+                )
 
 with tab2:
     st.header("📖 شرح الكود")
@@ -205,20 +332,35 @@ with tab2:
     
     if st.button("📖 شرح الكود"):
         if code_to_explain:
-            with st.spinner("جاري تحليل وشرح الكود..."):
-                result = client.explain_code(code_to_explain)
-                
-                if result.get("success"):
-                    st.success("تم تحليل الكود بنجاح!")
-                    st.markdown(result["result"]["response"])
-                else:
-                    st.error(f"فشل في شرح الكود: {result.get('error', 'خطأ غير معروف')}")
+            submit_job("explain_job", "explain_code", args=[code_to_explain], stream=stream_output)
+    
+    explain_job = poll_job("explain_job")
+    if explain_job:
+        error = job_error(explain_job)
+        if error:
+            st.error(f"فشل في شرح الكود: {error}")
+        else:
+            st.session_state.explanation = explain_job["result"]["response"]
+            st.session_state.explain_chunks = explain_job["result"].get("chunks")
+            st.success("تم تحليل الكود بنجاح!")
+    
+    if 'explanation' in st.session_state:
+        explain_chunks = st.session_state.get("explain_chunks")
+        if explain_chunks:
+            st.caption(
+                f"🧩 قُسم الكود إلى {explain_chunks['chunks']} أجزاء "
+                f"({explain_chunks['cached']} منها من الذاكرة المؤقتة)"
+            )
+        st.markdown(st.session_state.explanation)
 
 with tab3:
     st.header("🐛 تصحيح الأخطاء")
     
     col1, col2 = st.columns([1, 1])
     
+    with col2:
+        live_fix = st.empty()
+    
     with col1:
         buggy_code = st.text_area(
             "الكود الذي يحتوي على أخطاء:",
@@ -232,15 +374,43 @@ with tab3:
             placeholder="ZeroDivisionError: division by zero"
         )
         
-        if st.button("🔧 إصلاح الأخطاء"):
-            if buggy_code:
-                with st.spinner("جاري تحليل وإصلاح الأخطاء..."):
-                    result = client.debug_code(buggy_code, error_msg)
-                    
-                    if result.get("success"):
-                        st.session_state.fixed_code = result["result"]["response"]
-                    else:
-                        st.error(f"فشل في إصلاح الكود: {result.get('error', 'خطأ غير معروف')}")
+        col_fix, col_new = st.columns(2)
+        
+        with col_fix:
+            if st.button("🔧 إصلاح الأخطاء"):
+                if buggy_code:
+                    # الأدوار اللاحقة في نفس الجلسة ترسل فرق الكود عن آخر نسخة بدلاً من الكود كاملاً
+                    submit_job(
+                        "debug_job",
+                        "debug_session",
+                        state=st.session_state.get("debug_session"),
+                        code=buggy_code,
+                        error_message=error_msg,
+                        stream=stream_output
+                    )
+        
+        with col_new:
+            if st.button("🆕 جلسة تصحيح جديدة"):
+                for key in ("debug_session", "debug_stats", "fixed_code"):
+                    st.session_state.pop(key, None)
+        
+        debug_job = poll_job("debug_job", live_fix, language=language)
+        if debug_job:
+            error = job_error(debug_job)
+            if error:
+                st.error(f"فشل في إصلاح الكود: {error}")
+            else:
+                st.session_state.fixed_code = debug_job["result"]["response"]
+                st.session_state.debug_session = debug_job["result"]["state"]
+                st.session_state.debug_stats = debug_job["result"]["stats"]
+        
+        if 'debug_stats' in st.session_state:
+            debug_stats = st.session_state.debug_stats
+            st.caption(
+                f"💬 الأدوار: {debug_stats['turns']} — السياق: ~{debug_stats['context_tokens']} رمز"
+                + (" (مع ملخص)" if debug_stats["summarized"] else "")
+                + f" — توفير الإرسال: {debug_stats['saved']:.0%}"
+            )
     
     with col2:
         if 'fixed_code' in st.session_state:
@@ -255,72 +425,326 @@ with tab4:
         placeholder="https://example.com"
     )
     
-    if st.button("🌐 تصفح الموقع"):
+    browse_mode = st.radio("الوضع:", ["📄 صفحة واحدة", "🕸️ زحف متعدد الصفحات"], horizontal=True)
+    
+    force_browser = st.checkbox("استخدام المتصفح دائماً (للصفحات المعتمدة على JavaScript)", False)
+    
+    if browse_mode == "🕸️ زحف متعدد الصفحات":
+        col_depth, col_budget, col_workers = st.columns(3)
+        with col_depth:
+            crawl_depth = st.number_input("العمق:", 0, 5, 1)
+        with col_budget:
+            crawl_budget = st.number_input("الحد الأقصى للصفحات:", 1, 500, 20)
+        with col_workers:
+            crawl_workers = st.number_input("العمال المتوازيون:", 1, 32, 8)
+    
+    col_paragraphs, col_links = st.columns(2)
+    with col_paragraphs:
+        max_paragraphs = st.number_input("عدد الفقرات:", 1, 50, 5)
+    with col_links:
+        max_links = st.number_input("عدد الروابط:", 1, 100, 10)
+    
+    if browse_mode == "🕸️ زحف متعدد الصفحات" and st.button("🕸️ بدء الزحف"):
         if url:
-            with st.spinner("جاري تحميل الصفحة..."):
-                try:
-                    # إعداد Chrome للتشغيل في وضع headless
-                    chrome_options = Options()
-                    chrome_options.add_argument("--headless")
-                    chrome_options.add_argument("--no-sandbox")
-                    chrome_options.add_argument("--disable-dev-shm-usage")
-                    chrome_options.add_argument("--disable-gpu")
-                    
-                    # تهيئة WebDriver
-                    service = Service(ChromeDriverManager().install())
-                    driver = webdriver.Chrome(service=service, options=chrome_options)
-                    
-                    # تحميل الصفحة
-                    driver.get(url)
-                    page_source = driver.page_source
-                    driver.quit()
-                    
-                    # تحليل المحتوى باستخدام BeautifulSoup
-                    soup = BeautifulSoup(page_source, 'html.parser')
-                    
-                    # عرض المعلومات الأساسية
-                    st.success("تم تحميل الصفحة بنجاح!")
-                    
-                    title = soup.find('title')
-                    if title:
-                        st.subheader(f"📝 العنوان: {title.get_text()}")
-                    
-                    # استخراج النصوص الرئيسية
-                    paragraphs = soup.find_all('p')[:5]  # أول 5 فقرات
-                    if paragraphs:
-                        st.subheader("📄 المحتوى:")
-                        for i, p in enumerate(paragraphs, 1):
-                            text = p.get_text().strip()
-                            if text:
-                                st.write(f"{i}. {text[:200]}...")
-                    
-                    # استخراج الروابط
-                    links = soup.find_all('a', href=True)[:10]  # أول 10 روابط
-                    if links:
-                        st.subheader("🔗 الروابط:")
-                        for link in links:
-                            link_text = link.get_text().strip()
-                            link_url = link['href']
-                            if link_text and link_url:
-                                st.write(f"- [{link_text}]({link_url})")
-                    
-                except Exception as e:
-                    st.error(f"خطأ في تحميل الصفحة: {str(e)}")
+            submit_job(
+                "crawl_job",
+                "crawl",
+                url=url,
+                max_pages=crawl_budget,
+                max_depth=crawl_depth,
+                max_workers=crawl_workers,
+                max_paragraphs=max_paragraphs,
+                force_browser=force_browser
+            )
+    
+    if browse_mode == "🕸️ زحف متعدد الصفحات":
+        crawl_progress = st.empty()
+        crawl_job_state = poll_job("crawl_job", crawl_progress)
+        if crawl_job_state:
+            error = job_error(crawl_job_state)
+            # عند الإلغاء أو الفشل نحتفظ بالصفحات التي اكتملت قبل التوقف
+            pages = crawl_job_state["result"] if error is None else crawl_job_state["partial"] or []
+            if error:
+                st.error(f"خطأ في الزحف: {error}")
+            else:
+                st.success(f"اكتمل الزحف: {len(pages)} صفحة")
+            st.session_state.crawl_pages = pages
+            st.session_state.crawl_jsonl = "".join(json.dumps(page, ensure_ascii=False) + "\n" for page in pages)
+            st.session_state.crawl_context = crawler.crawl_context(pages)
+        
+        # الصفحات المكتملة حتى الآن أثناء الزحف، أو نتيجة آخر زحف
+        if "crawl_job" in st.session_state:
+            crawl_pages = (job_queue.get(st.session_state.crawl_job) or {}).get("partial") or []
+        else:
+            crawl_pages = st.session_state.get("crawl_pages", [])
+        for page in crawl_pages:
+            if page.get("error"):
+                st.warning(f"⚠️ {page['url']}: {page['error']}")
+            else:
+                with st.expander(f"📄 {page.get('title') or page['url']} (عمق {page['depth']}، {page['tier']})"):
+                    st.write(page["url"])
+                    for text in page["paragraphs"]:
+                        st.write(f"- {text[:200]}")
+    
+    if browse_mode == "🕸️ زحف متعدد الصفحات" and 'crawl_jsonl' in st.session_state and "crawl_job" not in st.session_state:
+        st.download_button("💾 تنزيل النتائج (JSONL)", st.session_state.crawl_jsonl, file_name="crawl.jsonl")
+        with st.expander("🧠 السياق المُجمع للمحادثة"):
+            st.text(st.session_state.crawl_context)
+    
+    if browse_mode == "📄 صفحة واحدة" and st.button("🌐 تصفح الموقع"):
+        if url:
+            submit_job(
+                "browse_job",
+                "browse",
+                url=url,
+                force_browser=force_browser,
+                max_paragraphs=max_paragraphs,
+                max_links=max_links
+            )
+    
+    if browse_mode == "📄 صفحة واحدة":
+        browse_job_state = poll_job("browse_job")
+        if browse_job_state:
+            error = job_error(browse_job_state)
+            if error:
+                st.error(f"خطأ في تحميل الصفحة: {error}")
+            else:
+                st.session_state.browse_result = browse_job_state["result"]
+        
+        if 'browse_result' in st.session_state:
+            fetched = st.session_state.browse_result
+            page = fetched["page"]
+            
+            # عرض المعلومات الأساسية
+            st.success("تم تحميل الصفحة بنجاح!")
+            tier_label = "🖥️ المتصفح" if fetched["tier"] == page_fetcher.TIER_BROWSER else f"⚡ {fetched['tier']}"
+            st.caption(f"مصدر الصفحة: {tier_label} — {fetched['elapsed'] * 1000:.0f} ms")
+            
+            if page["title"]:
+                st.subheader(f"📝 العنوان: {page['title']}")
+            
+            # النصوص الرئيسية
+            if page["paragraphs"]:
+                st.subheader("📄 المحتوى:")
+                for i, text in enumerate(page["paragraphs"], 1):
+                    st.write(f"{i}. {text[:200]}...")
+            
+            # الروابط
+            if page["links"]:
+                st.subheader("🔗 الروابط:")
+                for link in page["links"]:
+                    st.write(f"- [{link['text']}]({link['href']})")
+
+with tab5:
+    st.header("📁 معالجة ملفات متعددة")
+    
+    uploaded_files = st.file_uploader("ارفع ملفات الكود:", accept_multiple_files=True)
+    
+    operation_labels = {
+        "explain_code": "📖 شرح",
+        "debug_code": "🐛 تصحيح",
+        "optimize_code": "⚡ تحسين",
+        "convert_code": "🔄 تحويل"
+    }
+    batch_operation = st.selectbox(
+        "العملية:",
+        BATCH_OPERATIONS,
+        format_func=lambda operation: operation_labels[operation]
+    )
+    
+    target_language = None
+    if batch_operation == "convert_code":
+        target_language = st.selectbox(
+            "تحويل إلى:",
+            ["python", "javascript", "java", "cpp", "go", "rust"]
+        )
+    
+    max_workers = st.slider("عدد الطلبات المتوازية:", 1, 16, 4)
+    
+    if st.button("▶️ معالجة الملفات"):
+        if uploaded_files:
+            items = []
+            for uploaded in uploaded_files:
+                code = uploaded.getvalue().decode("utf-8", errors="replace")
+                if batch_operation == "convert_code":
+                    # لغة المصدر من امتداد كل ملف، ولغة الشريط الجانبي للامتدادات غير المعروفة
+                    extension = os.path.splitext(uploaded.name)[1].lower()
+                    source_language = code_index.LANGUAGES.get(extension, language)
+                    items.append((code, source_language, target_language))
+                else:
+                    items.append(code)
+            
+            # أسماء الملفات تُحفظ مع المهمة لأن قائمة الملفات المرفوعة قد تتغير قبل انتهائها
+            st.session_state.batch_names = [uploaded.name for uploaded in uploaded_files]
+            submit_job("batch_job", "batch", operation=batch_operation, items=items, max_workers=max_workers)
+    
+    batch_job_state = poll_job("batch_job")
+    if batch_job_state:
+        error = job_error(batch_job_state)
+        if error:
+            st.error(f"خطأ في معالجة الملفات: {error}")
+        st.session_state.batch_results = batch_job_state["result"] or batch_job_state["partial"] or []
+    
+    if "batch_job" in st.session_state:
+        batch_results = (job_queue.get(st.session_state.batch_job) or {}).get("partial") or []
+    else:
+        batch_results = st.session_state.get("batch_results", [])
+    
+    if batch_results:
+        names = st.session_state.get("batch_names", [])
+        failures = []
+        
+        for result in batch_results:
+            name = names[result["index"]] if result["index"] < len(names) else f"#{result['index'] + 1}"
+            
+            if result.get("success"):
+                with st.expander(f"✅ {name}"):
+                    st.markdown(result["response"])
+            else:
+                failures.append((name, result.get("error", "خطأ غير معروف")))
+        
+        if "batch_job" not in st.session_state:
+            st.success(f"اكتملت معالجة {len(batch_results) - len(failures)} من {len(names)} ملف")
+        for name, error in failures:
+            st.error(f"{name}: {error}")
+
+with tab6:
+    st.header("💬 محادثة المشروع")
+    st.caption("تُسترجع أقرب المقاطع من فهرس محلي للمشروع وتُرسل مع السؤال بدلاً من الملفات كاملة")
+    
+    col_root, col_top_k = st.columns([2, 1])
+    with col_root:
+        project_root = st.text_input("مجلد المشروع:", value=os.getenv('CODE_INDEX_ROOT', '.'))
+    with col_top_k:
+        chat_top_k = st.slider("عدد المقاطع المسترجعة:", 1, 20, 5)
+    
+    if st.button("🔄 تحديث الفهرس"):
+        if os.path.isdir(project_root):
+            submit_job("index_job", "index_project", root=project_root)
+        else:
+            st.error(f"المجلد غير موجود: {project_root}")
+    
+    index_job_state = poll_job("index_job")
+    if index_job_state:
+        error = job_error(index_job_state)
+        if error:
+            st.error(f"فشل في تحديث الفهرس: {error}")
+        else:
+            st.session_state.index_stats = index_job_state["result"]
+    
+    if 'index_stats' in st.session_state:
+        update = st.session_state.index_stats["update"]
+        index_stats = st.session_state.index_stats["index"]
+        st.caption(
+            f"🗂️ {index_stats['files']} ملف / {index_stats['snippets']} مقطع — آخر تحديث: "
+            f"{update['indexed']} أعيدت فهرسته، {update['unchanged']} دون تغيير، {update['removed']} حُذف "
+            f"({update['elapsed'] * 1000:.0f} ms)"
+        )
+    
+    chat_question = st.text_area("سؤالك عن المشروع:", height=120)
+    
+    include_crawl = False
+    if 'crawl_context' in st.session_state:
+        include_crawl = st.checkbox("تضمين سياق الزحف", False)
+    
+    chat_output = st.empty()
+    if st.button("💬 إرسال", type="primary"):
+        if chat_question and os.path.isdir(project_root):
+            submit_job(
+                "chat_job",
+                "chat",
+                message=chat_question,
+                context=st.session_state.crawl_context if include_crawl else "",
+                root=project_root,
+                top_k=chat_top_k,
+                stream=stream_output
+            )
+    
+    chat_job_state = poll_job("chat_job", chat_output)
+    if chat_job_state:
+        error = job_error(chat_job_state)
+        if error:
+            st.error(f"فشل في المحادثة: {error}")
+        else:
+            st.session_state.chat_answer = chat_job_state["result"]["response"]
+            st.session_state.chat_sources = chat_job_state["result"]["sources"]
+    
+    if 'chat_answer' in st.session_state:
+        st.markdown(st.session_state.chat_answer)
+        with st.expander(f"📚 المقاطع المستخدمة ({len(st.session_state.chat_sources)})"):
+            for source in st.session_state.chat_sources:
+                st.write(f"- `{source['path']}` (الأسطر {source['start_line']}-{source['end_line']}، {source['score']:.1f})")
 
 # إحصائيات النظام
 st.sidebar.markdown("---")
 st.sidebar.header("📊 إحصائيات النظام")
 
-try:
-    response = requests.get(f"http://0.0.0.0:5000/api/stats", timeout=5)
-    if response.status_code == 200:
-        stats = response.json()
-        st.sidebar.metric("🤖 الوكلاء النشطة", stats.get("totalAgents", 0))
-        st.sidebar.metric("🔧 حالة النظام", "صحي" if stats.get("systemHealth") == "healthy" else "غير صحي")
-    else:
-        st.sidebar.warning("لا يمكن جلب الإحصائيات")
-except:
+# آخر لقطة من مزود الإحصائيات الخلفي، دون أي انتظار للشبكة أثناء إعادة التشغيل
+stats_snapshot = get_stats_provider().snapshot()
+stats = stats_snapshot["stats"]
+if stats:
+    st.sidebar.metric("🤖 الوكلاء النشطة", stats["totalAgents"])
+    st.sidebar.metric("🔧 حالة النظام", "صحي" if stats["systemHealth"] == "healthy" else "غير صحي")
+    
+    col_tasks, col_skills = st.sidebar.columns(2)
+    col_tasks.metric("📋 المهام المنفذة", stats["totalTasksProcessed"])
+    col_skills.metric("🧩 المهارات", stats["availableSkills"])
+    
+    with st.sidebar.expander("📈 تفاصيل إضافية"):
+        st.write(f"⚙️ الوكلاء المشغولة: {stats['activeAgents']}")
+        if stats["averageSuccessRate"] is not None:
+            st.write(f"✅ متوسط نسبة النجاح: {stats['averageSuccessRate']:.0%}")
+        st.write(f"💬 محادثات AutoGen النشطة: {stats['activeChats']}")
+        st.write(f"🔀 سير عمل SuperAgent: {stats['totalWorkflows']}")
+        st.write(f"👥 فرق CrewAI: {stats['totalCrews']} ({stats['crewExecutions']} تنفيذ)")
+        for framework, count in stats["agentsByFramework"].items():
+            st.write(f"- {framework}: {count}")
+    
+    st.sidebar.caption(f"🕒 آخر تحديث قبل {stats_snapshot['age']:.0f} ثانية")
+    if stats_snapshot["error"]:
+        st.sidebar.warning("تعذر التحديث الأخير، يتم عرض آخر بيانات متاحة")
+elif stats_snapshot["error"]:
     st.sidebar.warning("النظام غير متصل")
+else:
+    st.sidebar.info("جاري جلب الإحصائيات...")
+
+st.sidebar.caption(f"🔌 الواجهة الخلفية: {client.name}")
+
+cache = get_default_cache()
+if cache is not None:
+    cache_stats = cache.stats()
+    st.sidebar.caption(
+        f"🗄️ الذاكرة المؤقتة: {cache_stats['hits'] + cache_stats['disk_hits']} إصابة / "
+        f"{cache_stats['misses']} إخفاق ({cache_stats['hit_rate']:.0%})"
+    )
+
+# لوحة التشخيص: زمن الطلبات والأخطاء والرموز لضبط التزامن وأحجام الذاكرة المؤقتة
+with st.sidebar.expander("📈 التشخيص"):
+    metric_rows = REGISTRY.summary()
+    if metric_rows:
+        st.dataframe(metric_rows, use_container_width=True, hide_index=True)
+    else:
+        st.caption("لا توجد قياسات بعد")
+    if metrics_port:
+        st.caption(f"📡 المقاييس بصيغة Prometheus على http://localhost:{metrics_port}/metrics")
+    
+    # زمن أول عرض للجلسة والوحدات التي حُملت عند الطلب
+    if "first_render_ms" not in st.session_state:
+        st.session_state.first_render_ms = (time.perf_counter() - run_started) * 1000
+    st.caption(
+        f"⏱️ أول عرض للجلسة: {st.session_state.first_render_ms:.0f} ms — "
+        f"الذاكرة المقيمة: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB"
+    )
+    lazy_rows = [{"module": name, "import_ms": seconds * 1000} for name, seconds in import_timings().items()]
+    if lazy_rows:
+        st.dataframe(lazy_rows, use_container_width=True, hide_index=True)
+    
+    # حالة طابور المهام المشترك بين كل الجلسات
+    job_stats = job_queue.stats()
+    st.caption(
+        f"🧵 المهام: {job_stats.get('running', 0)} قيد التنفيذ / {job_stats.get('queued', 0)} في الانتظار "
+        f"({job_queue.workers} عمال)"
+    )
 
 # معلومات إضافية
 st.sidebar.markdown("---")
@@ -334,3 +758,8 @@ st.sidebar.info(
     - استخدم ميزة تصحيح الأخطاء لتحسين الكود
     """
 )
+
+# متابعة المهام الخلفية: إعادة التشغيل دورياً حتى تنتهي كل مهام هذه الجلسة
+if active_jobs:
+    time.sleep(0.5)
+    st.rerun()
@@ -0,0 +1,345 @@
+# metrics.py - مقاييس الأداء (عدادات ومدرجات) بصيغة Prometheus مع نقطة /metrics محلية وتتبع اختياري
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+DEFAULT_METRICS_HOST = os.getenv('BLACKBOX_METRICS_HOST', '127.0.0.1')
+# 0 يعطل نقطة /metrics
+DEFAULT_METRICS_PORT = int(os.getenv('BLACKBOX_METRICS_PORT', '9464'))
+TRACING_ENABLED = os.getenv('BLACKBOX_TRACING', '0') == '1'
+
+# حدود المدرجات بالثواني: من استجابات الذاكرة المحلية حتى ردود النموذج الطويلة
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(labelnames, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"تسميات غير صحيحة للمقياس {self.name}: {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """عداد متزايد لكل مجموعة تسميات"""
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def value(self, **labels):
+        with self._lock:
+            return self._series.get(self._key(labels), 0)
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._series.items())
+
+    def render(self):
+        lines = self.header()
+        for key, value in self.samples():
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram(_Metric):
+    """مدرج تراكمي بحدود ثابتة مع المجموع والعدد، ويقدّر المئينات من الحدود"""
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = {"buckets": [0] * (len(self.buckets) + 1), "sum": 0.0, "count": 0}
+                self._series[key] = series
+            series["buckets"][bisect_left(self.buckets, value)] += 1
+            series["sum"] += value
+            series["count"] += 1
+
+    def samples(self):
+        with self._lock:
+            return sorted(
+                (key, {"buckets": list(series["buckets"]), "sum": series["sum"], "count": series["count"]})
+                for key, series in self._series.items()
+            )
+
+    def _quantile(self, q, series):
+        """تقدير المئين بالاستيفاء الخطي داخل الحد (كما في histogram_quantile)"""
+        if not series["count"]:
+            return None
+        rank = q * series["count"]
+        cumulative = 0
+        lower = 0.0
+        for upper, count in zip(self.buckets, series["buckets"]):
+            if count and cumulative + count >= rank:
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+            lower = upper
+        return self.buckets[-1]
+
+    def quantile(self, q, **labels):
+        for key, series in self.samples():
+            if key == self._key(labels):
+                return self._quantile(q, series)
+        return None
+
+    def render(self):
+        lines = self.header()
+        for key, series in self.samples():
+            cumulative = 0
+            for upper, count in zip(self.buckets, series["buckets"]):
+                cumulative += count
+                labels = _format_labels(self.labelnames, key, [("le", upper)])
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key, [("le", "+Inf")])
+            lines.append(f"{self.name}_bucket{labels} {series['count']}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {series['sum']}")
+            lines.append(f"{self.name}_count{labels} {series['count']}")
+        return lines
+
+
+class Registry:
+    """سجل المقاييس الذي تُصدّره نقطة /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """النص بصيغة Prometheus exposition"""
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def summary(self):
+        """صفوف مختصرة للعرض في لوحة التشخيص: العدد والمتوسط وp50/p95 أو قيمة العداد"""
+        with self._lock:
+            metrics = list(self._metrics)
+        rows = []
+        for metric in metrics:
+            for key, sample in metric.samples():
+                row = {
+                    "metric": metric.name,
+                    "labels": ", ".join(f"{name}={value}" for name, value in zip(metric.labelnames, key))
+                }
+                if metric.kind == "histogram":
+                    row.update({
+                        "count": sample["count"],
+                        "mean": sample["sum"] / sample["count"] if sample["count"] else None,
+                        "p50": metric._quantile(0.5, sample),
+                        "p95": metric._quantile(0.95, sample)
+                    })
+                else:
+                    row["count"] = sample
+                rows.append(row)
+        return rows
+
+
+REGISTRY = Registry()
+
+# طلبات Blackbox (client: sync أو async أو proxy، phase: ttfb أو total)
+REQUEST_SECONDS = REGISTRY.histogram(
+    "blackbox_request_seconds", "Blackbox request latency by phase",
+    ("client", "operation", "phase")
+)
+REQUESTS = REGISTRY.counter(
+    "blackbox_requests_total", "Blackbox requests by HTTP status, error class or cache",
+    ("client", "operation", "status")
+)
+RESPONSE_BYTES = REGISTRY.counter(
+    "blackbox_response_bytes_total", "Response body bytes received",
+    ("client", "operation")
+)
+# kind: sent للبايتات المرسلة فعلاً، saved لما وفره الضغط
+REQUEST_BYTES = REGISTRY.counter(
+    "blackbox_request_bytes_total", "Request body bytes sent, and bytes saved by gzip",
+    ("encoding", "kind")
+)
+TOKENS = REGISTRY.counter(
+    "blackbox_tokens_total", "Token usage reported by the completions API",
+    ("operation", "kind")
+)
+RETRIES = REGISTRY.counter(
+    "blackbox_retries_total", "Retried attempts by status code or exception class",
+    ("reason",)
+)
+BREAKER_REJECTIONS = REGISTRY.counter(
+    "blackbox_breaker_rejections_total", "Requests rejected while the circuit breaker was open"
+)
+COALESCED = REGISTRY.counter(
+    "blackbox_coalesced_total", "Requests served by joining an identical in-flight request",
+    ("kind",)
+)
+ENDPOINT_SECONDS = REGISTRY.histogram(
+    "blackbox_endpoint_seconds", "Request latency per pooled endpoint (BLACKBOX_ENDPOINTS)",
+    ("endpoint",)
+)
+HEDGES = REGISTRY.counter(
+    "blackbox_hedged_requests_total", "Hedged duplicate requests fired, and how often the duplicate won",
+    ("outcome",)
+)
+CONNECT_SECONDS = REGISTRY.histogram(
+    "http_connect_seconds", "New TCP (and TLS) connection setup time",
+    ("host",)
+)
+
+# التصفح
+PAGE_FETCH_SECONDS = REGISTRY.histogram(
+    "page_fetch_seconds", "Page fetch time by serving tier",
+    ("tier",)
+)
+PAGE_FETCH_ERRORS = REGISTRY.counter(
+    "page_fetch_errors_total", "Page fetches that failed on every tier",
+    ("error",)
+)
+BROWSER_CHECKOUT_SECONDS = REGISTRY.histogram(
+    "browser_checkout_seconds", "Time waiting for (or launching) a pooled browser"
+)
+BROWSER_LOAD_SECONDS = REGISTRY.histogram(
+    "browser_load_seconds", "Browser page load time"
+)
+
+# تشغيل الكود (outcome: ok أو error أو timeout أو cached)
+CODE_RUN_SECONDS = REGISTRY.histogram(
+    "code_run_seconds", "Generated code run time by outcome",
+    ("outcome",)
+)
+
+
+def observe_response(client, operation, status, started, ttfb=None, body_bytes=None):
+    """تسجيل طلب اكتمل بحالة HTTP مع زمن أول بايت والزمن الكلي منذ started (perf_counter)"""
+    REQUESTS.inc(client=client, operation=operation, status=status)
+    REQUEST_SECONDS.observe(time.perf_counter() - started, client=client, operation=operation, phase="total")
+    if ttfb is not None:
+        REQUEST_SECONDS.observe(ttfb, client=client, operation=operation, phase="ttfb")
+    if body_bytes:
+        RESPONSE_BYTES.inc(body_bytes, client=client, operation=operation)
+
+
+def observe_error(client, operation, error):
+    """تسجيل طلب فشل؛ أخطاء HTTP تُسجل برمز الحالة وغيرها باسم صنف الاستثناء"""
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or type(error).__name__
+    REQUESTS.inc(client=client, operation=operation, status=status)
+
+
+def observe_cache_hit(client, operation):
+    REQUESTS.inc(client=client, operation=operation, status="cache")
+
+
+def observe_usage(operation, usage):
+    """تسجيل usage من رد chat/completions (prompt_tokens وcompletion_tokens)"""
+    if not isinstance(usage, dict):
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        if usage.get(kind):
+            TOKENS.inc(usage[kind], operation=operation, kind=kind.split("_")[0])
+
+
+_tracer = trace.get_tracer("blackbox") if trace is not None and TRACING_ENABLED else None
+
+
+def span(name, **attributes):
+    """مقطع تتبع OpenTelemetry عند تفعيل BLACKBOX_TRACING=1 وتثبيت opentelemetry، وإلا فلا شيء"""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, attributes=attributes)
+
+
+@contextmanager
+def timed(histogram, **labels):
+    """قياس زمن الكتلة في histogram"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.observe(time.perf_counter() - started, **labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+_server = None
+_server_lock = threading.Lock()
+
+
+def start_metrics_server(port=None, host=None):
+    """تشغيل نقطة /metrics في خيط خلفي مرة واحدة لكل عملية؛ يُرجع المنفذ أو None"""
+    global _server
+    port = DEFAULT_METRICS_PORT if port is None else port
+    with _server_lock:
+        if _server is None and port:
+            try:
+                _server = ThreadingHTTPServer((host or DEFAULT_METRICS_HOST, port), _MetricsHandler)
+            except OSError as e:
+                print(f"⚠️ تحذير: تعذر تشغيل نقطة /metrics على المنفذ {port}: {str(e)}")
+                return None
+            _server.daemon_threads = True
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server.server_address[1] if _server else None
@@ -0,0 +1,177 @@
+# page_fetcher.py - جلب الصفحات على مستويات: HTTP مباشر أولاً ثم المتصفح عند الحاجة فقط
+import codecs
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+from http_transport import get_session, get_timeout
+from metrics import PAGE_FETCH_ERRORS, PAGE_FETCH_SECONDS, span
+
+DEFAULT_MAX_BYTES = int(os.getenv('FETCH_MAX_BYTES', str(5 * 1024 * 1024)))
+DEFAULT_MIN_TEXT_CHARS = int(os.getenv('FETCH_MIN_TEXT_CHARS', '200'))
+DEFAULT_VALIDATOR_ENTRIES = int(os.getenv('FETCH_VALIDATOR_ENTRIES', '512'))
+# مجموع أحرف HTML المحفوظة لردود 304؛ بدونه قد يبلغ 512 صفحة × FETCH_MAX_BYTES عدة غيغابايتات
+DEFAULT_VALIDATOR_MAX_CHARS = int(os.getenv('FETCH_VALIDATOR_MAX_CHARS', str(32 * 1024 * 1024)))
+
+# مستويات الجلب التي تُذكر في النتيجة
+TIER_HTTP = "http"
+TIER_HTTP_NOT_MODIFIED = "http-304"
+TIER_BROWSER = "browser"
+
+USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0 Safari/537.36"
+
+_SCRIPT_OR_STYLE = re.compile(r"<(script|style|noscript|template)\b.*?</\1\s*>", re.I | re.S)
+_TAG = re.compile(r"<[^>]+>")
+_EMPTY_MOUNT_POINT = re.compile(
+    r"<div[^>]+id=[\"'](root|app|__next|__nuxt|svelte)[\"'][^>]*>\s*</div>", re.I
+)
+_NOSCRIPT_WARNING = re.compile(r"<noscript[^>]*>[^<]*(enable|requires?)\s+javascript", re.I)
+
+
+def looks_js_rendered(html, min_text_chars=None):
+    """هل تبدو الصفحة هيكلاً فارغاً يُملأ بـ JavaScript؟"""
+    if _EMPTY_MOUNT_POINT.search(html) or _NOSCRIPT_WARNING.search(html):
+        return True
+    visible = _TAG.sub(" ", _SCRIPT_OR_STYLE.sub(" ", html))
+    return len(" ".join(visible.split())) < (min_text_chars or DEFAULT_MIN_TEXT_CHARS)
+
+
+def _known_encoding(encoding):
+    """الترميز إن عرفته بايثون، وإلا utf-8 (charset خاطئ مثل utf8mb4 يرفع LookupError عند الفك)"""
+    if encoding:
+        try:
+            return codecs.lookup(encoding).name
+        except LookupError:
+            pass
+    return "utf-8"
+
+
+def _fetch_with_browser(url):
+    # نستورد مجمع المتصفحات عند الحاجة فقط حتى لا يُحمّل Selenium لصفحات HTTP العادية
+    from browser_pool import fetch_page_source
+    return fetch_page_source(url)
+
+
+class PageFetcher:
+    """جلب صفحات بطلب HTTP مجمع مع طلبات شرطية (ETag/Last-Modified) والرجوع للمتصفح للصفحات الديناميكية
+
+    كل نتيجة تحتوي على tier يوضح المستوى الذي خدم الصفحة: http أو http-304 أو browser.
+    """
+
+    def __init__(self, session=None, timeout=None, max_bytes=None, browser_fetch=None):
+        self.session = session or get_session()
+        self.timeout = timeout or get_timeout(read_timeout=15)
+        self.max_bytes = max_bytes or DEFAULT_MAX_BYTES
+        self.browser_fetch = browser_fetch or _fetch_with_browser
+        self._validators = OrderedDict()
+        self._validator_chars = 0
+        self._lock = threading.Lock()
+        self.tier_counts = {TIER_HTTP: 0, TIER_HTTP_NOT_MODIFIED: 0, TIER_BROWSER: 0}
+
+    def _conditional_headers(self, url):
+        headers = {"User-Agent": USER_AGENT, "Accept": "text/html,application/xhtml+xml"}
+        with self._lock:
+            entry = self._validators.get(url)
+        if entry:
+            if entry["etag"]:
+                headers["If-None-Match"] = entry["etag"]
+            if entry["last_modified"]:
+                headers["If-Modified-Since"] = entry["last_modified"]
+        return headers, entry
+
+    def _remember(self, url, response, html):
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        with self._lock:
+            previous = self._validators.pop(url, None)
+            if previous is not None:
+                self._validator_chars -= len(previous["html"])
+            # صفحة أكبر من ربع الميزانية كانت ستطرد معظم المدخلات الأخرى، فنجلبها كاملة في المرة القادمة
+            if (not etag and not last_modified) or len(html) > DEFAULT_VALIDATOR_MAX_CHARS // 4:
+                return
+            self._validators[url] = {"etag": etag, "last_modified": last_modified, "html": html}
+            self._validator_chars += len(html)
+            while (
+                len(self._validators) > DEFAULT_VALIDATOR_ENTRIES
+                or self._validator_chars > DEFAULT_VALIDATOR_MAX_CHARS
+            ):
+                _, evicted = self._validators.popitem(last=False)
+                self._validator_chars -= len(evicted["html"])
+
+    def _read_body(self, response):
+        """قراءة الجسم حتى max_bytes فقط لتجنب تحميل صفحات ضخمة كاملة"""
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=65536):
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.max_bytes:
+                break
+        # requests يفترض ISO-8859-1 عند غياب charset، والأرجح لصفحات اليوم أنها UTF-8
+        content_type = response.headers.get("Content-Type", "")
+        encoding = response.encoding if "charset" in content_type.lower() else "utf-8"
+        return b"".join(chunks)[:self.max_bytes].decode(_known_encoding(encoding), errors="replace")
+
+    def _fetch_http(self, url):
+        """المستوى الأول: إرجاع (html, tier) أو None إذا لزم المتصفح"""
+        headers, entry = self._conditional_headers(url)
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304 and entry:
+                return entry["html"], TIER_HTTP_NOT_MODIFIED
+            if response.status_code != 200:
+                return None
+            if "html" not in response.headers.get("Content-Type", "text/html"):
+                return None
+            html = self._read_body(response)
+
+        if looks_js_rendered(html):
+            return None
+        self._remember(url, response, html)
+        return html, TIER_HTTP
+
+    def fetch(self, url, force_browser=False):
+        """جلب الصفحة وإرجاع {"url", "html", "tier", "elapsed"}"""
+        started = time.perf_counter()
+        fetched = None
+        with span("page_fetch", url=url):
+            if not force_browser:
+                try:
+                    fetched = self._fetch_http(url)
+                except requests.exceptions.RequestException:
+                    fetched = None
+
+            if fetched is None:
+                try:
+                    fetched = (self.browser_fetch(url), TIER_BROWSER)
+                except Exception as e:
+                    PAGE_FETCH_ERRORS.inc(error=type(e).__name__)
+                    raise
+
+        html, tier = fetched
+        elapsed = time.perf_counter() - started
+        PAGE_FETCH_SECONDS.observe(elapsed, tier=tier)
+        with self._lock:
+            self.tier_counts[tier] += 1
+        return {
+            "url": url,
+            "html": html,
+            "tier": tier,
+            "elapsed": elapsed
+        }
+
+
+_fetcher = None
+_fetcher_lock = threading.Lock()
+
+
+def get_page_fetcher():
+    """الجالب المشترك على مستوى العملية (يحتفظ بمحددات ETag/Last-Modified بين الجلسات)"""
+    global _fetcher
+    with _fetcher_lock:
+        if _fetcher is None:
+            _fetcher = PageFetcher()
+        return _fetcher
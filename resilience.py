@@ -0,0 +1,276 @@
+# resilience.py - إعادة المحاولة مع تراجع أسي، محدد معدل، وقاطع دائرة مشتركة على مستوى العملية
+import asyncio
+import email.utils
+import os
+import random
+import threading
+import time
+
+import requests
+
+from metrics import BREAKER_REJECTIONS, RETRIES
+
+DEFAULT_MAX_RETRIES = int(os.getenv('BLACKBOX_MAX_RETRIES', '3'))
+DEFAULT_RETRY_BASE_DELAY = float(os.getenv('BLACKBOX_RETRY_BASE_DELAY', '0.5'))
+DEFAULT_RETRY_MAX_DELAY = float(os.getenv('BLACKBOX_RETRY_MAX_DELAY', '30'))
+DEFAULT_RATE_LIMIT = float(os.getenv('BLACKBOX_RATE_LIMIT', '0'))
+DEFAULT_RATE_BURST = float(os.getenv('BLACKBOX_RATE_BURST', '0'))
+DEFAULT_BREAKER_THRESHOLD = int(os.getenv('BLACKBOX_BREAKER_THRESHOLD', '5'))
+DEFAULT_BREAKER_RESET = float(os.getenv('BLACKBOX_BREAKER_RESET', '30'))
+
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """الخدمة متعطلة حالياً، فنرفض الطلب فوراً بدلاً من انتظار المهلة كاملة"""
+
+
+def parse_retry_after(value):
+    """تحويل ترويسة Retry-After (ثوانٍ أو تاريخ HTTP) إلى عدد ثوانٍ، أو None"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryPolicy:
+    """تراجع أسي مع تشويش كامل (full jitter) يحترم Retry-After"""
+
+    def __init__(self, max_retries=None, base_delay=None, max_delay=None, retry_statuses=RETRY_STATUSES):
+        self.max_retries = DEFAULT_MAX_RETRIES if max_retries is None else max_retries
+        self.base_delay = base_delay or DEFAULT_RETRY_BASE_DELAY
+        self.max_delay = max_delay or DEFAULT_RETRY_MAX_DELAY
+        self.retry_statuses = retry_statuses
+
+    def delay(self, attempt, retry_after=None):
+        """مدة الانتظار قبل المحاولة رقم attempt + 1"""
+        backoff = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if retry_after is not None:
+            backoff = max(backoff, min(retry_after, self.max_delay))
+        return backoff
+
+
+class TokenBucket:
+    """محدد معدل بخوارزمية دلو الرموز، آمن للخيوط
+
+    rate: عدد الطلبات في الثانية (0 = بلا حد)، capacity: أقصى دفعة مسموحة.
+    pause() يوقف جميع المستخدمين مؤقتاً بعد رد 429 حتى لا تتزاحم المحاولات.
+    """
+
+    def __init__(self, rate=None, capacity=None):
+        self.rate = DEFAULT_RATE_LIMIT if rate is None else rate
+        self.capacity = capacity or DEFAULT_RATE_BURST or max(self.rate, 1.0)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """حجز رمز وإرجاع عدد الثواني التي يجب انتظارها قبل الإرسال"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(0.0, self._paused_until - now)
+            if self.rate <= 0:
+                return wait
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            if self._tokens < 0:
+                wait = max(wait, -self._tokens / self.rate)
+            return wait
+
+    def acquire(self):
+        """الانتظار (بحجب الخيط) حتى يتوفر رمز"""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """الانتظار دون حجب حلقة الأحداث حتى يتوفر رمز"""
+        wait = self.reserve()
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds):
+        """إيقاف الإرسال لجميع المستخدمين لمدة seconds"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class CircuitBreaker:
+    """قاطع دائرة: closed ← open بعد failure_threshold إخفاقات متتالية، ثم half-open بعد reset_timeout"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold=None, reset_timeout=None):
+        self.failure_threshold = failure_threshold or DEFAULT_BREAKER_THRESHOLD
+        self.reset_timeout = reset_timeout or DEFAULT_BREAKER_RESET
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """هل يُسمح بإرسال طلب الآن؟ في حالة half-open يُسمح بطلب اختباري واحد فقط"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self._opened_at < self.reset_timeout:
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self):
+        """تحرير الطلب الاختباري دون الحكم على الخدمة (استثناء من المستدعي أو إلغاء)"""
+        with self._lock:
+            self._probe_in_flight = False
+
+
+_rate_limiter = None
+_rate_limiters = {}
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_rate_limiter(name=None):
+    """محدد المعدل المشترك بين جميع العملاء في العملية، أو محدد مستقل لنقطة/مفتاح name (لكل مفتاح حصته)"""
+    global _rate_limiter
+    with _registry_lock:
+        if name is not None:
+            limiter = _rate_limiters.get(name)
+            if limiter is None:
+                limiter = TokenBucket()
+                _rate_limiters[name] = limiter
+            return limiter
+        if _rate_limiter is None:
+            _rate_limiter = TokenBucket()
+        return _rate_limiter
+
+
+def get_circuit_breaker(name):
+    """قاطع الدائرة المشترك لخدمة معينة (عادةً عنوان base_url)"""
+    with _registry_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker()
+            _breakers[name] = breaker
+        return breaker
+
+
+def _is_failure(status_code):
+    return status_code >= 500
+
+
+def send_with_retries(send, breaker, limiter, policy, retry_exceptions=(requests.ConnectionError, requests.Timeout)):
+    """تنفيذ send() مع قاطع الدائرة ومحدد المعدل وإعادة المحاولة
+
+    يُرجع آخر استجابة (قد تكون خطأ يُترك للمستدعي عبر raise_for_status)،
+    ويرفع CircuitOpenError إذا كانت الدائرة مفتوحة.
+    """
+    for attempt in range(policy.max_retries + 1):
+        if not breaker.allow():
+            BREAKER_REJECTIONS.inc()
+            raise CircuitOpenError("قاطع الدائرة مفتوح: الخدمة متعطلة مؤقتاً")
+        limiter.acquire()
+
+        try:
+            response = send()
+        except retry_exceptions as e:
+            breaker.record_failure()
+            if attempt == policy.max_retries:
+                raise
+            RETRIES.inc(reason=type(e).__name__)
+            time.sleep(policy.delay(attempt))
+            continue
+        except BaseException:
+            # استثناء غير قابل لإعادة المحاولة (خطأ برمجي، إلغاء، KeyboardInterrupt):
+            # لا نحكم به على الخدمة لكن يجب تحرير الطلب الاختباري وإلا بقيت الدائرة مغلقة أمام الجميع
+            breaker.release()
+            raise
+
+        if response.status_code not in policy.retry_statuses:
+            breaker.record_success()
+            return response
+
+        if _is_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if attempt == policy.max_retries:
+            return response
+
+        RETRIES.inc(reason=response.status_code)
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 429 and retry_after:
+            limiter.pause(retry_after)
+        response.close()
+        time.sleep(policy.delay(attempt, retry_after))
+
+
+async def send_with_retries_async(send, breaker, limiter, policy, retry_exceptions):
+    """نسخة غير متزامنة من send_with_retries؛ send دالة تُرجع coroutine"""
+    for attempt in range(policy.max_retries + 1):
+        if not breaker.allow():
+            BREAKER_REJECTIONS.inc()
+            raise CircuitOpenError("قاطع الدائرة مفتوح: الخدمة متعطلة مؤقتاً")
+        await limiter.acquire_async()
+
+        try:
+            response = await send()
+        except retry_exceptions as e:
+            breaker.record_failure()
+            if attempt == policy.max_retries:
+                raise
+            RETRIES.inc(reason=type(e).__name__)
+            await asyncio.sleep(policy.delay(attempt))
+            continue
+        except BaseException:
+            # استثناء غير قابل لإعادة المحاولة (خطأ برمجي، إلغاء، KeyboardInterrupt):
+            # لا نحكم به على الخدمة لكن يجب تحرير الطلب الاختباري وإلا بقيت الدائرة مغلقة أمام الجميع
+            breaker.release()
+            raise
+
+        if response.status_code not in policy.retry_statuses:
+            breaker.record_success()
+            return response
+
+        if _is_failure(response.status_code):
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        if attempt == policy.max_retries:
+            return response
+
+        RETRIES.inc(reason=response.status_code)
+        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+        if response.status_code == 429 and retry_after:
+            limiter.pause(retry_after)
+        await asyncio.sleep(policy.delay(attempt, retry_after))
@@ -0,0 +1,166 @@
+# response_cache.py - تخزين مؤقت للردود بمفتاح مبني على محتوى الطلب
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from serialization import dumps
+
+# الحقول التي تحدد الرد في طلبات chat/completions
+KEY_FIELDS = ("model", "messages", "temperature", "max_tokens")
+
+DEFAULT_MAX_ENTRIES = int(os.getenv('BLACKBOX_CACHE_SIZE', '1024'))
+DEFAULT_TTL = float(os.getenv('BLACKBOX_CACHE_TTL', '3600'))
+# العملاء يرسلون temperature=0.7 افتراضياً، فالعتبة أقل منها حتى لا تُخزن ردود التوليد والمحادثة العشوائية
+DEFAULT_MAX_TEMPERATURE = float(os.getenv('BLACKBOX_CACHE_MAX_TEMPERATURE', '0.3'))
+# عمليات تحليل مدخل محدد (وخادم Node يرسلها بـ 0.1) وطلب test_connection الثابت:
+# تكرار نفس الرد مقبول فيها مهما كانت temperature
+DEFAULT_CACHE_OPERATIONS = frozenset(filter(None, os.getenv(
+    'BLACKBOX_CACHE_OPERATIONS', 'explain_code,debug_code,optimize_code,convert_code,test_connection'
+).split(',')))
+
+
+class ResponseCache:
+    """ذاكرة LRU في الذاكرة مع مدة صلاحية، وطبقة اختيارية على القرص (SQLite)
+
+    طبقة القرص مشتركة بين جلسات Streamlit والعمليات المختلفة التي تستخدم نفس الملف.
+    الطلبات ذات temperature أعلى من max_temperature (أو بلا temperature) لا تُخزن لأن ردودها غير حتمية،
+    إلا عمليات operations.
+    """
+
+    def __init__(self, max_entries=None, ttl=None, disk_path=None, max_temperature=None, operations=None):
+        self.max_entries = max_entries or DEFAULT_MAX_ENTRIES
+        self.ttl = ttl or DEFAULT_TTL
+        self.max_temperature = DEFAULT_MAX_TEMPERATURE if max_temperature is None else max_temperature
+        self.operations = DEFAULT_CACHE_OPERATIONS if operations is None else frozenset(operations)
+        self.disk_path = disk_path
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+        if self.disk_path:
+            self._connection().execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(payload):
+        """بصمة SHA-256 للنموذج والرسائل وtemperature وmax_tokens"""
+        if "messages" in payload:
+            material = {field: payload.get(field) for field in KEY_FIELDS}
+        else:
+            material = {k: v for k, v in payload.items() if k != "stream"}
+        # نفس البايتات بالمرمّزين (orjson وjson) فالمفاتيح المحفوظة على القرص تبقى صالحة
+        return hashlib.sha256(dumps(material, sort_keys=True)).hexdigest()
+
+    def should_cache(self, payload, operation=None):
+        """هل يمكن تخزين رد هذا الطلب؟ (حسب العملية، وإلا حسب temperature)"""
+        if operation in self.operations:
+            return True
+        # طلبات وكيل Node بلا temperature: الخادم يختارها (0.7 للمحادثة)
+        temperature = payload.get("temperature")
+        if temperature is not None and temperature <= self.max_temperature:
+            return True
+        with self._lock:
+            self.bypassed += 1
+        return False
+
+    def _connection(self):
+        # اتصال SQLite لكل خيط لأن الاتصال الواحد لا يُشارك بين الخيوط بأمان
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.disk_path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        """إرجاع القيمة المخزنة أو None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        if self.disk_path:
+            row = self._connection().execute(
+                "SELECT value, expires_at FROM responses WHERE key = ? AND expires_at > ?",
+                (key, now)
+            ).fetchone()
+            if row is not None:
+                value = json.loads(row[0])
+                self._remember(key, value, row[1])
+                with self._lock:
+                    self.disk_hits += 1
+                return value
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key, value):
+        """تخزين القيمة في الذاكرة وعلى القرص إن كان مفعلاً"""
+        expires_at = time.time() + self.ttl
+        self._remember(key, value, expires_at)
+        if self.disk_path:
+            connection = self._connection()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), expires_at)
+            )
+            connection.execute("DELETE FROM responses WHERE expires_at <= ?", (time.time(),))
+
+    def _remember(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """مسح جميع المدخلات من الذاكرة والقرص"""
+        with self._lock:
+            self._entries.clear()
+        if self.disk_path:
+            self._connection().execute("DELETE FROM responses")
+
+    def stats(self):
+        """عدادات الإصابة والإخفاق الحالية"""
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0
+            }
+
+
+_default_cache = None
+_default_cache_lock = threading.Lock()
+
+
+def get_default_cache():
+    """الذاكرة المشتركة على مستوى العملية، أو None إن لم تُفعل عبر BLACKBOX_CACHE=1"""
+    global _default_cache
+    if os.getenv('BLACKBOX_CACHE', '0') != '1':
+        return None
+    with _default_cache_lock:
+        if _default_cache is None:
+            _default_cache = ResponseCache(disk_path=os.getenv('BLACKBOX_CACHE_PATH') or None)
+        return _default_cache
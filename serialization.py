@@ -0,0 +1,155 @@
+# serialization.py - ترميز JSON سريع بـ orjson إن توفرت (وإلا مسار json= المعتاد في requests) وضغط أجسام الطلبات الكبيرة
+import json
+import os
+import threading
+import zlib
+from urllib.parse import urlsplit
+
+from requests.exceptions import InvalidJSONError
+
+from metrics import REQUEST_BYTES
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# auto: orjson إن كانت مثبتة، json: المكتبة القياسية دائماً
+DEFAULT_CODEC = os.getenv('SERIALIZATION_CODEC', 'auto')
+# الأجسام الأصغر من العتبة لا يستحق ضغطها كلفة المعالج
+DEFAULT_GZIP_MIN_BYTES = int(os.getenv('SERIALIZATION_GZIP_MIN_BYTES', '8192'))
+# المستوى 1 يوفر ~75% من حجم الكود بنصف كلفة المستوى الافتراضي لـ zlib تقريباً (انظر benchmark.py)
+DEFAULT_GZIP_LEVEL = int(os.getenv('SERIALIZATION_GZIP_LEVEL', '1'))
+# 1 أو 0 أو auto (الضغط لغير العناوين المحلية فقط، فالضغط عبر loopback كلفة معالج بلا فائدة)
+# وكيل Node يفك الأجسام المضغوطة دائماً، أما قبول واجهة Blackbox لها فغير مضمون فهو معطل افتراضياً
+PROXY_GZIP = os.getenv('PROXY_GZIP_REQUESTS', 'auto')
+BLACKBOX_GZIP = os.getenv('BLACKBOX_GZIP_REQUESTS', '0')
+
+CODECS = ("orjson", "json")
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "0.0.0.0", "::1")
+
+_ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS if orjson is not None else 0
+
+
+def codec_name(codec=None):
+    """المرمّز الفعلي: orjson أو json"""
+    codec = codec or DEFAULT_CODEC
+    if codec == "auto":
+        return "orjson" if orjson is not None else "json"
+    if codec not in CODECS:
+        raise ValueError(f"مرمّز غير معروف: {codec}. المتاحة: auto, {', '.join(CODECS)}")
+    if codec == "orjson" and orjson is None:
+        raise ValueError("orjson غير مثبتة")
+    return codec
+
+
+def dumps(value, sort_keys=False, codec=None):
+    """ترميز مضغوط إلى bytes (UTF-8 دون هروب الأحرف غير اللاتينية ودون مسافات)"""
+    if codec_name(codec) == "orjson":
+        return orjson.dumps(value, option=_ORJSON_OPTIONS | (orjson.OPT_SORT_KEYS if sort_keys else 0))
+    return json.dumps(value, sort_keys=sort_keys, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def loads(data, codec=None):
+    """فك JSON من bytes أو str"""
+    if codec_name(codec) == "orjson":
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def decode_response(data, codec=None):
+    """فك جسم رد أو جزء بث؛ أخطاء الفك تُرفع كـ requests.exceptions.InvalidJSONError
+
+    مثل response.json() في requests، فتبقى ضمن RequestException التي يعالجها العملاء كرد فاشل.
+    """
+    try:
+        return loads(data, codec=codec)
+    except ValueError as e:
+        raise InvalidJSONError(f"رد ليس JSON صالحاً: {e}") from e
+
+
+def native_json(compress=False, codec=None):
+    """هل يُترك ترميز الجسم لمكتبة HTTP (json= في requests وhttpx)؟
+
+    بدون orjson لا يوفر الترميز المسبق شيئاً: json.dumps مع ensure_ascii=False ثم encode أبطأ
+    من مسار json= الافتراضي، فلا نرمّز بأنفسنا إلا للضغط.
+    """
+    return not compress and codec_name(codec) == "json"
+
+
+def encode_body(payload, compress=False, min_bytes=None, level=None, codec=None):
+    """جسم طلب JSON جاهز للإرسال مع ترويساته: (data, headers)
+
+    مع compress يُضغط الجسم بـ gzip إذا تجاوز min_bytes بايت، ويُضاف Content-Encoding: gzip.
+    """
+    data = dumps(payload, codec=codec)
+    headers = {"Content-Type": "application/json"}
+    min_bytes = DEFAULT_GZIP_MIN_BYTES if min_bytes is None else min_bytes
+    if compress and len(data) >= min_bytes:
+        compressed = gzip_bytes(data, level)
+        # الكود المكرر جداً أو الصغير قد لا يصغر
+        if len(compressed) < len(data):
+            REQUEST_BYTES.inc(len(data) - len(compressed), encoding="gzip", kind="saved")
+            data = compressed
+            headers["Content-Encoding"] = "gzip"
+    REQUEST_BYTES.inc(len(data), encoding=headers.get("Content-Encoding", "identity"), kind="sent")
+    return data, headers
+
+
+def gzip_bytes(data, level=None):
+    """ضغط gzip عبر zlib مباشرة (أسرع من وحدة gzip لأنه بلا ترويسة ملف ولا طابع زمني)"""
+    compressor = zlib.compressobj(DEFAULT_GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+_gzip_rejected = set()
+_gzip_rejected_lock = threading.Lock()
+
+
+def compression_enabled(url, setting):
+    """هل يُضغط جسم الطلب إلى url حسب الإعداد (True/False أو "1"/"0"/"auto")؟"""
+    if setting == "auto":
+        return urlsplit(url).hostname not in LOCAL_HOSTS
+    return setting in (True, "1")
+
+
+def gzip_accepted(url):
+    """هل يُرسل لهذا العنوان جسم مضغوط؟ (False بعد أن رد بـ 415 مرة)"""
+    with _gzip_rejected_lock:
+        return url not in _gzip_rejected
+
+
+def reject_gzip(url):
+    with _gzip_rejected_lock:
+        _gzip_rejected.add(url)
+
+
+def post_json(session, url, payload, headers=None, compress=False, **kwargs):
+    """POST بجسم JSON مرمّز مسبقاً ومضغوط عند الإمكان، عبر جلسة requests
+
+    compress كما في compression_enabled. إذا رفض الخادم الجسم المضغوط (415 Unsupported Media Type)
+    يُعاد الطلب دون ضغط ولا يُضغط لهذا العنوان بعدها.
+    """
+    compress = compression_enabled(url, compress) and gzip_accepted(url)
+    if native_json(compress):
+        return session.post(url, json=payload, headers=headers, **kwargs)
+    data, body_headers = encode_body(payload, compress)
+    response = session.post(url, data=data, headers=dict(headers or {}, **body_headers), **kwargs)
+    if response.status_code == 415 and "Content-Encoding" in body_headers:
+        reject_gzip(url)
+        response.close()
+        if native_json():
+            return session.post(url, json=payload, headers=headers, **kwargs)
+        data, body_headers = encode_body(payload)
+        response = session.post(url, data=data, headers=dict(headers or {}, **body_headers), **kwargs)
+    return response
+
+
+def completion_fields(data, codec=None):
+    """(نص الرد، usage) من جسم رد chat/completions
+
+    يُفك الجسم كاملاً مرة واحدة من bytes (بـ orjson إن توفرت) ثم يُرجع الحقلان فقط.
+    """
+    body = decode_response(data, codec=codec)
+    return body["choices"][0]["message"]["content"], body.get("usage")
+
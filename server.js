@@ -1,6 +1,11 @@
 const http = require('http');
 const fs = require('fs');
 const path = require('path');
+const util = require('util');
+const zlib = require('zlib');
+
+const gunzip = util.promisify(zlib.gunzip);
+const inflate = util.promisify(zlib.inflate);
 
 // تحميل خدمات الذكاء الاصطناعي مع معالجة شاملة للأخطاء
 let AIService;
@@ -262,6 +267,34 @@ function validateObject(obj, name) {
   return true;
 }
 
+// قراءة جسم الطلب كنص، مع فك الأجسام المضغوطة (يرسل عملاء بايثون الكود الكبير بـ gzip، انظر serialization.py)
+async function decodeRequestBody(req, chunks) {
+  const raw = Buffer.concat(chunks);
+  const encoding = (req.headers['content-encoding'] || 'identity').trim().toLowerCase();
+  if (encoding === 'identity') {
+    return raw.toString('utf8');
+  }
+  if (encoding === 'gzip' || encoding === 'x-gzip') {
+    return (await gunzip(raw)).toString('utf8');
+  }
+  if (encoding === 'deflate') {
+    return (await inflate(raw)).toString('utf8');
+  }
+  // 415 يخبر العميل أن يعيد الإرسال دون ضغط
+  const error = new Error(`ترميز محتوى غير مدعوم: ${encoding}`);
+  error.statusCode = 415;
+  throw error;
+}
+
+// الخدمات البديلة تُرجع {success: false} عند الفشل: نحوله إلى خطأ 502 بدلاً من تغليفه في رد ناجح
+function providerFailure(result) {
+  if (result && typeof result === 'object' && result.success === false) {
+    const error = new Error(result.error || 'فشل مزود الذكاء الاصطناعي');
+    error.statusCode = 502;
+    throw error;
+  }
+}
+
 try {
   console.log('🔧 بدء تهيئة خدمات الذكاء الاصطناعي...');
 
@@ -776,13 +809,16 @@ const server = http.createServer(async (req, res) => {
           );
         } catch (aiError) {
           console.error('خطأ في خدمة AI:', aiError.message);
-          throw new Error(`فشل في معالجة الطلب: ${aiError.message}`);
+          const requestError = new Error(`فشل في معالجة الطلب: ${aiError.message}`);
+          requestError.statusCode = aiError.statusCode;
+          throw requestError;
         }
 
         // التحقق من صحة الاستجابة
         if (!response) {
           throw new Error('لم يتم الحصول على استجابة من خدمة الذكاء الاصطناعي');
         }
+        providerFailure(response);
 
         res.writeHead(200, { 
           'Content-Type': 'application/json; charset=utf-8',
@@ -807,7 +843,7 @@ const server = http.createServer(async (req, res) => {
         console.error('🔍 التفاصيل:', error.stack || 'لا توجد تفاصيل إضافية');
 
         try {
-          res.writeHead(500, { 
+          res.writeHead(error.statusCode || 500, { 
             'Content-Type': 'application/json; charset=utf-8',
             'Access-Control-Allow-Origin': '*'
           });
@@ -843,19 +879,16 @@ const server = http.createServer(async (req, res) => {
 
   // نقطة نهاية متخصصة لطلبات البرمجة مع Blackbox AI
   if (req.url === '/api/blackbox/code' && req.method === 'POST') {
-    let body = '';
-    req.on('data', chunk => {
-      try {
-        body += chunk.toString();
-      } catch (chunkError) {
-        console.error('خطأ في قراءة بيانات Blackbox:', chunkError.message);
-      }
-    });
+    // تجميع الأجزاء كـ Buffer ثم فكها مرة واحدة حتى لا تنقسم الأحرف متعددة البايتات بين الأجزاء
+    const chunks = [];
+    req.on('data', chunk => chunks.push(chunk));
 
     req.on('end', async () => {
       try {
         console.log('📦 تلقي طلب Blackbox AI API');
 
+        const body = await decodeRequestBody(req, chunks);
+
         if (!body || typeof body !== 'string' || body.trim() === '') {
           throw new Error('لا توجد بيانات صالحة في طلب Blackbox');
         }
@@ -872,7 +905,7 @@ const server = http.createServer(async (req, res) => {
           throw new Error('بيانات Blackbox المحللة غير صالحة');
         }
 
-        const { action, code, prompt, language, from_language, to_language, error_message } = requestData;
+        const { action, code, prompt, language, from_language, to_language, error_message, stream, messages } = requestData;
 
         if (!action) {
           throw new Error('يجب تحديد action لـ Blackbox');
@@ -882,40 +915,79 @@ const server = http.createServer(async (req, res) => {
           throw new Error('خدمة الذكاء الاصطناعي غير متاحة لـ Blackbox');
         }
 
-        let result;
+        let message;
+        let type;
 
         switch (action) {
           case 'generate':
             if (!prompt || typeof prompt !== 'string') throw new Error('المعلمة "prompt" مطلوبة لـ "generate"');
-            result = await aiService.sendRequest('blackbox', `Generate ${language || 'python'} code for: ${prompt}`, { type: 'code_generation' });
+            message = `Generate ${language || 'python'} code for: ${prompt}`;
+            type = 'code_generation';
             break;
           case 'explain':
             if (!code || typeof code !== 'string') throw new Error('المعلمة "code" مطلوبة لـ "explain"');
-            result = await aiService.sendRequest('blackbox', `Explain this code in detail:\n\n\`\`\`\n${code}\n\`\`\``, { type: 'code_explanation' });
+            message = `Explain this code in detail:\n\n\`\`\`\n${code}\n\`\`\``;
+            type = 'code_explanation';
             break;
           case 'debug':
             if (!code || typeof code !== 'string') throw new Error('المعلمة "code" مطلوبة لـ "debug"');
-            result = await aiService.sendRequest('blackbox', `Debug this code and fix any issues:\n\nCode:\n\`\`\`\n${code}\n\`\`\`${error_message ? `\n\nError: ${error_message}` : ''}`, { type: 'code_debugging' });
+            message = `Debug this code and fix any issues:\n\nCode:\n\`\`\`\n${code}\n\`\`\`${error_message ? `\n\nError: ${error_message}` : ''}`;
+            type = 'code_debugging';
             break;
           case 'optimize':
             if (!code || typeof code !== 'string') throw new Error('المعلمة "code" مطلوبة لـ "optimize"');
-            result = await aiService.sendRequest('blackbox', `Optimize this code for better performance:\n\n\`\`\`\n${code}\n\`\`\``, { type: 'code_optimization' });
+            message = `Optimize this code for better performance:\n\n\`\`\`\n${code}\n\`\`\``;
+            type = 'code_optimization';
             break;
           case 'convert':
             if (!code || typeof code !== 'string') throw new Error('المعلمة "code" مطلوبة لـ "convert"');
             if (!from_language || typeof from_language !== 'string') throw new Error('المعلمة "from_language" مطلوبة لـ "convert"');
             if (!to_language || typeof to_language !== 'string') throw new Error('المعلمة "to_language" مطلوبة لـ "convert"');
-            result = await aiService.sendRequest('blackbox', `Convert this ${from_language} code to ${to_language}:\n\n\`\`\`${from_language}\n${code}\n\`\`\``, { type: 'code_conversion' });
+            message = `Convert this ${from_language} code to ${to_language}:\n\n\`\`\`${from_language}\n${code}\n\`\`\``;
+            type = 'code_conversion';
+            break;
+          case 'chat':
+            // محادثة متعددة الأدوار: يُرسل السجل كما هو (انظر conversation.py)
+            if (!Array.isArray(messages) || messages.length === 0) throw new Error('المعلمة "messages" مطلوبة لـ "chat"');
+            if (!messages.every(item => item && typeof item.role === 'string' && typeof item.content === 'string')) {
+              throw new Error('كل رسالة في "messages" تحتاج role وcontent نصيين');
+            }
+            message = messages[messages.length - 1].content;
+            type = 'code_conversation';
             break;
           default:
-            throw new Error(`نوع العملية غير مدعوم في Blackbox. الأنواع المتاحة: generate, explain, debug, optimize, convert`);
+            throw new Error(`نوع العملية غير مدعوم في Blackbox. الأنواع المتاحة: generate, explain, debug, optimize, convert, chat`);
         }
 
+        const requestOptions = action === 'chat' ? { type, messages } : { type };
+
+        // تمرير بث SSE مباشرة من Blackbox إلى العميل عند طلبه
+        if (stream === true && typeof aiService.streamRequest === 'function') {
+          const upstream = await aiService.streamRequest('blackbox', message, requestOptions);
+
+          res.writeHead(200, {
+            'Content-Type': 'text/event-stream; charset=utf-8',
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'Access-Control-Allow-Origin': '*'
+          });
+
+          for await (const chunk of upstream.body) {
+            res.write(chunk);
+          }
+          res.end();
+          console.log('✅ تم بث استجابة Blackbox بنجاح');
+          return;
+        }
+
+        const result = await aiService.sendRequest('blackbox', message, requestOptions);
+        providerFailure(result);
+
         res.writeHead(200, {
           'Content-Type': 'application/json; charset=utf-8',
           'Access-Control-Allow-Origin': '*',
           'Access-Control-Allow-Methods': 'POST, OPTIONS',
-          'Access-Control-Allow-Headers': 'Content-Type'
+          'Access-Control-Allow-Headers': 'Content-Type, Content-Encoding'
         });
 
         const responseData = {
@@ -925,15 +997,22 @@ const server = http.createServer(async (req, res) => {
           timestamp: new Date()
         };
 
-        res.end(JSON.stringify(responseData, null, 2));
+        // JSON مضغوط دون مسافات: الردود تحمل كوداً كبيراً ويُفك في بايثون مباشرة
+        res.end(JSON.stringify(responseData));
         console.log('✅ تم إرسال استجابة Blackbox بنجاح');
 
       } catch (error) {
         console.error('❌ خطأ في Blackbox API:', error.message);
         console.error('🔍 التفاصيل:', error.stack || 'لا توجد تفاصيل إضافية');
 
+        // إذا بدأ البث بالفعل نرسل الخطأ كحدث SSE بدلاً من رأس جديد
+        if (res.headersSent) {
+          res.end(`data: ${JSON.stringify({ error: error.message || 'خطأ غير متوقع في Blackbox' })}\n\n`);
+          return;
+        }
+
         try {
-          res.writeHead(500, {
+          res.writeHead(error.statusCode || 500, {
             'Content-Type': 'application/json; charset=utf-8',
             'Access-Control-Allow-Origin': '*'
           });
@@ -0,0 +1,136 @@
+# single_flight.py - دمج الطلبات المتطابقة المتزامنة في طلب واحد للخادم (single-flight)
+import os
+import threading
+from concurrent.futures import Future
+
+from metrics import COALESCED
+
+SINGLE_FLIGHT_ENABLED = os.getenv('BLACKBOX_SINGLE_FLIGHT', '1') == '1'
+
+
+class _Broadcast:
+    """أجزاء بث مشتركة: خيط واحد يقرأ من المصدر وكل مشترك يقرأ من البداية بالترتيب"""
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.condition = threading.Condition()
+
+    def pump(self, source, on_finish):
+        try:
+            for chunk in source:
+                with self.condition:
+                    self.chunks.append(chunk)
+                    self.condition.notify_all()
+        except BaseException as e:
+            with self.condition:
+                self.error = e
+        finally:
+            on_finish()
+            with self.condition:
+                self.done = True
+                self.condition.notify_all()
+
+    def subscribe(self):
+        index = 0
+        while True:
+            with self.condition:
+                while index >= len(self.chunks) and not self.done:
+                    self.condition.wait()
+                if index < len(self.chunks):
+                    chunk = self.chunks[index]
+                elif self.error is not None:
+                    raise self.error
+                else:
+                    return
+            index += 1
+            yield chunk
+
+
+class SingleFlight:
+    """مشاركة طلب واحد قيد التنفيذ بين كل المستدعين بنفس المفتاح
+
+    على خلاف الذاكرة المؤقتة لا يُحتفظ بالنتيجة بعد اكتمالها؛ الدمج يشمل فقط الطلبات المتزامنة
+    (مثل النقر المزدوج أو عدة مستخدمين يرسلون نفس الطلب في نفس اللحظة).
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def do(self, key, fn):
+        """تنفيذ fn() مرة واحدة لكل المستدعين المتزامنين بنفس key وإرجاع نتيجتها (أو رفع خطأها)"""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = Future()
+                self._calls[key] = future
+                self.leaders += 1
+            else:
+                self.shared += 1
+        if not leader:
+            COALESCED.inc(kind="call")
+            return future.result()
+
+        try:
+            future.set_result(fn())
+        except BaseException as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                del self._calls[key]
+        return future.result()
+
+    def stream(self, key, fn):
+        """بث أجزاء fn() (مولد) لكل المشتركين المتزامنين بنفس key من مصدر واحد
+
+        المشترك المتأخر يستلم الأجزاء السابقة أولاً ثم يتابع البث الحي. يُقرأ المصدر في خيط
+        خلفي حتى نهايته، فلا يتوقف بقية المشتركين إذا توقف أحدهم عن القراءة.
+        """
+        with self._lock:
+            broadcast = self._streams.get(key)
+            leader = broadcast is None
+            if leader:
+                broadcast = _Broadcast()
+                self._streams[key] = broadcast
+                self.leaders += 1
+            else:
+                self.shared += 1
+
+        if leader:
+            def finish():
+                with self._lock:
+                    self._streams.pop(key, None)
+
+            threading.Thread(target=broadcast.pump, args=(fn(), finish), daemon=True).start()
+        else:
+            COALESCED.inc(kind="stream")
+        return broadcast.subscribe()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "in_flight": len(self._calls) + len(self._streams),
+                "leaders": self.leaders,
+                "shared": self.shared
+            }
+
+
+_single_flight = None
+_single_flight_lock = threading.Lock()
+
+
+def get_single_flight():
+    """طبقة الدمج المشتركة على مستوى العملية (كل جلسات Streamlit وكل العملاء)، أو None إن عُطلت"""
+    global _single_flight
+    if not SINGLE_FLIGHT_ENABLED:
+        return None
+    with _single_flight_lock:
+        if _single_flight is None:
+            _single_flight = SingleFlight()
+        return _single_flight
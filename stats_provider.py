@@ -0,0 +1,106 @@
+# stats_provider.py - إحصائيات النظام تُحدث في الخلفية وتُقرأ فوراً من آخر لقطة
+import os
+import threading
+import time
+
+import requests
+
+from http_transport import get_session, get_timeout
+
+DEFAULT_STATS_URL = os.getenv('STATS_URL', "http://0.0.0.0:5000/api/stats")
+DEFAULT_REFRESH_INTERVAL = float(os.getenv('STATS_REFRESH_INTERVAL', '10'))
+
+
+def summarize_stats(stats):
+    """استخراج المقاييس المعروضة من رد /api/stats"""
+    statistics = stats.get("statistics") or {}
+    mcp = statistics.get("mcp") or {}
+    autogen = statistics.get("autogen") or {}
+    superagent = statistics.get("superagent") or {}
+    crewai = statistics.get("crewai") or {}
+    semantic_kernel = statistics.get("semanticKernel") or {}
+    return {
+        "totalAgents": stats.get("totalAgents", 0),
+        "systemHealth": stats.get("systemHealth"),
+        "activeAgents": mcp.get("activeAgents", 0),
+        "totalTasksProcessed": mcp.get("totalTasksProcessed", 0),
+        "averageSuccessRate": mcp.get("averageSuccessRate"),
+        "activeChats": autogen.get("activeChats", 0),
+        "totalWorkflows": superagent.get("totalWorkflows", 0),
+        "totalCrews": crewai.get("totalCrews", 0),
+        "crewExecutions": crewai.get("totalExecutions", 0),
+        "availableSkills": semantic_kernel.get("availableSkills", 0),
+        "agentsByFramework": {
+            "MCP": mcp.get("totalAgents", 0),
+            "AutoGen": autogen.get("totalAgents", 0),
+            "SuperAgent": superagent.get("totalAgents", 0),
+            "CrewAI": crewai.get("totalAgents", 0),
+            "Semantic Kernel": semantic_kernel.get("totalAgents", 0)
+        }
+    }
+
+
+class StatsProvider:
+    """يجلب /api/stats في خيط خلفي كل interval ثانية ويقدم آخر لقطة مع عمرها
+
+    القراءة لا تنتظر الشبكة أبداً، لذلك لا تتأخر إعادة تشغيل Streamlit بسبب بطء خادم Node.
+    """
+
+    def __init__(self, url=None, interval=None, session=None):
+        self.url = url or DEFAULT_STATS_URL
+        self.interval = interval or DEFAULT_REFRESH_INTERVAL
+        self.session = session or get_session()
+        self.timeout = get_timeout(connect_timeout=2, read_timeout=5)
+        self._snapshot = None
+        self._fetched_at = None
+        self._error = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def refresh(self):
+        """جلب الإحصائيات مرة واحدة وتحديث اللقطة"""
+        try:
+            response = self.session.get(self.url, timeout=self.timeout)
+            response.raise_for_status()
+            snapshot = summarize_stats(response.json())
+            with self._lock:
+                self._snapshot = snapshot
+                self._fetched_at = time.time()
+                self._error = None
+        except (requests.exceptions.RequestException, ValueError) as e:
+            with self._lock:
+                self._error = str(e)
+
+    def _loop(self):
+        while not self._stop.is_set():
+            self.refresh()
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def snapshot(self):
+        """آخر لقطة: {"stats", "age", "error"}؛ stats تكون None قبل أول جلب ناجح"""
+        with self._lock:
+            age = time.time() - self._fetched_at if self._fetched_at else None
+            return {"stats": self._snapshot, "age": age, "error": self._error}
+
+
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_stats_provider():
+    """المزود المشترك على مستوى العملية (خيط تحديث واحد لجميع الجلسات)"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            _provider = StatsProvider().start()
+        return _provider
@@ -0,0 +1,209 @@
+# stub_server.py - خادم Blackbox وهمي محلي لقياس الأداء دون اتصال: زمن استجابة قابل للضبط، بث، وحقن أخطاء و429
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_RESPONSE_TEXT = "def fibonacci(n):\n    a, b = 0, 1\n    for _ in range(n):\n        a, b = b, a + b\n    return a\n"
+
+
+def parse_latency(spec):
+    """تحويل وصف توزيع زمن الاستجابة إلى دالة تُرجع ثوانٍ
+
+    fixed:0.05 | uniform:0.02,0.2 | normal:0.1,0.02 | lognormal:-2.5,0.5 (معاملات ln للثواني)
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(value) for value in args.split(",") if value]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"توزيع زمن غير معروف: {spec}")
+
+
+class StubConfig:
+    """إعدادات سلوك الخادم الوهمي
+
+    latency: وصف التوزيع لزمن أول بايت (انظر parse_latency)
+    error_rate / rate_limit_rate: نسبة الطلبات التي تُرد بـ 500 أو 429 (مع Retry-After)
+    stream_chunks / chunk_delay: عدد أجزاء البث والفاصل بينها بالثواني
+    seed: بذرة المولد العشوائي لتكرار نفس التسلسل بين التشغيلات
+    """
+
+    def __init__(self, latency="fixed:0.05", error_rate=0.0, rate_limit_rate=0.0, retry_after=0,
+                 stream_chunks=20, chunk_delay=0.005, response_text=DEFAULT_RESPONSE_TEXT, seed=0):
+        self.latency = parse_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.stream_chunks = stream_chunks
+        self.chunk_delay = chunk_delay
+        self.response_text = response_text
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self.requests = 0
+
+    def draw(self):
+        """سحب (زمن الانتظار، حالة الحقن) لطلب جديد"""
+        with self._lock:
+            self.requests += 1
+            delay = self.latency(self._rng)
+            roll = self._rng.random()
+        if roll < self.rate_limit_rate:
+            return delay, 429
+        if roll < self.rate_limit_rate + self.error_rate:
+            return delay, 500
+        return delay, 200
+
+    def chunks(self):
+        """تقسيم نص الرد إلى stream_chunks أجزاء"""
+        size = max(1, -(-len(self.response_text) // self.stream_chunks))
+        return [self.response_text[start:start + size] for start in range(0, len(self.response_text), size)]
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # الترويسات والجسم يُكتبان منفصلين: مع Nagle وتأخير ACK لدى العميل ينتظر الجسم ~40ms في كل رد
+    disable_nagle_algorithm = True
+    config = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_sse(self, events):
+        """إرسال أحداث SSE بترميز chunked مع chunk_delay بين الأجزاء"""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for index, event in enumerate(events):
+            if index:
+                time.sleep(self.config.chunk_delay)
+            data = f"data: {event}\n\n".encode("utf-8")
+            self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+            self.wfile.flush()
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _usage(self, payload):
+        prompt = " ".join(str(message.get("content", "")) for message in payload.get("messages", []))
+        return {
+            "prompt_tokens": len(prompt.split()),
+            "completion_tokens": len(self.config.response_text.split())
+        }
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        data = self.rfile.read(length)
+        # مثل server.js: الأجسام الكبيرة تصل مضغوطة بـ gzip (serialization.py)
+        if self.headers.get("Content-Encoding") == "gzip":
+            data = zlib.decompress(data, 31)
+        payload = json.loads(data or b"{}")
+        delay, status = self.config.draw()
+        time.sleep(delay)
+
+        if status == 429:
+            self._send_json(429, {"error": "rate limited"}, {"Retry-After": str(self.config.retry_after)})
+        elif status != 200:
+            self._send_json(status, {"error": "injected failure"})
+        elif self.path.endswith("/chat/completions"):
+            self._chat_completions(payload)
+        elif self.path == "/api/blackbox/code":
+            self._proxy_code(payload)
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def _chat_completions(self, payload):
+        if payload.get("stream"):
+            events = [json.dumps({"choices": [{"delta": {"content": chunk}}]}) for chunk in self.config.chunks()]
+            events.append(json.dumps({"choices": [{"delta": {}}], "usage": self._usage(payload)}))
+            events.append("[DONE]")
+            self._send_sse(events)
+            return
+        self._send_json(200, {
+            "choices": [{"message": {"role": "assistant", "content": self.config.response_text}}],
+            "usage": self._usage(payload)
+        })
+
+    def _proxy_code(self, payload):
+        # نفس شكل رد server.js على /api/blackbox/code
+        if payload.get("stream"):
+            events = [json.dumps({"choices": [{"delta": {"content": chunk}}]}) for chunk in self.config.chunks()]
+            events.append("[DONE]")
+            self._send_sse(events)
+            return
+        self._send_json(200, {
+            "success": True,
+            "result": {"response": self.config.response_text},
+            "action": payload.get("action")
+        })
+
+
+class _StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # إغلاق العميل للاتصال (مثل تجاوز مجمع الاتصالات) متوقع أثناء القياس
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+def start_stub_server(config=None, host="127.0.0.1", port=0):
+    """تشغيل الخادم الوهمي في خيط خلفي وإرجاع الخادم (المنفذ في server.server_address[1])"""
+    handler = type("StubHandler", (_StubHandler,), {"config": config or StubConfig()})
+    server = _StubServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="خادم Blackbox وهمي لقياس الأداء")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--latency", default="fixed:0.05")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=float, default=0)
+    parser.add_argument("--stream-chunks", type=int, default=20)
+    parser.add_argument("--chunk-delay", type=float, default=0.005)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        latency=args.latency,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        retry_after=args.retry_after,
+        stream_chunks=args.stream_chunks,
+        chunk_delay=args.chunk_delay,
+        seed=args.seed
+    )
+    server = start_stub_server(config, args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f"🧪 الخادم الوهمي يعمل على http://{host}:{port} (BLACKBOX_BASE_URL=http://{host}:{port}/v1)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()